@@ -0,0 +1,178 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from datetime import datetime
+
+
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Computes the sha256 hash of a file content. Hashes are memoized by path, size and modification time,
+    so repeated lookups of unchanged files do not read them again.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        str: The hex digest of the file content.
+    """
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _file_hashes_lock:
+        if memo_key in _file_hashes:
+            return _file_hashes[memo_key]
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    with _file_hashes_lock:
+        _file_hashes[memo_key] = digest.hexdigest()
+    return _file_hashes[memo_key]
+
+
+class ArtifactStore:
+    """A content-addressed store of pipeline stage outputs. Every stage output is kept in a folder keyed
+        by the hash of the stage name, its input files content and its parameters, next to a manifest."""
+
+    def __init__(self, root: str = "results/artifacts") -> None:
+        """
+        Args:
+            root (str, optional): The path to the store folder. Defaults to "results/artifacts".
+        """
+        self.root = root
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+
+    def get_key(self, stage: str, input_paths=(), params=None) -> str:
+        """
+        Computes the key of a stage output.
+
+        Args:
+            stage (str): The stage name.
+            input_paths (iterable, optional): The paths to the stage input files.
+            params (dict, optional): The stage parameters, must be JSON serializable.
+
+        Returns:
+            str: The hex digest identifying the stage output.
+        """
+        description = {
+            "stage": stage,
+            "inputs": [hash_file(path) for path in input_paths],
+            "params": params or {},
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def get_artifact_dir(self, key: str) -> str:
+        """Returns the folder of the stage output with the provided key."""
+        return os.path.join(self.root, "objects", key[:2], key)
+
+    def lookup(self, key: str):
+        """
+        Looks up a stored stage output.
+
+        Args:
+            key (str): The stage output key.
+
+        Returns:
+            dict: The output names mapped to stored file paths, or None if the output is not stored.
+        """
+        artifact_dir = self.get_artifact_dir(key)
+        manifest_path = os.path.join(artifact_dir, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        return {name: os.path.join(artifact_dir, filename) for name, filename in manifest["outputs"].items()}
+
+    def create_staging_dir(self) -> str:
+        """Creates an empty folder where a stage writes its outputs before they are published."""
+        return tempfile.mkdtemp(dir=os.path.join(self.root, "tmp"))
+
+    def publish(self, key: str, stage: str, staging_dir: str, outputs: dict, input_paths=(), params=None) -> dict:
+        """
+        Moves stage outputs from a staging folder into the store and writes their manifest.
+
+        Args:
+            key (str): The stage output key.
+            stage (str): The stage name.
+            staging_dir (str): The folder with the stage outputs.
+            outputs (dict): The output names mapped to file names inside the staging folder.
+            input_paths (iterable, optional): The paths to the stage input files.
+            params (dict, optional): The stage parameters.
+
+        Returns:
+            dict: The output names mapped to stored file paths.
+
+        Raises:
+            FileNotFoundError: If the stage did not write any of its outputs.
+        """
+        for filename in outputs.values():
+            if not os.path.exists(os.path.join(staging_dir, filename)):
+                raise FileNotFoundError(f"Stage '{stage}' did not produce {filename}")
+
+        manifest = {
+            "key": key,
+            "stage": stage,
+            "inputs": {os.path.abspath(path): hash_file(path) for path in input_paths},
+            "params": params or {},
+            "outputs": outputs,
+            "created": datetime.now().isoformat(),
+        }
+        with open(os.path.join(staging_dir, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=4)
+
+        artifact_dir = self.get_artifact_dir(key)
+        os.makedirs(os.path.dirname(artifact_dir), exist_ok=True)
+        try:
+            os.replace(staging_dir, artifact_dir)
+        except OSError:
+            # Another run has published the same output in the meantime
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        return self.lookup(key)
+
+    def run_stage(self, stage: str, outputs: dict, produce, input_paths=(), params=None, reproducible=True) -> dict:
+        """
+        Returns stored stage outputs, running the stage only if they are not stored yet.
+
+        Outputs of stages which are not reproducible (e.g. generation with a random seed or picked by the
+        user) are not determined by inputs and parameters, so such stages always run and their outputs
+        are additionally keyed by their own content.
+
+        Args:
+            stage (str): The stage name.
+            outputs (dict): The output names mapped to file names the stage writes.
+            produce (callable): The function running the stage, called with the folder to write outputs to.
+            input_paths (iterable, optional): The paths to the stage input files.
+            params (dict, optional): The stage parameters.
+            reproducible (bool, optional): Whether the stage outputs are determined by its inputs and
+                parameters. Defaults to True.
+
+        Returns:
+            dict: The output names mapped to stored file paths.
+        """
+        if reproducible:
+            key = self.get_key(stage, input_paths, params)
+            artifacts = self.lookup(key)
+            if artifacts is not None:
+                print(f"Reusing stored {stage} outputs ({key[:12]})")
+                return artifacts
+
+        staging_dir = self.create_staging_dir()
+        try:
+            produce(staging_dir)
+            if not reproducible:
+                output_paths = [os.path.join(staging_dir, filename) for filename in outputs.values()]
+                key = self.get_key(stage, list(input_paths) + output_paths, params)
+            return self.publish(key, stage, staging_dir, outputs, input_paths, params)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
@@ -0,0 +1,155 @@
+import os
+import json
+import argparse
+import subprocess
+from artifact_store import ArtifactStore
+from stages import run_child_process
+
+
+# The face ratios of the levels of detail, from the original model to the coarsest one
+LOD_RATIOS = [1.0, 0.25, 0.05]
+# The minimum projected object size in pixels of every level of detail
+LOD_MIN_PIXELS = [256, 64, 0]
+# import_3d_model resizes objects by 0.85 * depth_value, and the camera frames 2 units of height
+MAX_OBJECT_SCALE = 0.85
+FRAME_HEIGHT = 2.0
+
+
+def preprocess_asset(object_path, artifact_store=None, ratios=LOD_RATIOS, cached_only=False):
+    """
+    Exports the levels of detail of a 3D model with background Blender, once per model content.
+
+    Args:
+        object_path (str): The path to the 3D model file.
+        artifact_store (ArtifactStore, optional): The store keeping the levels of detail. Defaults to the
+            store in "results/artifacts".
+        ratios (list, optional): The face ratios of the levels of detail. Defaults to LOD_RATIOS.
+        cached_only (bool, optional): Whether to only return levels of detail which were already exported,
+            without running Blender. Defaults to False.
+
+    Returns:
+        dict: The object bounding box ("bbox_min", "bbox_max") and its "lods", each with its face "ratio",
+            number of "faces", "fbx" path and preview "mesh" path, or None if cached_only is set and the
+            levels of detail were not exported yet.
+    """
+    artifact_store = artifact_store or ArtifactStore(os.path.join("results", "artifacts"))
+
+    def export(output_dir):
+        script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "export_lods.py")
+        command = ["blender", "-b", "-P", script_path, "--", os.path.abspath(object_path), output_dir,
+                   "--ratios"] + [str(ratio) for ratio in ratios]
+        run_child_process(command, stdout=subprocess.DEVNULL)
+
+    outputs = {"lods": "lods.json"}
+    for index, ratio in enumerate(ratios):
+        outputs[f"mesh_{index}"] = f"lod_{index}.npz"
+        if ratio < 1.0:
+            outputs[f"fbx_{index}"] = f"lod_{index}.fbx"
+    params = {"ratios": list(ratios)}
+    if cached_only:
+        artifacts = artifact_store.lookup(artifact_store.get_key("lods", [object_path], params))
+        if artifacts is None:
+            return None
+    else:
+        artifacts = artifact_store.run_stage("lods", outputs, export, input_paths=[object_path], params=params)
+
+    with open(artifacts["lods"], "r") as f:
+        lods = json.load(f)
+    for index, lod in enumerate(lods["lods"]):
+        lod["fbx"] = artifacts[f"fbx_{index}"] if lod["fbx"] else object_path
+        lod["mesh"] = artifacts[f"mesh_{index}"]
+    return lods
+
+
+def get_projected_size(lods, depth_value, image_height):
+    """
+    Computes the largest extent of the placed object in pixels, as seen by the orthographic camera.
+
+    Args:
+        lods (dict): The levels of detail returned by preprocess_asset.
+        depth_value (float): The normalized depth value at the placement point.
+        image_height (int): The rendered image height.
+
+    Returns:
+        float: The projected object size in pixels.
+    """
+    extent = max(high - low for low, high in zip(lods["bbox_min"], lods["bbox_max"]))
+    return extent * MAX_OBJECT_SCALE * depth_value / FRAME_HEIGHT * image_height
+
+
+def select_lod(lods, depth_value, image_height, min_pixels=LOD_MIN_PIXELS):
+    """
+    Selects the coarsest level of detail which is still detailed enough for the projected object size.
+
+    Args:
+        lods (dict): The levels of detail returned by preprocess_asset.
+        depth_value (float): The normalized depth value at the placement point.
+        image_height (int): The rendered image height.
+        min_pixels (list, optional): The minimum projected size in pixels of every level of detail.
+            Defaults to LOD_MIN_PIXELS.
+
+    Returns:
+        dict: The selected level of detail.
+    """
+    projected_size = get_projected_size(lods, depth_value, image_height)
+    for lod, lod_min_pixels in zip(lods["lods"], min_pixels):
+        if projected_size >= lod_min_pixels:
+            return lod
+    return lods["lods"][-1]
+
+
+def get_object_lod_path(object_path, depth_value, image_height, artifact_store=None, cached_only=False):
+    """
+    Returns the level of detail of a 3D model to import for a placement, falling back to the original model
+    if the levels of detail cannot be exported.
+
+    Interactive runs pass cached_only, so a render never waits for the export: their levels of detail are
+    exported up front with the asset_preprocess.py CLI, or by the preview of the object.
+
+    Args:
+        object_path (str): The path to the 3D model file.
+        depth_value (float): The normalized depth value at the placement point.
+        image_height (int): The rendered image height.
+        artifact_store (ArtifactStore, optional): The store keeping the levels of detail.
+        cached_only (bool, optional): Whether to fall back to the original model instead of exporting
+            levels of detail which were not exported yet. Defaults to False.
+
+    Returns:
+        str: The path to the 3D model file to import.
+    """
+    try:
+        lods = preprocess_asset(object_path, artifact_store, cached_only=cached_only)
+        if lods is None:
+            print(f"Levels of detail of {object_path} are not exported yet, run asset_preprocess.py to export them")
+            return object_path
+        lod = select_lod(lods, depth_value, image_height)
+        print(f"Using the {lod['ratio']:.0%} level of detail ({lod['faces']} faces) of {object_path}")
+        return lod["fbx"]
+    except Exception as exc:
+        print(f"Error while preparing levels of detail: {exc}")
+        return object_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export decimated levels of detail of 3D models and show which one a placement uses."
+    )
+    parser.add_argument("--object_paths", type=str, nargs="+", required=True, help="Paths to the 3D objects")
+    parser.add_argument("--depth_value", type=float, default=None, help="Normalized depth value of a placement")
+    parser.add_argument("--image_height", type=int, default=1024, help="Rendered image height")
+    args = parser.parse_args()
+
+    for object_path in args.object_paths:
+        try:
+            lods = preprocess_asset(object_path)
+        except Exception as exc:
+            print(f"Error while preparing levels of detail of {object_path}: {exc}")
+            continue
+
+        print(object_path)
+        for lod in lods["lods"]:
+            print(f"  {lod['ratio']:>6.0%} {lod['faces']:>9} faces  {lod['fbx']}")
+        if args.depth_value is not None:
+            projected_size = get_projected_size(lods, args.depth_value, args.image_height)
+            lod = select_lod(lods, args.depth_value, args.image_height)
+            print(f"  Projected size {projected_size:.0f} px, using the {lod['ratio']:.0%} level of detail")
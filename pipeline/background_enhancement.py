@@ -4,6 +4,8 @@ import cv2
 import argparse
 import numpy as np
 from PIL import Image
+from tracing import span
+from sh_lighting import generate_sh_lighting
 
 
 def image_to_hdri(image: np.ndarray, scale: float = 1) -> np.ndarray:
@@ -61,7 +63,8 @@ def generate_hdri_from_existing_image(image_path, output_path, scale=1):
           raise an exception.
     """
     # Load the existing image
-    existing_image = cv2.imread(image_path)
+    with span("hdri.read"):
+        existing_image = cv2.imread(image_path)
 
     # Check if the image is loaded successfully
     if existing_image is None:
@@ -69,13 +72,15 @@ def generate_hdri_from_existing_image(image_path, output_path, scale=1):
     
     try:
         # Generate HDRI from the existing image
-        hdri_image = image_to_hdri(existing_image, scale=scale)
+        with span("hdri.generate"):
+            hdri_image = image_to_hdri(existing_image, scale=scale)
 
         # Encode the enhanced image data in PNG format
-        hdri_image = cv2.imencode(".png", hdri_image)[1]
+        with span("hdri.encode"):
+            hdri_image = cv2.imencode(".png", hdri_image)[1]
         
         # Save the enhanced image to a file named as the provided output file name
-        with open(output_path, "wb") as f:
+        with span("hdri.write"), open(output_path, "wb") as f:
             f.write(hdri_image)
 
         return hdri_image
@@ -104,6 +109,14 @@ if __name__ == '__main__':
         required=False,
         help="Output image directory."
     )
+    parser.add_argument(
+        "--lighting",
+        type=str,
+        default="hdri",
+        choices=["hdri", "sh"],
+        help="Write the full HDRI image, or the spherical harmonics lighting (a small JSON file and "
+             "prefiltered environment map) which blender.py accepts in place of the HDRI image."
+    )
     args = parser.parse_args()
 
     image_path = args.input_image_path
@@ -111,9 +124,11 @@ if __name__ == '__main__':
 
     if args.output_dir:
         output_dir = args.output_dir
-        output_hdri_path = os.path.join(output_dir, f"{os.path.basename(root)}_hdri{ext}")
+        root = os.path.join(output_dir, os.path.basename(root))
     else:
         output_dir = os.path.join(os.path.dirname(image_path), "results")
-        output_hdri_path =  f"{root}_hdri{ext}"
 
-    generate_hdri_from_existing_image(image_path=image_path, output_path=output_hdri_path)
+    if args.lighting == "sh":
+        generate_sh_lighting(image_path, f"{root}_lighting.json")
+    else:
+        generate_hdri_from_existing_image(image_path=image_path, output_path=f"{root}_hdri{ext}")
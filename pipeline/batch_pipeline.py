@@ -0,0 +1,567 @@
+import os
+import json
+import hashlib
+import argparse
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PIL import Image
+from depth_loader import DepthMap
+from depthToNormal import DepthToNormalMap
+from artifact_store import ArtifactStore, hash_file
+from asset_preprocess import get_object_lod_path
+from render_scheduler import RenderScheduler
+from sd_client import StableDiffusionClient, decode_image
+from tracing import start_trace, finish_trace, span
+
+
+# The job keys which decide the job results, the default job id is derived from them
+JOB_RESULT_KEYS = (
+    "prompt", "scene_image", "depth_map", "invert_depth", "object_path", "points", "seed", "negative_prompt",
+    "width", "height", "steps", "sampler_name", "cfg_scale", "checkpoint",
+)
+JOB_FILE_KEYS = ("scene_image", "depth_map", "object_path")
+
+
+def normalize_job(job, base_dir, description="Job"):
+    """
+    Validates a composition job and normalises its "points" and paths in place.
+
+    Args:
+        job (dict): The job, see load_manifest for its keys.
+        base_dir (str): The directory relative paths are resolved against.
+        description (str, optional): How the job is referred to in errors. Defaults to "Job".
+
+    Returns:
+        dict: The job.
+
+    Raises:
+        ValueError: If the job misses any of the required keys or its points are not [x, y] pairs.
+    """
+    if "prompt" not in job and "scene_image" not in job:
+        raise ValueError(f"{description} needs either a 'prompt' or a 'scene_image'")
+    if "object_path" not in job:
+        raise ValueError(f"{description} needs an 'object_path'")
+
+    points = job.get("points", [job["point"]] if "point" in job else [])
+    if not points:
+        raise ValueError(f"{description} needs at least one placement point")
+    if not isinstance(points, list) or any(not isinstance(point, (list, tuple)) or len(point) != 2 for point in points):
+        raise ValueError(f"{description} has invalid placement points, expected [x, y] pairs")
+    job["points"] = [(int(point[0]), int(point[1])) for point in points]
+
+    for key in JOB_FILE_KEYS:
+        if job.get(key):
+            job[key] = os.path.join(base_dir, job[key])
+    return job
+
+
+def check_points(points, width, height, description="Job"):
+    """
+    Checks that the placement points lie on an image, the normal and depth at every point are read from it.
+
+    Args:
+        points (list): The normalised (x, y) placement points.
+        width (int): The image width.
+        height (int): The image height.
+        description (str, optional): How the job is referred to in errors. Defaults to "Job".
+
+    Raises:
+        ValueError: If a point lies outside of the image.
+    """
+    for x, y in points:
+        if not (0 <= x < width and 0 <= y < height):
+            raise ValueError(f"{description} has the placement point ({x}, {y}) outside of the {width}x{height} image")
+
+
+def get_job_id(job, file_hashes=None, occurrence=1):
+    """
+    Returns the default id of a normalised job, a hash of everything its results depend on. The id names
+    the job results folder, so resumed runs only reuse the results of the same job, wherever it is listed.
+
+    Args:
+        job (dict): The normalised job.
+        file_hashes (dict, optional): The content hashes of job files by job key, used instead of hashing
+            the files at the job paths. Files that do not exist are identified by their path.
+        occurrence (int, optional): The number of the job among identical jobs, identical jobs with a random
+            seed are still separate jobs. Defaults to 1.
+
+    Returns:
+        str: The job id.
+    """
+    file_hashes = file_hashes or {}
+    fields = {}
+    for key in JOB_RESULT_KEYS:
+        if job.get(key) is None:
+            continue
+        value = job[key]
+        if key in file_hashes:
+            value = file_hashes[key]
+        elif key in JOB_FILE_KEYS and os.path.exists(value):
+            value = hash_file(value)
+        fields[key] = value
+
+    digest = hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()[:12]
+    return f"job_{digest}" if occurrence == 1 else f"job_{digest}_{occurrence}"
+
+
+def load_manifest(manifest_path):
+    """
+    Reads composition jobs from a JSONL manifest, one job per line.
+
+    Every job needs an "object_path", the placement "points" (or a single "point") and either a "prompt"
+    or a "scene_image". Optional keys are "id", "depth_map", "invert_depth", "seed", "negative_prompt",
+    "width", "height", "steps", "sampler_name", "cfg_scale" and "checkpoint". Relative paths are resolved
+    against the manifest directory. Jobs without an "id" get one derived from their content.
+
+    Args:
+        manifest_path (str): The path to the JSONL manifest file.
+
+    Returns:
+        list: The jobs as dictionaries with normalised "id", "points" and paths.
+
+    Raises:
+        ValueError: If a job misses any of the required keys.
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    occurrences = {}
+
+    with open(manifest_path, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+
+            job = normalize_job(json.loads(line), base_dir, f"Job on line {line_number}")
+            if "id" not in job:
+                job_id = get_job_id(job)
+                occurrences[job_id] = occurrences.get(job_id, 0) + 1
+                job["id"] = get_job_id(job, occurrence=occurrences[job_id])
+            jobs.append(job)
+
+    return jobs
+
+
+class BatchRunner:
+    """A class representing a headless version of the pipeline, which runs composition jobs from a
+        manifest through all stages with bounded parallelism."""
+
+    def __init__(
+        self, output_folder_path, workers=2, depth_workers=1, render_workers=1, normals_workers=2,
+        sd_url="http://localhost:7860", generation_settings=None,
+        marigold_checkpoint="prs-eth/marigold-lcm-v1-0", enable_gpu=False, use_lods=True, depth_mode="full",
+        lighting="sh", depth_model=None
+    ):
+        """
+        Args:
+            output_folder_path (str): The path to the folder where every job gets its own results folder.
+            workers (int, optional): The number of jobs processed concurrently. Defaults to 2.
+            depth_workers (int, optional): The number of concurrent Marigold runs. Defaults to 1.
+            render_workers (int, optional): The number of concurrent Blender runs, each one on its own
+                partition of the CPU cores. Defaults to 1.
+            normals_workers (int, optional): The number of concurrent normal map calculations. Defaults to 2.
+            sd_url (str, optional): The automatic1111 url. Defaults to "http://localhost:7860".
+            generation_settings (dict, optional): The default scene generation settings (negative_prompt,
+                width, height, steps, sampler_name, cfg_scale, checkpoint), overridable per job.
+            marigold_checkpoint (str, optional): The Marigold model checkpoint.
+                Defaults to "prs-eth/marigold-lcm-v1-0".
+            enable_gpu (bool, optional): Whether Blender renders with GPU. Defaults to False.
+            use_lods (bool, optional): Whether objects are rendered with the level of detail matching their
+                projected size. Defaults to True.
+            depth_mode (str, optional): "full" runs Marigold at its default processing resolution, "fast"
+                runs it at a reduced resolution and upsamples the depth map guided by the scene image.
+                Defaults to "full".
+            lighting (str, optional): "sh" lights the renders with spherical harmonics computed from the scene
+                image, "hdri" with the full HDRI image of the scene image. Defaults to "sh".
+            depth_model (DepthModel, optional): A Marigold model kept loaded across jobs. Defaults to None,
+                which estimates the depth of every job in its own Marigold process.
+
+        Attributes:
+            max_depth (int): The maximum depth value used in depth-to-normal conversion.
+            stage_limits (dict): The semaphores bounding the concurrency of the heavy stages.
+            render_scheduler (RenderScheduler): The scheduler running Blender renders on core partitions.
+            chrome_trace_path (str): The path to the Chrome trace of the last run.
+            artifact_store (ArtifactStore): The store of the object levels of detail.
+        """
+        self.output_folder_path = output_folder_path
+        self.workers = workers
+        self.sd_url = sd_url
+        self.generation_settings = {
+            "negative_prompt": "",
+            "width": 1024,
+            "height": 1024,
+            "steps": 30,
+            "sampler_name": "DPM++ 2M Karras",
+            "cfg_scale": 7,
+            "checkpoint": "juggernautXL_v7Rundiffusion.safetensors [0724518c6b]",
+        }
+        self.generation_settings.update(generation_settings or {})
+        self.marigold_checkpoint = marigold_checkpoint
+        self.enable_gpu = enable_gpu
+        self.use_lods = use_lods
+        self.depth_mode = depth_mode
+        self.lighting = lighting
+        self.depth_model = depth_model
+        self.max_depth = 255
+        self.artifact_store = ArtifactStore(os.path.join(output_folder_path, "artifacts"))
+
+        self.stage_limits = {
+            "scene": threading.Semaphore(1),
+            "depth": threading.Semaphore(depth_workers),
+            "normals": threading.Semaphore(normals_workers),
+        }
+        self.render_scheduler = RenderScheduler(render_workers)
+        self.chrome_trace_path = None
+        self._sd_client = None
+        self._sd_client_lock = threading.Lock()
+
+    @property
+    def sd_client(self):
+        """The automatic1111 client, created on first use so that jobs with scene images do not need it."""
+        with self._sd_client_lock:
+            if self._sd_client is None:
+                self._sd_client = StableDiffusionClient(self.sd_url)
+            return self._sd_client
+
+    def get_job_folder(self, job):
+        """Returns the results folder of the job."""
+        return os.path.join(self.output_folder_path, job["id"])
+
+    def get_render_path(self, job, point):
+        """Returns the path of the rendered image for a job placement point."""
+        x, y = point
+        return os.path.join(self.get_job_folder(job), f"render_{x}_{y}.png")
+
+    def get_image_size(self, job):
+        """
+        Returns the width and height of the job images, which the depth map shares with the scene image.
+
+        Raises:
+            ValueError: If the depth map or the scene image of the job cannot be read.
+        """
+        if job.get("depth_map"):
+            height, width = DepthMap(job["depth_map"]).shape
+            return width, height
+        if job.get("scene_image"):
+            try:
+                # Only the image header is read
+                with Image.open(job["scene_image"]) as image:
+                    return image.size
+            except OSError:
+                raise ValueError(f"Unable to load image from {job['scene_image']}")
+        return (job.get("width", self.generation_settings["width"]),
+                job.get("height", self.generation_settings["height"]))
+
+    def is_completed(self, job):
+        """Checks whether renders for all placement points of the job already exist."""
+        return all(os.path.exists(self.get_render_path(job, point)) for point in job["points"])
+
+    def get_scene_image(self, job, job_folder):
+        """Returns the job scene image path, generating the image from the job prompt if needed."""
+        if job.get("scene_image"):
+            return job["scene_image"]
+
+        scene_image_path = os.path.join(job_folder, "scene.png")
+        if os.path.exists(scene_image_path):
+            return scene_image_path
+
+        settings = {key: job.get(key, value) for key, value in self.generation_settings.items()}
+        with self.stage_limits["scene"], span("batch.scene_generation", job=job["id"]):
+            scene_img = self.sd_client.txt2img(
+                job["prompt"], settings["negative_prompt"], settings["width"], settings["height"],
+                settings["steps"], settings["sampler_name"], settings["cfg_scale"], job.get("seed", -1),
+                settings["checkpoint"]
+            )[0]
+        # The image is written under a temporary name, so a resumed run never finds a partial image
+        temporary_path = f"{scene_image_path}.tmp"
+        decode_image(scene_img).save(temporary_path, format="PNG")
+        os.replace(temporary_path, scene_image_path)
+        return scene_image_path
+
+    def get_depth_map(self, job, job_folder, scene_image_path):
+        """Returns the job depth map path, estimating the depth map with Marigold if needed, with the shared
+            depth model if there is one."""
+        if job.get("depth_map"):
+            if not job.get("invert_depth"):
+                return job["depth_map"]
+
+            inverted_depth_path = os.path.join(job_folder, "depth_inverted.png")
+            if not os.path.exists(inverted_depth_path):
+                depth = DepthMap(job["depth_map"])
+                depth.invert()
+                temporary_path = os.path.join(job_folder, "depth_inverted.tmp.png")
+                depth.save(temporary_path)
+                os.replace(temporary_path, inverted_depth_path)
+            return inverted_depth_path
+
+        root, ext = os.path.splitext(os.path.basename(scene_image_path))
+        depth_map_path = os.path.join(job_folder, f"{root}_depth{ext}")
+        if not os.path.exists(depth_map_path):
+            with self.stage_limits["depth"], span("batch.depth", job=job["id"]):
+                if self.depth_model is not None:
+                    self.depth_model.estimate(scene_image_path, job_folder, self.depth_mode)
+                else:
+                    args = [
+                        "python",
+                        "depth_estimation_marigold.py",
+                        "--checkpoint", self.marigold_checkpoint,
+                        "--input_image_path", scene_image_path,
+                        "--output_dir", job_folder,
+                        "--depth_mode", self.depth_mode,
+                    ]
+                    subprocess.run(args, check=True)
+        return depth_map_path
+
+    def get_hdri_image(self, job, job_folder, scene_image_path):
+        """Returns the job HDRI image or lighting file path, generating it from the scene image if needed."""
+        root, ext = os.path.splitext(os.path.basename(scene_image_path))
+        if self.lighting == "sh":
+            hdri_image_path = os.path.join(job_folder, f"{root}_lighting.json")
+        else:
+            hdri_image_path = os.path.join(job_folder, f"{root}_hdri{ext}")
+        if not os.path.exists(hdri_image_path):
+            args = [
+                "python",
+                "background_enhancement.py",
+                "--input_image_path", scene_image_path,
+                "--output_dir", job_folder,
+                "--lighting", self.lighting
+            ]
+            with span("batch.hdri", job=job["id"]):
+                subprocess.run(args, check=True)
+        return hdri_image_path
+
+    def get_object_path(self, job, depth_value, image_height):
+        """Returns the job 3D object path, or the path to its level of detail matching the projected size."""
+        if not self.use_lods:
+            return job["object_path"]
+        with span("batch.lods", job=job["id"]):
+            return get_object_lod_path(job["object_path"], depth_value, image_height, self.artifact_store)
+
+    def render(self, job, scene_image_path, depth_map_path, hdri_image_path, object_path, point, normal_to_surface,
+               depth_value):
+        """Calls Blender for scene generation and object placement at one of the job points."""
+        output_path = self.get_render_path(job, point)
+        command = [
+            "blender",
+            "-b",
+            "-P",
+            "blender.py",
+            "--",
+            depth_map_path,
+            scene_image_path,
+            hdri_image_path,
+            object_path,
+            str(point[0]),
+            str(point[1]),
+            str(normal_to_surface[0]),
+            str(normal_to_surface[1]),
+            str(normal_to_surface[2]),
+            str(depth_value),
+            str(self.enable_gpu),
+            "--output_path", os.path.abspath(output_path),
+            "--snapshot_dir", os.path.join(self.output_folder_path, "blend_snapshots")
+        ]
+        with span("batch.render", job=job["id"], point=list(point)):
+            self.render_scheduler.run(command, check=True)
+
+        if not os.path.exists(output_path):
+            raise RuntimeError(f"Blender did not render {output_path}")
+
+    def run_job(self, job, progress=None):
+        """
+        Runs a single job through all pipeline stages, skipping stages whose outputs already exist.
+
+        Args:
+            job (dict): The job.
+            progress (callable, optional): Called with the stage name and its details whenever a stage
+                starts, and with "rendered" and the render path whenever a render is done.
+        """
+        progress = progress or (lambda stage, **details: None)
+        job_folder = self.get_job_folder(job)
+        os.makedirs(job_folder, exist_ok=True)
+
+        progress("scene")
+        scene_image_path = self.get_scene_image(job, job_folder)
+        progress("depth")
+        depth_map_path = self.get_depth_map(job, job_folder, scene_image_path)
+        progress("lighting")
+        hdri_image_path = self.get_hdri_image(job, job_folder, scene_image_path)
+
+        progress("normals")
+        with self.stage_limits["normals"], span("batch.normals", job=job["id"]):
+            depth_to_normal_converter = DepthToNormalMap(depth_map_path, max_depth=self.max_depth)
+            depth_to_normal_converter.calculate_normals()
+        # Points outside of the depth map would read the normal and depth of the opposite image side
+        height, width = depth_to_normal_converter.depth_map.shape
+        check_points(job["points"], width, height, f"Job {job['id']}")
+
+        for point in job["points"]:
+            render_path = self.get_render_path(job, point)
+            if os.path.exists(render_path):
+                progress("rendered", point=list(point), path=render_path)
+                continue
+
+            x, y = point
+            progress("render", point=list(point))
+            normal_to_surface = depth_to_normal_converter.normals_map[y, x]
+            depth_value = depth_to_normal_converter.depth_map[y, x]
+            object_path = self.get_object_path(job, depth_value, depth_to_normal_converter.depth_map.shape[0])
+            self.render(job, scene_image_path, depth_map_path, hdri_image_path, object_path, point,
+                        normal_to_surface, depth_value)
+            progress("rendered", point=list(point), path=render_path)
+
+    def run(self, jobs):
+        """
+        Runs all jobs which are not completed yet.
+
+        Args:
+            jobs (list): The jobs read from the manifest.
+
+        Returns:
+            list: The ids of the failed jobs.
+        """
+        startTime = datetime.now()
+
+        # Spans of every stage, including child processes and Blender, are collected into one trace
+        trace_name = startTime.strftime("%Y-%m-%d-%H-%M-%S")
+        trace_path = os.path.join(self.output_folder_path, "traces", f"{trace_name}.jsonl")
+        start_trace(trace_path)
+
+        try:
+            pending_jobs = [job for job in jobs if not self.is_completed(job)]
+            print(f"Skipping {len(jobs) - len(pending_jobs)} of {len(jobs)} jobs with existing results")
+
+            failed_jobs = []
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {executor.submit(self.run_job, job): job for job in pending_jobs}
+                for future in as_completed(futures):
+                    job = futures[future]
+                    try:
+                        future.result()
+                        print(f"Job {job['id']} has been completed!")
+                    except Exception as exc:
+                        failed_jobs.append(job["id"])
+                        print(f"Error while running job {job['id']}: {exc}")
+        finally:
+            self.chrome_trace_path = os.path.join(self.output_folder_path, "traces", f"{trace_name}.json")
+            finish_trace(trace_path, self.chrome_trace_path)
+            print("Batch trace saved as", self.chrome_trace_path)
+        self.render_scheduler.print_report()
+        print(f"Completed {len(pending_jobs) - len(failed_jobs)} jobs, {len(failed_jobs)} failed")
+        print("Batch run time:", datetime.now() - startTime)
+        return failed_jobs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run composition jobs from a JSONL manifest without any interaction."
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        help="JSONL manifest with one job per line",
+        required=True
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        help="Output directory with a results folder per job",
+        required=False,
+        default="results/batch"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of jobs processed concurrently",
+        required=False,
+        default=2
+    )
+    parser.add_argument(
+        "--depth_workers",
+        type=int,
+        help="Number of concurrent Marigold depth estimations",
+        required=False,
+        default=1
+    )
+    parser.add_argument(
+        "--render_workers",
+        type=int,
+        help="Number of concurrent Blender renders",
+        required=False,
+        default=1
+    )
+    parser.add_argument(
+        "--normals_workers",
+        type=int,
+        help="Number of concurrent normal map calculations",
+        required=False,
+        default=2
+    )
+    parser.add_argument(
+        "--sd_url",
+        type=str,
+        help="automatic1111 url, used for jobs with a prompt",
+        required=False,
+        default="http://localhost:7860"
+    )
+    parser.add_argument(
+        "--marigold_checkpoint",
+        type=str,
+        help="Marigold checkpoint path or hub name",
+        required=False,
+        default="prs-eth/marigold-lcm-v1-0",
+        choices=[
+            "prs-eth/marigold-lcm-v1-0",
+            "prs-eth/marigold-v1-0",
+            "Bingxin/Marigold"
+        ]
+    )
+    parser.add_argument(
+        "--depth_mode",
+        type=str,
+        help="Marigold depth mode, 'fast' infers depth at a reduced resolution and upsamples it guided by "
+             "the scene image",
+        required=False,
+        default="full",
+        choices=["full", "fast"]
+    )
+    parser.add_argument(
+        "--lighting",
+        type=str,
+        help="Light the renders with spherical harmonics computed from the scene image ('sh'), or with the "
+             "full HDRI image of the scene image ('hdri')",
+        required=False,
+        default="sh",
+        choices=["sh", "hdri"]
+    )
+    parser.add_argument(
+        "--enable_gpu",
+        action="store_true",
+        help="Render with GPU in Blender"
+    )
+    parser.add_argument(
+        "--no_lods",
+        action="store_true",
+        help="Render objects at full detail instead of the level of detail matching their projected size"
+    )
+    args = parser.parse_args()
+
+    runner = BatchRunner(
+        args.output_dir,
+        workers=args.workers,
+        depth_workers=args.depth_workers,
+        render_workers=args.render_workers,
+        normals_workers=args.normals_workers,
+        sd_url=args.sd_url,
+        marigold_checkpoint=args.marigold_checkpoint,
+        enable_gpu=args.enable_gpu,
+        use_lods=not args.no_lods,
+        depth_mode=args.depth_mode,
+        lighting=args.lighting
+    )
+    failed_jobs = runner.run(load_manifest(args.manifest))
+    if failed_jobs:
+        print("Failed jobs:", ", ".join(failed_jobs))
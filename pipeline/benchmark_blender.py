@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+
+# The stand-in bpy module has to be found before a real one, blender.py imports it at module level
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_bpy"))
+import bpy
+import blender
+
+
+def get_blender_argv(depth_map_path, texture_image_path, hdri_image_path, object_path, point, normal, depth_value,
+                     output_dir, frames=1, camera_path="orbit", snapshot_dir=None):
+    """Returns the Blender command line the pipelines use to call blender.py."""
+    snapshot_args = ["--snapshot_dir", snapshot_dir] if snapshot_dir else []
+    return [
+        "blender", "-b", "-P", "blender.py", "--",
+        depth_map_path, texture_image_path, hdri_image_path, object_path,
+        str(point[0]), str(point[1]), str(normal[0]), str(normal[1]), str(normal[2]), str(depth_value), "false",
+        "--output_path", os.path.join(output_dir, "render.png"), "--output_dir", output_dir,
+        "--frames", str(frames), "--camera_path", camera_path,
+    ] + snapshot_args
+
+
+def benchmark_scene_building(argv, runs):
+    """
+    Builds and renders the blender.py scene with the stand-in bpy module several times. With a snapshot
+    folder in the command line, the first run saves the scene snapshot and the others open it.
+
+    Args:
+        argv (list): The Blender command line.
+        runs (int): The number of runs.
+
+    Returns:
+        dict: The wall times of argument parsing and of blender.main in seconds, the cost counters of the
+            last run and the placed object.
+    """
+    parse_times, main_times = [], []
+    for _ in range(runs):
+        bpy.reset_data()
+        start = time.perf_counter()
+        args = blender.parse_arguments(argv)
+        parse_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        blender.main(args)
+        main_times.append(time.perf_counter() - start)
+
+    placed_object = next(obj for obj in bpy.context.scene.objects if obj.name not in ("Plane", "Camera"))
+    return {
+        "runs": runs,
+        "parse_arguments_s": float(np.median(parse_times)),
+        "main_s": float(np.median(main_times)),
+        "main_p95_s": float(np.percentile(main_times, 95)),
+        "counters": bpy.get_stats(),
+        "object": {
+            "location": list(placed_object.location),
+            "rotation_euler": [float(angle) for angle in placed_object.rotation_euler],
+            "scale": list(placed_object.scale),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the blender.py scene building without Blender, using the stand-in bpy module "
+                    "in fake_bpy, and report the operator, vertex and data-block counts."
+    )
+    parser.add_argument("--depth_map", type=str, default="../depth_maps/depth_map0.png", help="Path to the depth map")
+    parser.add_argument("--texture_image", type=str, default=None,
+                        help="Path to the scene image (defaults to the depth map)")
+    parser.add_argument("--hdri_image", type=str, default=None,
+                        help="Path to the HDRI image or the lighting JSON file (defaults to the scene image)")
+    parser.add_argument("--object_path", type=str, default="../3d_objects/worm.fbx", help="Path to the 3D object")
+    parser.add_argument("--point", type=int, nargs=2, default=[512, 512], metavar=("X", "Y"), help="Placement point")
+    parser.add_argument("--normal", type=float, nargs=3, default=[0.1, -0.9, 0.4], metavar=("X", "Y", "Z"),
+                        help="Surface normal at the placement point")
+    parser.add_argument("--depth_value", type=float, default=0.5, help="Depth value at the placement point")
+    parser.add_argument("--frames", type=int, default=1, help="Number of animation frames")
+    parser.add_argument("--camera_path", type=str, default="orbit", choices=["orbit", "dolly"], help="Camera path")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs")
+    parser.add_argument("--snapshots", action="store_true",
+                        help="Reuse a scene snapshot saved by the first run, like repeated placements do")
+    parser.add_argument("--output", type=str, default=None, help="Output path of the benchmark report JSON")
+    args = parser.parse_args()
+
+    texture_image = args.texture_image or args.depth_map
+    hdri_image = args.hdri_image or texture_image
+    try:
+        # The animation timings written by blender.py go to a folder which is removed afterwards
+        with tempfile.TemporaryDirectory() as output_dir:
+            snapshot_dir = os.path.join(output_dir, "snapshots") if args.snapshots else None
+            argv = get_blender_argv(args.depth_map, texture_image, hdri_image, args.object_path, args.point,
+                                    args.normal, args.depth_value, output_dir, args.frames, args.camera_path,
+                                    snapshot_dir)
+            report = benchmark_scene_building(argv, args.runs)
+    except Exception as exc:
+        print(f"Error while benchmarking the scene building: {exc}")
+        sys.exit(1)
+
+    counters = report["counters"]
+    print(f"parse_arguments: {report['parse_arguments_s'] * 1000:.2f} ms, "
+          f"main: {report['main_s'] * 1000:.1f} ms (p95 {report['main_p95_s'] * 1000:.1f} ms)")
+    print(f"Operators: {sum(counters['operators'].values())}")
+    for name, count in sorted(counters["operators"].items(), key=lambda item: -item[1]):
+        print(f"  {name:<28} {count:>5}")
+    print(f"Data-API writes: {counters['data_sets']}")
+    print(f"Data-blocks created: {sum(counters['datablocks_created'].values())} {counters['datablocks_created']}")
+    print(f"Data-blocks removed: {sum(counters['datablocks_removed'].values())} {counters['datablocks_removed']}")
+    print(f"Mesh vertices created: {counters['mesh_vertices_created']}")
+    print(f"Image pixels loaded: {counters['image_pixels_loaded']}")
+    print(f"Snapshots saved: {counters['files_saved']}, opened: {counters['files_opened']}")
+    print(f"Rendered frames: {counters['rendered_frames']}, pixels: {counters['render_pixels']}, "
+          f"evaluated vertices: {counters['evaluated_vertices']}")
+    print(f"Object location {report['object']['location']}, rotation {report['object']['rotation_euler']}, "
+          f"scale {report['object']['scale']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,176 @@
+import os
+import json
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from PIL import Image
+from datetime import datetime
+from fake_sd_server import start_server
+from batch_pipeline import BatchRunner, load_manifest
+
+
+class BenchmarkRunner(BatchRunner):
+    """A BatchRunner for CPU-only benchmark machines, where Marigold depth estimation and Blender rendering
+        can be left out and replaced by a fixed depth map and no render."""
+
+    def __init__(self, output_folder_path, stages, depth_map_path=None, **kwargs):
+        """
+        Args:
+            output_folder_path (str): The path to the folder where every job gets its own results folder.
+            stages (list): The optional stages to run, any of "depth" and "render".
+            depth_map_path (str, optional): The depth map used by all jobs when "depth" is not run.
+            **kwargs: The BatchRunner arguments.
+        """
+        # Levels of detail are exported with Blender, so they are only used when rendering
+        kwargs.setdefault("use_lods", "render" in stages)
+        super().__init__(output_folder_path, **kwargs)
+        self.stages = stages
+        self.depth_map_path = depth_map_path
+
+    def get_depth_map(self, job, job_folder, scene_image_path):
+        if "depth" in self.stages:
+            return super().get_depth_map(job, job_folder, scene_image_path)
+        return self.depth_map_path
+
+    def render(self, job, scene_image_path, depth_map_path, hdri_image_path, object_path, point, normal_to_surface,
+               depth_value):
+        if "render" in self.stages:
+            super().render(job, scene_image_path, depth_map_path, hdri_image_path, object_path, point,
+                           normal_to_surface, depth_value)
+
+
+def write_manifest(manifest_path, num_jobs, points_per_job, point_range, object_path):
+    """Writes a manifest of prompt jobs with deterministic seeds and placement points."""
+    rng = np.random.default_rng(0)
+    with open(manifest_path, "w") as f:
+        for index in range(num_jobs):
+            points = [[int(rng.integers(0, point_range[0])), int(rng.integers(0, point_range[1]))]
+                      for _ in range(points_per_job)]
+            job = {
+                "id": f"benchmark_{index:04d}",
+                "prompt": f"benchmark scene number {index}",
+                "seed": index,
+                "object_path": object_path,
+                "points": points,
+            }
+            f.write(json.dumps(job) + "\n")
+
+
+def summarize_trace(chrome_trace_path):
+    """
+    Aggregates the spans of a Chrome trace per stage.
+
+    Returns:
+        dict: The span names mapped to their count, total, mean and 95th percentile wall time in seconds,
+            and mean CPU time in seconds.
+    """
+    with open(chrome_trace_path, "r") as f:
+        events = [event for event in json.load(f)["traceEvents"] if event["ph"] == "X"]
+
+    stages = {}
+    for event in events:
+        stages.setdefault(event["name"], []).append(event)
+
+    summary = {}
+    for name, stage_events in sorted(stages.items()):
+        wall_times = np.array([event["dur"] / 1e6 for event in stage_events])
+        cpu_times = np.array([event["args"]["cpu_time_s"] for event in stage_events])
+        summary[name] = {
+            "count": len(stage_events),
+            "total_s": float(wall_times.sum()),
+            "mean_s": float(wall_times.mean()),
+            "p95_s": float(np.percentile(wall_times, 95)),
+            "mean_cpu_s": float(cpu_times.mean()),
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the non-interactive pipeline end to end against a stand-in automatic1111 API."
+    )
+    parser.add_argument("--jobs", type=int, default=8, help="Number of jobs")
+    parser.add_argument("--points_per_job", type=int, default=2, help="Number of placement points per job")
+    parser.add_argument("--width", type=int, default=512, help="Generated image width")
+    parser.add_argument("--height", type=int, default=512, help="Generated image height")
+    parser.add_argument("--steps", type=int, default=30, help="Number of generation steps")
+    parser.add_argument("--workers", type=int, default=2, help="Number of jobs processed concurrently")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fixed latency of every txt2img call (s)")
+    parser.add_argument("--step_latency", type=float, default=0.0, help="Latency of every generation step (s)")
+    parser.add_argument(
+        "--stages",
+        type=str,
+        nargs="*",
+        default=[],
+        choices=["depth", "render"],
+        help="Optional stages to run, they need Marigold and Blender to be installed"
+    )
+    parser.add_argument(
+        "--depth_map",
+        type=str,
+        default="../depth_maps/depth_map0.png",
+        help="Depth map used by all jobs when the depth stage is not run"
+    )
+    parser.add_argument(
+        "--object_path",
+        type=str,
+        default="../3d_objects/worm.fbx",
+        help="3D object placed by all jobs"
+    )
+    parser.add_argument("--output", type=str, default=None, help="Output path of the benchmark report JSON")
+    args = parser.parse_args()
+
+    server = start_server(port=0, latency=args.latency, step_latency=args.step_latency)
+    sd_url = f"http://127.0.0.1:{server.server_port}"
+
+    output_folder_path = tempfile.mkdtemp(prefix="pipeline_benchmark_")
+    try:
+        if "depth" in args.stages:
+            point_range = (args.width, args.height)
+        else:
+            point_range = Image.open(args.depth_map).size
+
+        manifest_path = os.path.join(output_folder_path, "manifest.jsonl")
+        write_manifest(manifest_path, args.jobs, args.points_per_job, point_range,
+                       os.path.abspath(args.object_path))
+
+        runner = BenchmarkRunner(
+            output_folder_path,
+            args.stages,
+            depth_map_path=os.path.abspath(args.depth_map),
+            workers=args.workers,
+            sd_url=sd_url,
+            generation_settings={"width": args.width, "height": args.height, "steps": args.steps},
+        )
+
+        startTime = datetime.now()
+        failed_jobs = runner.run(load_manifest(manifest_path))
+        wall_time = (datetime.now() - startTime).total_seconds()
+        summary = summarize_trace(runner.chrome_trace_path)
+    finally:
+        server.shutdown()
+        shutil.rmtree(output_folder_path, ignore_errors=True)
+
+    print("----------------------------------------------")
+    print(f"{'stage':<28} {'count':>6} {'total s':>9} {'mean s':>9} {'p95 s':>9} {'cpu s':>9}")
+    for name, stats in summary.items():
+        print(f"{name:<28} {stats['count']:>6} {stats['total_s']:>9.3f} {stats['mean_s']:>9.3f} "
+              f"{stats['p95_s']:>9.3f} {stats['mean_cpu_s']:>9.3f}")
+
+    completed_jobs = args.jobs - len(failed_jobs)
+    print("----------------------------------------------")
+    print(f"Completed jobs: {completed_jobs} of {args.jobs}")
+    print(f"Total wall time: {wall_time:.3f} s")
+    print(f"Throughput: {completed_jobs / wall_time * 60:.2f} jobs/min")
+
+    if args.output:
+        report = {
+            "settings": vars(args),
+            "stages": summary,
+            "completed_jobs": completed_jobs,
+            "wall_time_s": wall_time,
+            "jobs_per_minute": completed_jobs / wall_time * 60,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
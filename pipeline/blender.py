@@ -1,9 +1,22 @@
 import os
 import bpy
 import sys
+import json
+import math
+import time
+import hashlib
+import argparse
 import numpy as np
 from datetime import datetime
 
+# Blender does not add the script folder to the module search path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from tracing import span, traced
+from artifact_store import hash_file
+
+# Part of the snapshot keys, to be increased whenever build_scene changes so older snapshots are not reused
+SNAPSHOT_VERSION = 1
+
 
 def load_image(image_path):
     """Loads an image file into Blender."""
@@ -15,6 +28,7 @@ def load_image(image_path):
         print("Error loading image:", e)
         return None
 
+@traced("blender.clear_scene")
 def clear_scene():
     """Clears the Blender scene by deleting all objects."""
     bpy.ops.object.select_all(action="SELECT")
@@ -43,13 +57,19 @@ def add_camera(aspect_ratio, plane_size_x):
     bpy.context.object.data.type = 'ORTHO'
     bpy.context.object.data.ortho_scale = 2.0 * aspect_ratio if aspect_ratio > 1 else 2.0
 
+@traced("blender.light")
 def add_light(hdri_path):
     """
     Adds an HDRI image as light source.
 
     Args:
-        hdri_path (str): The file path to the HDRI image.
+        hdri_path (str): The file path to the HDRI image, or to a spherical harmonics lighting JSON file
+            written by sh_lighting.py.
     """
+    if hdri_path.endswith(".json"):
+        add_sh_light(hdri_path)
+        return
+
     world = bpy.context.scene.world
     world.use_nodes = True
     node_tree = world.node_tree
@@ -61,6 +81,31 @@ def add_light(hdri_path):
     node_tree.links.new(enode.outputs['Color'], node_tree.nodes['Background'].inputs['Color'])
     node_tree.nodes['Background'].inputs['Strength'].default_value = 1
 
+def add_sh_light(lighting_path):
+    """
+    Adds spherical harmonics lighting as light source: the ambient color, and the small prefiltered
+    environment map if the lighting file names one.
+
+    Args:
+        lighting_path (str): The file path to the lighting JSON file.
+    """
+    with open(lighting_path, "r") as f:
+        lighting = json.load(f)
+
+    world = bpy.context.scene.world
+    world.color = lighting["ambient"]
+    world.use_nodes = True
+    node_tree = world.node_tree
+    background = node_tree.nodes['Background']
+    background.inputs['Color'].default_value = (*lighting["ambient"], 1.0)
+    background.inputs['Strength'].default_value = 1
+
+    environment_map = lighting.get("environment_map")
+    if environment_map:
+        enode = node_tree.nodes.new("ShaderNodeTexEnvironment")
+        enode.image = load_image(os.path.join(os.path.dirname(lighting_path), environment_map))
+        node_tree.links.new(enode.outputs['Color'], background.inputs['Color'])
+
 def adjust_rendering_settings(enable_gpu=False):
     scene = bpy.context.scene
     scene.render.engine = 'BLENDER_WORKBENCH'
@@ -71,6 +116,7 @@ def adjust_rendering_settings(enable_gpu=False):
     scene.view_settings.exposure = 0.5
     scene.render.film_transparent = True
 
+@traced("blender.import_object")
 def import_3d_model(object_path, depth_value):
     """
     Imports a 3D model file into the Blender scene.
@@ -106,6 +152,7 @@ def set_output_path():
     output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../rendered_results/", output_filename)
     return output_path
 
+@traced("blender.render")
 def render_and_save(output_path):
     """
     Renders the scene and saves the image to the specified output path.
@@ -116,6 +163,88 @@ def render_and_save(output_path):
     bpy.context.scene.render.filepath = output_path
     bpy.ops.render.render(write_still=True)
 
+def set_camera_path(camera, aspect_ratio, plane_size_x, frames, camera_path, amplitude):
+    """
+    Keyframes the camera along a looping path around the displaced plane, starting and ending at the
+    still image camera position.
+
+    Args:
+      camera (bpy.types.Object): The scene camera added by add_camera.
+      aspect_ratio (float): The aspect ratio of the depth map.
+      plane_size_x (float): The x coordinate of the plane center.
+      frames (int): The number of frames.
+      camera_path (str): "orbit" swings the orthographic camera around the vertical axis through the plane
+        center by up to amplitude degrees, "dolly" moves a perspective camera with the same framing towards
+        the plane by up to amplitude units.
+      amplitude (float): The orbit angle in degrees or the dolly distance.
+    """
+    scene = bpy.context.scene
+    scene.frame_start = 1
+    scene.frame_end = frames
+    distance = 3.0
+    center = (plane_size_x, 0.0, 1.0)
+
+    if camera_path == "dolly":
+        # A perspective camera framing the plane like the orthographic one, so moving it creates parallax
+        camera.data.type = 'PERSP'
+        camera.data.sensor_fit = 'AUTO'
+        camera.data.angle = 2 * math.atan(camera.data.ortho_scale / 2 / distance)
+
+    for frame in range(1, frames + 1):
+        t = (frame - 1) / frames
+        if camera_path == "orbit":
+            angle = math.radians(amplitude) * math.sin(2 * math.pi * t)
+            camera.location = (center[0] + distance * math.sin(angle), center[1] - distance * math.cos(angle),
+                               center[2])
+            camera.rotation_euler = (1.5708, 0, angle)
+        else:
+            # Eases in and out of the closest position and back, without a velocity jump at the loop start
+            push = amplitude * (1 - math.cos(2 * math.pi * t)) / 2
+            camera.location = (center[0], center[1] - distance + push, center[2])
+            camera.rotation_euler = (1.5708, 0, 0)
+        camera.keyframe_insert(data_path="location", frame=frame)
+        camera.keyframe_insert(data_path="rotation_euler", frame=frame)
+
+@traced("blender.render_animation")
+def render_animation(output_dir):
+    """
+    Renders all frames of the scene as an image sequence and saves the render time of every frame.
+
+    Args:
+      output_dir (str): The folder where the frames and timings.json are saved.
+    """
+    scene = bpy.context.scene
+    frame_timings = {}
+    frame_starts = {}
+
+    def on_render_pre(scene, *args):
+        frame_starts[scene.frame_current] = time.perf_counter()
+
+    def on_render_write(scene, *args):
+        frame = scene.frame_current
+        frame_timings[frame] = time.perf_counter() - frame_starts[frame]
+
+    bpy.app.handlers.render_pre.append(on_render_pre)
+    bpy.app.handlers.render_write.append(on_render_write)
+    startTime = time.perf_counter()
+    try:
+        # The scene is built once, only the camera moves between frames
+        scene.render.filepath = os.path.join(output_dir, "frame_")
+        bpy.ops.render.render(animation=True)
+    finally:
+        bpy.app.handlers.render_pre.remove(on_render_pre)
+        bpy.app.handlers.render_write.remove(on_render_write)
+
+    timings = {
+        "frames": [
+            {"frame": frame, "path": f"frame_{frame:04d}.png", "render_s": frame_timings.get(frame)}
+            for frame in range(scene.frame_start, scene.frame_end + 1)
+        ],
+        "total_s": time.perf_counter() - startTime,
+    }
+    with open(os.path.join(output_dir, "timings.json"), "w") as f:
+        json.dump(timings, f, indent=4)
+
 def move_object(obj_name, x, z, image_width, image_height, ratio):
     """Moves imported 3D object to previously selected place."""
     obj_list = bpy.context.scene.objects
@@ -139,15 +268,143 @@ def rotate_object(obj_name, normal_vector):
 
     model_3D.rotation_euler = (current_rotation_x, rotation_angle_rad, current_rotation_z)
 
-def main():
-    """The main function orchestrating the creation of a Blender scene."""
+def parse_arguments(argv):
+    """
+    Parses the script arguments passed after '--' on the Blender command line.
+
+    Args:
+      argv (list): The full Blender command line arguments.
+
+    Returns:
+      argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog="blender -P blender.py --",
+        description="Create a 2.5D scene from a depth map and place a 3D object in it."
+    )
+    parser.add_argument("depth_map_path", type=str, help="Path to the depth map")
+    parser.add_argument("texture_image_path", type=str, help="Path to the scene (texture) image")
+    parser.add_argument("hdri_image_path", type=str, help="Path to the HDRI image or the lighting JSON file")
+    parser.add_argument("model_3d_path", type=str, help="Path to the 3D object")
+    parser.add_argument("x_coord", type=int, help="X coordinate of the placement point")
+    parser.add_argument("z_coord", type=int, help="Z (image y) coordinate of the placement point")
+    parser.add_argument("x_norm", type=float, help="X component of the surface normal")
+    parser.add_argument("y_norm", type=float, help="Y component of the surface normal")
+    parser.add_argument("z_norm", type=float, help="Z component of the surface normal")
+    parser.add_argument("depth_value", type=float, help="Depth value at the placement point")
+    parser.add_argument("enable_gpu", type=str, help="Whether GPU rendering is enabled (true/false)")
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default=None,
+        help="Path of the rendered image (defaults to a timestamped file in rendered_results)"
+    )
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=1,
+        help="Number of animation frames, more than one renders an image sequence along the camera path"
+    )
+    parser.add_argument(
+        "--camera_path",
+        type=str,
+        default="orbit",
+        choices=["orbit", "dolly"],
+        help="Camera path of animations"
+    )
+    parser.add_argument(
+        "--path_amplitude",
+        type=float,
+        default=None,
+        help="Orbit angle in degrees (default 8) or dolly distance (default 0.5) of animations"
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default=None,
+        help="Folder of the animation frames (defaults to a timestamped folder in rendered_results)"
+    )
+    parser.add_argument(
+        "--snapshot_dir",
+        type=str,
+        default=None,
+        help="Folder of the prepared scene snapshots (.blend), keyed by the depth map, scene image and lighting "
+             "content, so repeated placements into a scene only import and transform the object"
+    )
+    script_args = argv[argv.index("--") + 1:] if "--" in argv else []
+    return parser.parse_args(script_args)
+
+def get_snapshot_path(snapshot_dir, depth_map_path, texture_image_path, hdri_image_path):
+    """
+    Returns the path of the scene snapshot of a depth map, scene image and lighting combination, keyed by
+    the content of the files.
+
+    Args:
+        snapshot_dir (str): The folder of the snapshots.
+        depth_map_path (str): The path to the depth map.
+        texture_image_path (str): The path to the scene image.
+        hdri_image_path (str): The path to the HDRI image or the lighting JSON file.
+
+    Returns:
+        str: The path of the .blend snapshot, which may not exist yet.
+    """
+    input_paths = [depth_map_path, texture_image_path, hdri_image_path]
+    if hdri_image_path.endswith(".json"):
+        with open(hdri_image_path, "r") as f:
+            environment_map = json.load(f).get("environment_map")
+        if environment_map:
+            input_paths.append(os.path.join(os.path.dirname(hdri_image_path), environment_map))
+
+    digest = hashlib.sha256(f"scene v{SNAPSHOT_VERSION}".encode())
+    for path in input_paths:
+        digest.update(hash_file(path).encode())
+    return os.path.join(snapshot_dir, f"scene_{digest.hexdigest()[:16]}.blend")
+
+@traced("blender.save_snapshot")
+def save_snapshot(snapshot_path):
+    """Saves the current scene with its images packed, so the snapshot does not depend on the input files."""
+    os.makedirs(os.path.dirname(os.path.abspath(snapshot_path)), exist_ok=True)
+    bpy.ops.file.pack_all()
+    # Concurrent renders of the same scene may save the same snapshot, each one replaces it atomically
+    root, ext = os.path.splitext(snapshot_path)
+    temp_path = f"{root}.{os.getpid()}{ext}"
+    bpy.ops.wm.save_as_mainfile(filepath=os.path.abspath(temp_path), copy=True)
+    os.replace(temp_path, snapshot_path)
+
+@traced("blender.open_snapshot")
+def open_snapshot(snapshot_path):
+    """
+    Opens a scene snapshot.
+
+    Returns:
+        tuple: The width and height of the depth map the scene was built from.
+    """
+    bpy.ops.wm.open_mainfile(filepath=os.path.abspath(snapshot_path))
+    render = bpy.context.scene.render
+    return render.resolution_x, render.resolution_y
+
+@traced("blender.build_scene")
+def build_scene(depth_map_path, texture_image_path, hdri_image_path):
+    """
+    Builds the part of the scene which is the same for all placements into a scene image: the displaced
+    and textured plane, the camera and the lighting.
+
+    Args:
+        depth_map_path (str): The path to the depth map.
+        texture_image_path (str): The path to the scene image.
+        hdri_image_path (str): The path to the HDRI image or the lighting JSON file.
+
+    Returns:
+        tuple: The width and height of the depth map.
+    """
     # Clear existing objects
     clear_scene()
 
-    # Load the depth image
-    depth_image = load_image(depth_map_path)
-    if not depth_image:
-        sys.exit(1)
+    with span("blender.load_depth"):
+        # Load the depth image
+        depth_image = load_image(depth_map_path)
+        if not depth_image:
+            sys.exit(1)
 
     # Calculate image dimensions and aspect ratio
     image_width, image_height = get_image_dimensions(depth_image)
@@ -157,51 +414,55 @@ def main():
     plane_size_x = aspect_ratio
     plane_size_y = 1
 
-    # Add a plane with the calculated size
-    bpy.ops.mesh.primitive_plane_add(size=2, enter_editmode=False, scale=(1, 1, 1))
-    bpy.context.object.scale[0] = aspect_ratio
-    bpy.ops.object.editmode_toggle()
-    # Subdivide the plane for smoother deformation
-    bpy.ops.mesh.subdivide(number_cuts=100)
-
-    # Add a displace modifier and a new texture
-    displace_modifier = bpy.context.object.modifiers.new(name="Displace", type='DISPLACE')
-    displace_texture = bpy.data.textures.new("DisplaceTexture", type='IMAGE')
-    displace_modifier.texture = displace_texture
-    displace_texture.image = depth_image
-    # Set the strength of the Displace modifier
-    displace_modifier.strength = 0.8
-
-    # Switch to Edit mode and perform a Shade smooth of the object
-    bpy.ops.object.editmode_toggle()
-    bpy.ops.object.shade_smooth()
+    with span("blender.subdivide"):
+        # Add a plane with the calculated size
+        bpy.ops.mesh.primitive_plane_add(size=2, enter_editmode=False, scale=(1, 1, 1))
+        bpy.context.object.scale[0] = aspect_ratio
+        bpy.ops.object.editmode_toggle()
+        # Subdivide the plane for smoother deformation
+        bpy.ops.mesh.subdivide(number_cuts=100)
+
+    with span("blender.displace"):
+        # Add a displace modifier and a new texture
+        displace_modifier = bpy.context.object.modifiers.new(name="Displace", type='DISPLACE')
+        displace_texture = bpy.data.textures.new("DisplaceTexture", type='IMAGE')
+        displace_modifier.texture = displace_texture
+        displace_texture.image = depth_image
+        # Set the strength of the Displace modifier
+        displace_modifier.strength = 0.8
+
+        # Switch to Edit mode and perform a Shade smooth of the object
+        bpy.ops.object.editmode_toggle()
+        bpy.ops.object.shade_smooth()
 
     # Get the active object, rotate and translate it
     obj = bpy.context.active_object
     obj.rotation_euler = (1.5708, 0, 0)
     obj.location = (plane_size_x, 0, 1)
 
-    # Create a new material with a texture image node
-    new_material = bpy.data.materials.new(name="MyMaterial")
-    new_material.use_nodes = True
-    node_tree = bpy.data.materials['MyMaterial'].node_tree
-    texture_node = node_tree.nodes.new('ShaderNodeTexImage')
-    texture_node.location = (-300, 200)
-
-    # Load the texture image and assign it to the texture node
-    texture_image = load_image(texture_image_path)
-    if texture_image:
-        texture_node.image = texture_image
-
-    # Find existing Principled BSDF node and connect Texture node to Principled BSDF node's Base Color input
-    principled_bsdf_node = node_tree.nodes.get("Principled BSDF")
-    node_tree.links.new(texture_node.outputs["Color"], principled_bsdf_node.inputs["Base Color"])
-
-    # apply newly created material to be used by default
-    obj.data.materials.append(new_material)
-
-    # Show texture of an object
-    for area in bpy.context.screen.areas:
+    with span("blender.material"):
+        # Create a new material with a texture image node
+        new_material = bpy.data.materials.new(name="MyMaterial")
+        new_material.use_nodes = True
+        node_tree = bpy.data.materials['MyMaterial'].node_tree
+        texture_node = node_tree.nodes.new('ShaderNodeTexImage')
+        texture_node.location = (-300, 200)
+
+        # Load the texture image and assign it to the texture node
+        texture_image = load_image(texture_image_path)
+        if texture_image:
+            texture_node.image = texture_image
+
+        # Find existing Principled BSDF node and connect Texture node to Principled BSDF node's Base Color input
+        principled_bsdf_node = node_tree.nodes.get("Principled BSDF")
+        node_tree.links.new(texture_node.outputs["Color"], principled_bsdf_node.inputs["Base Color"])
+
+        # apply newly created material to be used by default
+        obj.data.materials.append(new_material)
+
+    # Show texture of an object (there is no screen when Blender runs in background mode)
+    screen_areas = bpy.context.screen.areas if bpy.context.screen else []
+    for area in screen_areas:
         if area.type == 'VIEW_3D':
             area.spaces.active.shading.color_type = 'TEXTURE'
             break
@@ -210,6 +471,35 @@ def main():
     add_camera(aspect_ratio, plane_size_x)
     set_render_resolution(image_width, image_height)
 
+    # add hdri as a light source to the scene
+    add_light(hdri_image_path)
+    return image_width, image_height
+
+@traced("blender.main")
+def main(args):
+    """The main function orchestrating the creation of a Blender scene."""
+    depth_map_path = args.depth_map_path
+    texture_image_path = args.texture_image_path
+    hdri_image_path = args.hdri_image_path
+    model_3d_path = args.model_3d_path
+    object_coordinates = args.x_coord, args.z_coord
+    normal_vector = args.x_norm, args.y_norm, args.z_norm
+    depth_value = args.depth_value
+    enable_gpu = args.enable_gpu.lower() == 'true'
+
+    # Placements into the same scene image reuse the scene, only the object is imported and transformed
+    snapshot_path = None
+    if args.snapshot_dir:
+        snapshot_path = get_snapshot_path(args.snapshot_dir, depth_map_path, texture_image_path, hdri_image_path)
+    if snapshot_path and os.path.exists(snapshot_path):
+        image_width, image_height = open_snapshot(snapshot_path)
+    else:
+        image_width, image_height = build_scene(depth_map_path, texture_image_path, hdri_image_path)
+        if snapshot_path:
+            save_snapshot(snapshot_path)
+    aspect_ratio = image_width / image_height
+    plane_size_x = aspect_ratio
+
     old_objs = set(bpy.context.scene.objects)
     # import selected 3D model
     import_3d_model(model_3d_path, depth_value)
@@ -221,36 +511,31 @@ def main():
     move_object(imported_obj_name[0], x, z, image_width, image_height, aspect_ratio)
     rotate_object(imported_obj_name[0], normal_vector)
 
-    # add hdri as a light source to the scene
-    add_light(hdri_image_path)
-
     # Deselect all the objects
     bpy.ops.object.select_all(action='DESELECT')
 
     # Adjust rendering settings, render the image and save it
     adjust_rendering_settings(enable_gpu=enable_gpu)
-    output_path = set_output_path()
-    render_and_save(output_path)
+    if args.frames > 1:
+        amplitude = args.path_amplitude
+        if amplitude is None:
+            amplitude = 8.0 if args.camera_path == "orbit" else 0.5
+        set_camera_path(bpy.context.scene.camera, aspect_ratio, plane_size_x, args.frames, args.camera_path,
+                        amplitude)
+        output_dir = args.output_dir or os.path.splitext(set_output_path())[0]
+        os.makedirs(output_dir, exist_ok=True)
+        render_animation(output_dir)
+    else:
+        output_path = args.output_path or set_output_path()
+        render_and_save(output_path)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) == 15:
-        depth_map_path = sys.argv[4]
-        texture_image_path = sys.argv[5]
-        hdri_image_path = sys.argv[6]
-        model_3d_path = sys.argv[7]
-        object_coordinates = int(sys.argv[8]), int(sys.argv[9])
-        normal_vector = float(sys.argv[10]), float(sys.argv[11]), float(sys.argv[12])
-        depth_value = float(sys.argv[13])
-        enable_gpu_arg = sys.argv[14]
-        enable_gpu = enable_gpu_arg.lower() == 'true'
-    else:
-        print("Usage: blender -P blender_code.py -- /path/to/your/depth_map /path/to/texture_image /path/to/hdri_image /path/to/3d_object x_coord z_coord x_norm y_norm z_norm depth_value enable_gpu")
-        sys.exit(1)
+    args = parse_arguments(sys.argv)
 
     # Check if the file exists for depth map, texture image, hdri image, and 3D object
-    if not os.path.exists(depth_map_path) or not os.path.exists(texture_image_path) or not os.path.exists(hdri_image_path) or not os.path.exists(model_3d_path):
+    if not os.path.exists(args.depth_map_path) or not os.path.exists(args.texture_image_path) or not os.path.exists(args.hdri_image_path) or not os.path.exists(args.model_3d_path):
         print("Image or object file not found. Check your file paths.")
         sys.exit(1)
 
-    main()
+    main(args)
@@ -1,11 +1,14 @@
 import os
 import cv2
 import subprocess
-import numpy as np
-from PIL import Image
 from datetime import datetime
 from tkinter import filedialog as fd
+from depth_loader import DepthMap
 from depthToNormal import DepthToNormalMap
+from asset_preprocess import get_object_lod_path
+from point_selector import PointSelector
+from preview_renderer import PreviewRenderer, get_preview_mesh
+from tracing import start_trace, finish_trace, span, traced
 
 
 class Pipeline():
@@ -17,29 +20,37 @@ class Pipeline():
         Attributes:
             scene_image_path (str): The path to the selected scene (colored) image file.
             depth_map_path (str): The path to the selected depth map file.
+            depth (DepthMap): The depth map decoded once and shared by the normal and render stages.
             object_3d_path (str): The path to the selected 3D object file.
-            selected_point (tuple): The coordinates of the selected point on the original image.
+            selected_point (tuple): The coordinates of the selected point on the original image, chosen
+                once the normal map is ready.
             max_depth (int): The maximum depth value used in depth-to-normal conversion.
             depth_to_normal_converter (DepthToNormalMap): An instance of DepthToNormalMap class
                 for converting depth maps to normal maps.
+            lighting (str): "sh" lights the render with spherical harmonics computed from the scene image,
+                "hdri" with the full HDRI image of the scene image.
+            use_lods (bool): Whether the object is rendered with the level of detail matching its projected
+                size, if the levels of detail were already exported.
         """
         self.scene_image_path = self.upload_image("Select Scene Image File")
-        self.depth_map_path = self.upload_image("Select Depth Image File")
+        self.depth_map_path = self.upload_image("Select Depth Image File",
+                                                filetypes=[("Depth files", "*.png *.jpg *.jpeg *.npy *.exr")])
         self.object_3d_path = self.upload_3d_object()
-        self.selected_point = self.choose_point(self.scene_image_path)
+        self.selected_point = None
         self.output_folder_path = "results"
         self.max_depth = 255
         self.enable_gpu = False
+        self.lighting = "sh"
+        self.use_lods = True
 
-    def upload_image(self, title):
+    def upload_image(self, title, filetypes=(("Image files", "*.jpg *.jpeg *.png"),)):
         """
-        Prompts the user to select an image (allowed types: jpg, jpeg, png).
+        Prompts the user to select an image (allowed types: jpg, jpeg, png by default).
 
         Returns:
             str: The path to the selected image file.
         """
-        file_path = fd.askopenfilename(title=title,
-                                        filetypes=[("Image files", "*.jpg *.jpeg *.png")])
+        file_path = fd.askopenfilename(title=title, filetypes=list(filetypes))
         return file_path
     
     def upload_3d_object(self):
@@ -53,35 +64,6 @@ class Pipeline():
                                        filetypes=[("Object files", "*.fbx")])
         return file_path
 
-    def choose_point(self, image_path):
-        """
-        Allows the user to select a point on an image.
-
-        Args:
-            image_path (str): The path to the image file.
-
-        Returns:
-            tuple: The coordinates (x, y) of the selected point.
-        """
-        def on_mouse_click(event, x, y, flags, param):
-            """Handles mouse click events."""
-            if event == cv2.EVENT_LBUTTONDOWN:
-                nonlocal point
-                point = (x, y)
-                cv2.destroyAllWindows()
-
-        point = None
-        image = cv2.imread(image_path)
-        window_name = "Select Point"
-
-        cv2.imshow(window_name, image)
-        cv2.setMouseCallback(window_name, on_mouse_click)
-
-        while point is None:
-            cv2.waitKey(100)
-
-        return point
-
     def get_normal_map(self):
         """Calculates normal vectors for the entire image."""
         self.depth_to_normal_converter.calculate_normals()
@@ -92,9 +74,16 @@ class Pipeline():
         self.normal_to_surface = self.depth_to_normal_converter.normals_map[y, x]
         self.depth_value = self.depth_to_normal_converter.depth_map[y, x]
 
+    @traced("pipeline.render")
     def generate_scene(self):
         """Calls Blender for scene generation and object placement."""
         try:
+            self.save_inverted_depth_map()
+            # Small or far away objects are rendered with a decimated level of detail, if it is exported
+            object_path = self.object_3d_path
+            if self.use_lods:
+                object_path = get_object_lod_path(self.object_3d_path, self.depth_value, self.depth.shape[0],
+                                                  cached_only=True)
             command = [
                 "blender",
                 "-P",
@@ -103,47 +92,67 @@ class Pipeline():
                 self.depth_map_path,
                 self.scene_image_path,
                 self.hdri_image_path,
-                self.object_3d_path,
+                object_path,
                 str(self.selected_point[0]),
                 str(self.selected_point[1]),
                 str(self.normal_to_surface[0]),
                 str(self.normal_to_surface[1]),
                 str(self.normal_to_surface[2]),
                 str(self.depth_value),
-                str(self.enable_gpu)
+                str(self.enable_gpu),
+                "--snapshot_dir", os.path.join(self.output_folder_path, "blend_snapshots")
             ]
             subprocess.run(command)
 
         except Exception as exc:
             print(f"Error while generating scene in Blender: {exc}")
 
-    def draw_normal_to_surface(self):
-        """Draws normal vector to the surface at the selected point."""
-        image = cv2.imread(self.scene_image_path)
+    def create_preview_renderer(self):
+        """
+        Prepares the Blender-free placement preview of the selected object.
+
+        Returns:
+            PreviewRenderer: The preview renderer, or None if the object mesh could not be loaded.
+        """
+        try:
+            return PreviewRenderer(self.scene_image_path, self.depth, get_preview_mesh(self.object_3d_path))
+        except Exception as exc:
+            print(f"Error while preparing the placement preview: {exc}")
+            return None
+
+    def draw_placement_preview(self):
+        """Returns the scene image with the placed object preview and the surface normal at the selected point."""
         x, y = self.selected_point
+        if self.preview_renderer is not None:
+            image = self.preview_renderer.render(x, y, self.normal_to_surface, self.depth_value)
+        else:
+            image = cv2.imread(self.scene_image_path)
+
         arrow_length = 50
         end_point = (int(x + arrow_length * self.normal_to_surface[0]), int(y + arrow_length * self.normal_to_surface[1]))
         cv2.arrowedLine(image, (x, y), end_point, (0, 255, 0), thickness=2)
+        return image
 
-        while True:
-            cv2.imshow("Normal to the Surface at the Selected Point", image)
-            key = cv2.waitKey(1) & 0xFF
-
-            if key == ord('r') or key == ord('R'):
-                # Allow user to reselect the point by pressing 'R'
-                cv2.destroyAllWindows()
-                self.selected_point = self.choose_point(self.scene_image_path)
-                self.get_surface_normal_vector(self.selected_point)
-                x, y = self.selected_point
-                image = cv2.imread(self.scene_image_path)
-                end_point = (int(x + arrow_length * self.normal_to_surface[0]), int(y + arrow_length * self.normal_to_surface[1]))
-                cv2.arrowedLine(image, (x, y), end_point, (0, 255, 0), thickness=2)
-
-            # Press 'ESC' or 'Enter' to exit
-            elif key == 27 or key == 13:
-                cv2.destroyAllWindows()
-                break
-
+    @traced("pipeline.normal_preview")
+    def draw_normal_to_surface(self):
+        """Shows the object preview and the surface normal at the selected point, while the depth and
+            surface normal under the cursor are shown live. Clicking moves the point without Blender."""
+        def render_preview(point):
+            self.selected_point = point
+            self.get_surface_normal_vector(point)
+            return self.draw_placement_preview()
+
+        selector = PointSelector(self.scene_image_path, self.depth_to_normal_converter.depth_map,
+                                 self.depth_to_normal_converter.normals_map,
+                                 window_name="Normal to the Surface at the Selected Point")
+        # Closing the window after unpinning keeps the last pinned point, without any it cancels the selection
+        point = selector.select(self.selected_point, render_preview)
+        if point is not None:
+            self.selected_point = point
+        if self.selected_point is not None:
+            self.get_surface_normal_vector(self.selected_point)
+
+    @traced("pipeline.hdri")
     def generate_hdri_image(self):
         """Run HDRI image generation process from the scene image."""
         try:
@@ -151,51 +160,68 @@ class Pipeline():
                 "python",
                 "background_enhancement.py",
                 "--input_image_path", self.scene_image_path,
-                "--output_dir", self.output_folder_path
+                "--output_dir", self.output_folder_path,
+                "--lighting", self.lighting
             ]
             subprocess.run(args, check=True)
 
             root, ext = os.path.splitext(self.scene_image_path)
-            output_hdri_path = os.path.join(self.output_folder_path, f"{os.path.basename(root)}_hdri{ext}")
+            if self.lighting == "sh":
+                output_hdri_path = os.path.join(self.output_folder_path, f"{os.path.basename(root)}_lighting.json")
+            else:
+                output_hdri_path = os.path.join(self.output_folder_path, f"{os.path.basename(root)}_hdri{ext}")
             self.hdri_image_path = output_hdri_path
 
         except Exception as exc:
             print(f"Error while generating HDRI image: {exc}")
 
+    @traced("pipeline.invert_depth")
     def invert_depth_map(self):
-        """Invert depth map image and save it."""
-        depth_image = Image.open(self.depth_map_path)
-        depth_array = np.array(depth_image)
-        inverted_depth_array = np.abs(depth_array - 2**16 - 1)
-        inverted_depth_array_uint16 = inverted_depth_array.astype(np.uint16)
-        inverted_depth_image = Image.fromarray(inverted_depth_array_uint16)
-        
+        """Decode the depth map once and invert it in place."""
+        self.depth = DepthMap(self.depth_map_path)
+        self.depth.invert()
+
+    def save_inverted_depth_map(self):
+        """Save the inverted depth map for Blender, which reads the depth map from disk."""
         image_name = os.path.basename(self.depth_map_path)
         name, ext = os.path.splitext(image_name)
         output_dir = "results"
         
         output_path = os.path.join(output_dir, f"{name}_depth.png")
-        inverted_depth_image.save(output_path)
-        self.depth_map_path = output_path
+        self.depth_map_path = self.depth.save(output_path)
         print("Image saved:", output_path)
 
     def run_pipeline(self):
         """Run the pipeline."""
         startTime = datetime.now()
 
-        if not os.path.exists(self.output_folder_path):
-            os.makedirs(self.output_folder_path)
-
-        self.invert_depth_map()
-        self.depth_to_normal_converter = DepthToNormalMap(self.depth_map_path,
-                                                          max_depth=self.max_depth)
-
-        self.get_normal_map()
-        self.get_surface_normal_vector(self.selected_point)
-        self.draw_normal_to_surface()
-        self.generate_hdri_image()
-        self.generate_scene()
+        # Spans of every stage, including child processes and Blender, are collected into one trace
+        trace_name = startTime.strftime("%Y-%m-%d-%H-%M-%S")
+        trace_path = os.path.join(self.output_folder_path, "traces", f"{trace_name}.jsonl")
+        start_trace(trace_path)
 
+        try:
+            with span("pipeline.run"):
+                if not os.path.exists(self.output_folder_path):
+                    os.makedirs(self.output_folder_path)
+
+                self.invert_depth_map()
+                with span("pipeline.normals"):
+                    self.depth_to_normal_converter = DepthToNormalMap(self.depth,
+                                                                      max_depth=self.max_depth)
+                    self.get_normal_map()
+
+                self.preview_renderer = self.create_preview_renderer()
+                self.draw_normal_to_surface()
+                if self.selected_point is None:
+                    print("Point selection has been cancelled, stopping the pipeline.")
+                    return
+                self.generate_hdri_image()
+                self.generate_scene()
+        finally:
+            chrome_trace_path = os.path.join(self.output_folder_path, "traces", f"{trace_name}.json")
+            finish_trace(trace_path, chrome_trace_path)
+            print("Pipeline trace saved as", chrome_trace_path)
         print("Pipeline run time:", datetime.now() - startTime)
 
 
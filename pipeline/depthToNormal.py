@@ -1,32 +1,148 @@
 import cv2
 import argparse
 import numpy as np
+from depth_loader import DepthMap
+
+
+SMOOTHING_FILTERS = ["gauss", "bilateral", "median", "circular", "none", "plane", "plane_edge"]
+# The Scharr kernel responds with 32 times the depth slope, plane fit slopes are scaled to match
+SCHARR_GAIN = 32
+# Depth jumps between neighboring pixels above this value (in 0-255 depth units) are discontinuities
+EDGE_THRESHOLD = 2.0
+# Weight of discontinuity pixels in the edge-aware plane fit, kept above zero so every window has a fit
+EDGE_WEIGHT = 1e-3
+# The sigma of the 7x7 Gaussian depth filter, a sigma of 0 makes OpenCV use its fixed 7-tap kernel instead
+GAUSS_SIGMA = 1.4
+
+
+def window_sums(integral, radius, shift=(0, 0)):
+    """
+    Sums an image over the (2 * radius + 1) square window around every pixel from its summed-area table,
+    at a constant cost per pixel. Windows are clipped at the image borders.
+
+    Args:
+        integral (numpy.ndarray): The summed-area table of the image, as returned by cv2.integral.
+        radius (int): The window radius in pixels.
+        shift (tuple, optional): The (y, x) offset of the window centers from the pixels. Defaults to (0, 0).
+
+    Returns:
+        numpy.ndarray: The window sums, with the shape of the image.
+    """
+    rows, cols = integral.shape[0] - 1, integral.shape[1] - 1
+    row_start = np.clip(np.arange(rows) + shift[0] - radius, 0, rows)[:, None]
+    row_end = np.clip(np.arange(rows) + shift[0] + radius + 1, 0, rows)[:, None]
+    col_start = np.clip(np.arange(cols) + shift[1] - radius, 0, cols)
+    col_end = np.clip(np.arange(cols) + shift[1] + radius + 1, 0, cols)
+    return (integral[row_end, col_end] - integral[row_start, col_end]
+            - integral[row_end, col_start] + integral[row_start, col_start])
+
+
+def fit_plane_normals(depth, window, weights=None, edge_aware=False, chunk_rows=512):
+    """
+    Fits a least-squares plane depth = a * x + b * y + c to the window around every pixel and returns
+    the plane normals. The plane only depends on window sums of depth and coordinate moments, so the
+    cost per pixel does not grow with the window size.
+
+    The edge-aware fit also tries the four windows which have the pixel in a corner, and keeps the plane
+    with the smallest residual, which is the window on the pixel's side of a depth discontinuity.
+
+    Args:
+        depth (numpy.ndarray): The float32 depth map.
+        window (int): The odd window size in pixels.
+        weights (numpy.ndarray, optional): The per-pixel weights of the fit. Defaults to equal weights.
+        edge_aware (bool, optional): Whether to also fit the corner windows. Defaults to False.
+        chunk_rows (int, optional): The number of rows fitted at once, which bounds the size of the
+            summed-area tables. Defaults to 512.
+
+    Returns:
+        numpy.ndarray: The float32 normal map of shape (H, W, 3).
+    """
+    rows, cols = depth.shape
+    radius = window // 2
+    if weights is None:
+        weights = np.ones_like(depth)
+    shifts = [(0, 0)]
+    if edge_aware:
+        shifts += [(dy, dx) for dy in (-radius, radius) for dx in (-radius, radius)]
+    normals = np.empty((rows, cols, 3), dtype=np.float32)
+
+    for start in range(0, rows, chunk_rows):
+        end = min(rows, start + chunk_rows)
+        # The strip is padded so the shifted windows of its rows are complete
+        pad_start, pad_end = max(0, start - 2 * radius), min(rows, end + 2 * radius)
+        w = weights[pad_start:pad_end].astype(np.float64)
+        z = depth[pad_start:pad_end].astype(np.float64)
+        y, x = np.mgrid[pad_start - start:pad_end - start, 0:cols].astype(np.float64)
+        moments = {
+            name: cv2.integral(image, sdepth=cv2.CV_64F)
+            for name, image in [("1", w), ("x", w * x), ("y", w * y), ("z", w * z), ("xx", w * x * x),
+                                ("yy", w * y * y), ("xy", w * x * y), ("xz", w * x * z),
+                                ("yz", w * y * z), ("zz", w * z * z)]
+        }
+
+        best_slopes, best_residual = None, None
+        for shift in shifts:
+            s = {name: window_sums(integral, radius, shift)[start - pad_start:end - pad_start]
+                 for name, integral in moments.items()}
+            # Weighted covariances of the window, the plane offset c drops out
+            cxx = s["xx"] - s["x"] * s["x"] / s["1"]
+            cyy = s["yy"] - s["y"] * s["y"] / s["1"]
+            cxy = s["xy"] - s["x"] * s["y"] / s["1"]
+            cxz = s["xz"] - s["x"] * s["z"] / s["1"]
+            cyz = s["yz"] - s["y"] * s["z"] / s["1"]
+
+            det = cxx * cyy - cxy * cxy
+            det[det == 0] = np.inf
+            slope_x = (cyy * cxz - cxy * cyz) / det
+            slope_y = (cxx * cyz - cxy * cxz) / det
+            if len(shifts) == 1:
+                best_slopes = slope_x, slope_y
+                break
+
+            # The mean squared distance of the window depths from the plane
+            residual = (s["zz"] - s["z"] * s["z"] / s["1"] - slope_x * cxz - slope_y * cyz) / s["1"]
+            # Windows mostly outside the image fit few pixels too well to compare
+            row_counts = np.clip(np.arange(start, end) + shift[0] + radius + 1, 0, rows) \
+                - np.clip(np.arange(start, end) + shift[0] - radius, 0, rows)
+            col_counts = np.clip(np.arange(cols) + shift[1] + radius + 1, 0, cols) \
+                - np.clip(np.arange(cols) + shift[1] - radius, 0, cols)
+            residual[row_counts[:, None] * col_counts < window * window // 2] = np.inf
+            if best_residual is None:
+                best_slopes, best_residual = (slope_x, slope_y), residual
+            else:
+                better = residual < best_residual
+                best_residual = np.where(better, residual, best_residual)
+                best_slopes = tuple(np.where(better, new, old) for new, old in zip((slope_x, slope_y), best_slopes))
+
+        slope_x, slope_y = (slope * SCHARR_GAIN for slope in best_slopes)
+        strip = np.dstack((-slope_x, -slope_y, np.ones_like(slope_x)))
+        normals[start:end] = strip / np.linalg.norm(strip, axis=2, keepdims=True)
+    return normals
 
 
 class DepthToNormalMap:
     """A class for converting a depth map image to a normal map image."""
 
-    def __init__(self, depth_map_path: str, max_depth: int = 255) -> None:
+    def __init__(self, depth_map_path, max_depth: int = 255, depth_scale: float = 255) -> None:
         """Constructs a DepthToNormalMap object.
 
         Args:
-            depth_map_path (str): The path to the depth map image file.
+            depth_map_path (str or DepthMap): The path to the depth map image file, or an already
+                decoded depth map.
             max_depth (int, optional): The maximum depth value in the depth map image.
                 Defaults to 255.
+            depth_scale (float, optional): The scale of the normalized depth before differentiation, which
+                sets how steep the normals are. Defaults to 255.
 
         Raises:
             ValueError: If the depth map image file cannot be read.
         """
-        self.depth_map = cv2.imread(depth_map_path, cv2.IMREAD_UNCHANGED)
-
-        if self.depth_map is None:
-            raise ValueError(
-                f"Could not read the depth map image file at {depth_map_path}"
-            )
-        # Normalize the depth map to [0, 1]
-        self.depth_map = self.depth_map / 65535
+        if not isinstance(depth_map_path, DepthMap):
+            depth_map_path = DepthMap(depth_map_path)
+        # Normalized [0, 1] float32 view of the decoded depth map
+        self.depth_map = depth_map_path.normalized()
         self.max_depth = max_depth
-        self.scaling_factor = 255
+        self.scaling_factor = depth_scale
         self.clicked_points = []
 
     def circular_filter(self, image, radius):
@@ -38,33 +154,70 @@ class DepthToNormalMap:
         kernel /= np.sum(kernel)
         return cv2.filter2D(image, -1, kernel)
 
-    def calculate_normals(self) -> None:
-        """Calculates normal vectors for the entire image."""
+    def calculate_normals(self, smoothing: str = "gauss", window: int = 9, gauss_sigma: float = GAUSS_SIGMA) -> None:
+        """Calculates normal vectors for the entire image.
+
+        Args:
+            smoothing (str, optional): The filter applied to the depth map before differentiation, one of
+                "gauss", "bilateral", "median", "circular" or "none", or the plane fit estimators "plane"
+                and "plane_edge". Defaults to "gauss".
+            window (int, optional): The window size of the plane fit estimators. Defaults to 9.
+            gauss_sigma (float, optional): The sigma of the "gauss" filter. Defaults to GAUSS_SIGMA.
+        """
+        if smoothing in ("plane", "plane_edge"):
+            self.calculate_plane_normals(window, edge_aware=smoothing == "plane_edge")
+            return
+
         rows, cols = self.depth_map.shape
 
-        x, y = np.meshgrid(np.arange(cols), np.arange(rows))
-        x = x.astype(np.float32)
-        y = y.astype(np.float32)
-        
-        scaled_image = (self.depth_map * self.scaling_factor)
-        depth_float32 = scaled_image.astype(np.float32)
-        depth_float32 = cv2.GaussianBlur(depth_float32, (7, 7), 1.4)
-        # Median Filter 
-        # depth_float32 = cv2.medianBlur(depth_float32, 5)
-        # Bilateral Filter:
-        # depth_float32 = cv2.bilateralFilter(depth_float32, 9, 75, 75)
-        # Circular 
-        # depth_float32 = self.circular_filter(depth_float32, radius=9)
+        depth_float32 = self.depth_map * np.float32(self.scaling_factor)
+        if smoothing == "gauss":
+            depth_float32 = cv2.GaussianBlur(depth_float32, (7, 7), gauss_sigma)
+        elif smoothing == "median":
+            depth_float32 = cv2.medianBlur(depth_float32, 5)
+        elif smoothing == "bilateral":
+            depth_float32 = cv2.bilateralFilter(depth_float32, 9, 75, 75)
+        elif smoothing == "circular":
+            depth_float32 = self.circular_filter(depth_float32, radius=9)
+        elif smoothing != "none":
+            raise ValueError(f"Unknown smoothing filter: {smoothing}")
 
         dx = cv2.Scharr(depth_float32, cv2.CV_32F, 1, 0)
         dy = cv2.Scharr(depth_float32, cv2.CV_32F, 0, 1)
 
-        normal = np.dstack((-dx, -dy, np.ones((rows, cols))))
+        normal = np.dstack((-dx, -dy, np.ones((rows, cols), dtype=np.float32)))
         norm = np.sqrt(np.sum(normal**2, axis=2, keepdims=True))
         normal = np.divide(normal, norm, out=np.zeros_like(normal), where=norm != 0)
 
         self.normals_map = normal
 
+    def calculate_plane_normals(self, window: int = 9, edge_aware: bool = False,
+                                edge_threshold: float = EDGE_THRESHOLD) -> None:
+        """Calculates normal vectors by fitting a plane to the depth of the window around every pixel.
+
+        Args:
+            window (int, optional): The odd window size in pixels. Defaults to 9.
+            edge_aware (bool, optional): Whether to avoid fitting planes across depth discontinuities, by
+                down-weighting discontinuity pixels and fitting the window on the pixel's side of the
+                discontinuity. Defaults to False.
+            edge_threshold (float, optional): The depth jump between neighboring pixels, in 0-255 depth
+                units whatever the depth scale, above which a pixel is at a discontinuity.
+                Defaults to EDGE_THRESHOLD.
+        """
+        depth_float32 = self.depth_map * np.float32(self.scaling_factor)
+
+        weights = None
+        if edge_aware:
+            jumps = np.zeros_like(depth_float32)
+            jumps[:, :-1] = np.abs(np.diff(depth_float32, axis=1))
+            jumps[:-1] = np.maximum(jumps[:-1], np.abs(np.diff(depth_float32, axis=0)))
+            # Both sides of a jump are discontinuity pixels
+            jumps = cv2.dilate(jumps, np.ones((3, 3), np.uint8))
+            scaled_threshold = np.float32(edge_threshold * self.scaling_factor / 255)
+            weights = np.where(jumps > scaled_threshold, np.float32(EDGE_WEIGHT), np.float32(1))
+
+        self.normals_map = fit_plane_normals(depth_float32, window | 1, weights, edge_aware)
+
     def save_normal_map(self, output_path: str):
         """Converts the depth map image to a normal map image.
 
@@ -152,6 +305,19 @@ if __name__ == "__main__":
         default=255,
         help="Maximum depth value (default: 255)"
     )
+    parser.add_argument(
+        "--smoothing",
+        type=str,
+        choices=SMOOTHING_FILTERS,
+        default="gauss",
+        help="Depth smoothing filter or plane fit normal estimator (default: gauss)"
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=9,
+        help="Window size of the plane fit normal estimators (default: 9)"
+    )
     parser.add_argument(
         "--save_normal_map",
         type=str,
@@ -188,7 +354,7 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     converter = DepthToNormalMap(args.input, max_depth=args.max_depth)
-    converter.calculate_normals()
+    converter.calculate_normals(smoothing=args.smoothing, window=args.window)
 
     if args.save_normal_map == "y":
         converter.save_normal_map(args.norm_map_path)
@@ -1,30 +1,24 @@
 import os
-import torch
 import argparse
-import numpy as np
-from PIL import Image
-from diffusers.utils import load_image
-from diffusers import DiffusionPipeline
+import threading
+from tracing import span
+from depth_settings import FAST_PROCESSING_RES
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(
-        description="Run single-image depth estimation using Marigold."
-    )
-    parser.add_argument(
-        "--checkpoint",
-        type=str,
-        default="prs-eth/marigold-lcm-v1-0",
-        choices=["prs-eth/marigold-lcm-v1-0", "prs-eth/marigold-v1-0", "Bingxin/Marigold"],
-        help="Checkpoint path or hub name.",
-    )
-    parser.add_argument(
-        "--input_image_path",
-        type=str,
-        required=True,
-        help="Path to the input image.",
-    )
-    args = parser.parse_args()
+def load_depth_model(checkpoint):
+    """
+    Loads a Marigold pipeline onto the GPU, or onto the CPU if CUDA is not available.
+
+    Args:
+        checkpoint (str): The checkpoint path or hub name.
+
+    Returns:
+        DiffusionPipeline: The loaded Marigold pipeline.
+    """
+    # The model dependencies take seconds to import, so they are only imported once a model is needed
+    with span("marigold.import"):
+        import torch
+        from diffusers import DiffusionPipeline
 
     if torch.cuda.is_available():
         device = torch.device("cuda")
@@ -34,44 +28,88 @@ if __name__ == '__main__':
 
     print(f"device = {device}")
 
-    marigold_checkpoint = args.checkpoint
-    pipe = DiffusionPipeline.from_pretrained(
-        marigold_checkpoint,
-        custom_pipeline="marigold_depth_estimation"
-        # torch_dtype=torch.float16,  # (optional) Run with half-precision (16-bit float).
-        # variant="fp16",             # (optional) Use with `torch_dtype=torch.float16`, to directly load fp16 checkpoint
-    )
-    pipe.to(device)
+    with span("marigold.load_model", checkpoint=checkpoint):
+        pipe = DiffusionPipeline.from_pretrained(
+            checkpoint,
+            custom_pipeline="marigold_depth_estimation"
+            # torch_dtype=torch.float16,  # (optional) Run with half-precision (16-bit float).
+            # variant="fp16",             # (optional) Use with `torch_dtype=torch.float16`, to directly load fp16 checkpoint
+        )
+        pipe.to(device)
+    return pipe
+
+
+def estimate_depth(pipe, img_path, output_dir=None, depth_mode="full", fast_res=FAST_PROCESSING_RES,
+                   processing_res=None, ensemble_size=None):
+    """
+    Estimates the depth map of an image and saves it next to its colorized version.
+
+    Args:
+        pipe (DiffusionPipeline): The Marigold pipeline returned by load_depth_model.
+        img_path (str): The path to the input image.
+        output_dir (str, optional): The output directory. Defaults to the input image directory.
+        depth_mode (str, optional): "full" runs Marigold at its default processing resolution, "fast" runs
+            it at fast_res and upsamples the depth map guided by the image. Defaults to "full".
+        fast_res (int, optional): The processing resolution of the fast depth mode.
+            Defaults to FAST_PROCESSING_RES.
+        processing_res (int, optional): The processing resolution of the full depth mode.
+            Defaults to the Marigold default.
+        ensemble_size (int, optional): The number of inference passes. Defaults to the Marigold default.
+
+    Returns:
+        tuple: The paths to the 16-bit depth map and to the colorized depth map.
+    """
+    import numpy as np
+    from PIL import Image
+    from diffusers.utils import load_image
 
-    img_path = args.input_image_path
-    
     root, ext = os.path.splitext(img_path)
+    if output_dir:
+        root = os.path.join(output_dir, os.path.basename(root))
     output_depth_path =  f"{root}_depth{ext}"
     output_colored_depth_path =  f"{root}_col_depth{ext}"
 
     image: Image.Image = load_image(img_path)
 
-    pipeline_output = pipe(
-        image,                    # Input image.
-        # ----- recommended setting for DDIM version -----
-        # denoising_steps=10,     # (optional) Number of denoising steps of each inference pass. Default: 10.
-        # ensemble_size=10,       # (optional) Number of inference passes in the ensemble. Default: 10.
-        # ------------------------------------------------
-        # ----- recommended setting for LCM version ------
-        # denoising_steps=4,
-        # ensemble_size=5,
-        # -------------------------------------------------
-        # processing_res=768,     # (optional) Maximum resolution of processing. If set to 0: will not resize at all. Defaults to 768.
-        # match_input_res=True,   # (optional) Resize depth prediction to match input resolution.
-        # batch_size=0,           # (optional) Inference batch size, no bigger than `num_ensemble`. If set to 0, the script will automatically decide the proper batch size. Defaults to 0.
-        # seed=2024,              # (optional) Random seed can be set to ensure additional reproducibility. Default: None (unseeded). Note: forcing --batch_size 1 helps to increase reproducibility. To ensure full reproducibility, deterministic mode needs to be used.
-        # color_map="Spectral",   # (optional) Colormap used to colorize the depth map. Defaults to "Spectral". Set to `None` to skip colormap generation.
-        show_progress_bar=True, # (optional) If true, will show progress bars of the inference progress.
-    )
+    inference_args = {}
+    if depth_mode == "fast":
+        # Marigold keeps its output at the processing resolution, the upsampling below restores the input size
+        inference_args = {"processing_res": fast_res, "match_input_res": False}
+    elif processing_res is not None:
+        inference_args["processing_res"] = processing_res
+    if ensemble_size is not None:
+        inference_args["ensemble_size"] = ensemble_size
+
+    with span("marigold.inference", depth_mode=depth_mode):
+        pipeline_output = pipe(
+            image,                    # Input image.
+            **inference_args,
+            # ----- recommended setting for DDIM version -----
+            # denoising_steps=10,     # (optional) Number of denoising steps of each inference pass. Default: 10.
+            # ensemble_size=10,       # (optional) Number of inference passes in the ensemble. Default: 10.
+            # ------------------------------------------------
+            # ----- recommended setting for LCM version ------
+            # denoising_steps=4,
+            # ensemble_size=5,
+            # -------------------------------------------------
+            # processing_res=768,     # (optional) Maximum resolution of processing. If set to 0: will not resize at all. Defaults to 768.
+            # match_input_res=True,   # (optional) Resize depth prediction to match input resolution.
+            # batch_size=0,           # (optional) Inference batch size, no bigger than `num_ensemble`. If set to 0, the script will automatically decide the proper batch size. Defaults to 0.
+            # seed=2024,              # (optional) Random seed can be set to ensure additional reproducibility. Default: None (unseeded). Note: forcing --batch_size 1 helps to increase reproducibility. To ensure full reproducibility, deterministic mode needs to be used.
+            # color_map="Spectral",   # (optional) Colormap used to colorize the depth map. Defaults to "Spectral". Set to `None` to skip colormap generation.
+            show_progress_bar=True, # (optional) If true, will show progress bars of the inference progress.
+        )
 
     depth: np.ndarray = pipeline_output.depth_np                    # Predicted depth map
     depth_colored: Image.Image = pipeline_output.depth_colored      # Colorized prediction
 
+    if depth_mode == "fast":
+        from depth_upsampling import upsample_depth
+
+        with span("marigold.upsample", processing_res=fast_res):
+            depth = upsample_depth(depth, np.asarray(image.convert("RGB")))
+            depth_colored = depth_colored.resize(image.size, Image.BILINEAR)
+
     #marigold by default produces depth map where black is front, for controlnets etc. we want the opposite
     inverse_depth = 1.0 - depth
 
@@ -81,9 +119,96 @@ if __name__ == '__main__':
     if os.path.exists(output_colored_depth_path):
         print(f"Existing file: colorized depth map '{output_colored_depth_path}' will be overwritten")
 
-    # Save as uint16 PNG
-    depth_uint16 = (inverse_depth * 65535.0).astype(np.uint16)
-    Image.fromarray(depth_uint16).save(output_depth_path, mode="I;16")
+    with span("marigold.save"):
+        # Save as uint16 PNG
+        depth_uint16 = (inverse_depth * 65535.0).astype(np.uint16)
+        Image.fromarray(depth_uint16).save(output_depth_path, mode="I;16")
+
+        # Save colorized depth map
+        depth_colored.save(output_colored_depth_path)
+    return output_depth_path, output_colored_depth_path
+
+
+class DepthModel:
+    """A Marigold model kept loaded by a long running process, so depth estimations after the first one do
+        not import the model dependencies and load the checkpoint again."""
+
+    def __init__(self, checkpoint: str) -> None:
+        """
+        Args:
+            checkpoint (str): The checkpoint path or hub name.
+
+        Attributes:
+            pipe (DiffusionPipeline): The Marigold pipeline, loaded on first use.
+        """
+        self.checkpoint = checkpoint
+        self.pipe = None
+        self.lock = threading.Lock()
+
+    def estimate(self, img_path, output_dir=None, depth_mode="full"):
+        """
+        Estimates and saves the depth map of an image, see estimate_depth. Estimations run one at a time, as
+        they share the model and its device memory.
+
+        Returns:
+            tuple: The paths to the 16-bit depth map and to the colorized depth map.
+        """
+        with self.lock:
+            if self.pipe is None:
+                self.pipe = load_depth_model(self.checkpoint)
+            return estimate_depth(self.pipe, img_path, output_dir, depth_mode)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Run single-image depth estimation using Marigold."
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default="prs-eth/marigold-lcm-v1-0",
+        choices=["prs-eth/marigold-lcm-v1-0", "prs-eth/marigold-v1-0", "Bingxin/Marigold"],
+        help="Checkpoint path or hub name.",
+    )
+    parser.add_argument(
+        "--input_image_path",
+        type=str,
+        required=True,
+        help="Path to the input image.",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=False,
+        help="Output directory (defaults to the input image directory).",
+    )
+    parser.add_argument(
+        "--depth_mode",
+        type=str,
+        default="full",
+        choices=["full", "fast"],
+        help="'full' runs Marigold at its default processing resolution, 'fast' runs it at --fast_res "
+             "and upsamples the depth map to the input resolution guided by the input image.",
+    )
+    parser.add_argument(
+        "--fast_res",
+        type=int,
+        default=FAST_PROCESSING_RES,
+        help="Processing resolution of the fast depth mode.",
+    )
+    parser.add_argument(
+        "--processing_res",
+        type=int,
+        default=None,
+        help="Processing resolution of the full depth mode (defaults to the Marigold default of 768).",
+    )
+    parser.add_argument(
+        "--ensemble_size",
+        type=int,
+        default=None,
+        help="Number of inference passes in the ensemble (defaults to the Marigold default).",
+    )
+    args = parser.parse_args()
 
-    # Save colorized depth map
-    depth_colored.save(output_colored_depth_path)
+    estimate_depth(load_depth_model(args.checkpoint), args.input_image_path, args.output_dir, args.depth_mode,
+                   args.fast_res, args.processing_res, args.ensemble_size)
@@ -0,0 +1,92 @@
+import os
+# OpenCV only decodes EXR files when explicitly enabled
+os.environ.setdefault("OPENCV_IO_ENABLE_OPENEXR", "1")
+
+import cv2
+import numpy as np
+
+
+class DepthMap:
+    """A depth map decoded once in its native dtype and shared between the pipeline stages."""
+
+    def __init__(self, depth_map_path: str) -> None:
+        """Constructs a DepthMap object.
+
+        Supported inputs are 8/16-bit PNG (or any other image format readable by OpenCV), float .npy arrays
+        and EXR files. Color images are reduced to their first channel.
+
+        Args:
+            depth_map_path (str): The path to the depth map file.
+
+        Raises:
+            ValueError: If the depth map file cannot be read.
+        """
+        self.path = depth_map_path
+        self.data = self.decode(depth_map_path)
+        # Integer depth maps span their whole dtype range, float depth maps are expected in [0, 1]
+        if np.issubdtype(self.data.dtype, np.integer):
+            self.max_value = np.iinfo(self.data.dtype).max
+        else:
+            self.max_value = 1.0
+        self._normalized = None
+
+    @staticmethod
+    def decode(depth_map_path: str) -> np.ndarray:
+        """Reads a depth map file into a 2D array of its native dtype."""
+        if os.path.splitext(depth_map_path)[1].lower() == ".npy":
+            depth_map = np.load(depth_map_path)
+        else:
+            depth_map = cv2.imread(depth_map_path, cv2.IMREAD_UNCHANGED)
+
+        if depth_map is None:
+            raise ValueError(
+                f"Could not read the depth map image file at {depth_map_path}"
+            )
+        if depth_map.ndim == 3:
+            depth_map = np.ascontiguousarray(depth_map[:, :, 0])
+        return depth_map
+
+    @property
+    def shape(self) -> tuple:
+        """The (rows, cols) shape of the depth map."""
+        return self.data.shape
+
+    def invert(self) -> None:
+        """Inverts the depth map in place, without changing its dtype (near becomes far and vice versa)."""
+        np.subtract(self.data.dtype.type(self.max_value), self.data, out=self.data)
+        self._normalized = None
+
+    def normalized(self) -> np.ndarray:
+        """
+        Returns the depth map normalized to [0, 1] as float32.
+
+        The normalized buffer is computed once and every call returns a view of it without copying, float32
+        depth maps in [0, 1] are returned as they are.
+
+        Returns:
+            numpy.ndarray: The normalized depth map.
+        """
+        if self._normalized is None:
+            if self.data.dtype == np.float32 and self.max_value == 1.0:
+                self._normalized = self.data
+            else:
+                self._normalized = self.data.astype(np.float32)
+                self._normalized *= np.float32(1.0 / self.max_value)
+        return self._normalized.view()
+
+    def save(self, output_path: str) -> str:
+        """
+        Writes the depth map to an image file, float depth maps are stored as 16-bit images.
+
+        Args:
+            output_path (str): The path to the output image file.
+
+        Returns:
+            str: The output path.
+        """
+        data = self.data
+        if not np.issubdtype(data.dtype, np.integer):
+            data = (self.normalized().clip(0, 1) * 65535.0).astype(np.uint16)
+        if not cv2.imwrite(output_path, data):
+            raise ValueError(f"Could not write the depth map image file at {output_path}")
+        return output_path
@@ -0,0 +1,279 @@
+import os
+import cv2
+import json
+import time
+import struct
+import argparse
+import numpy as np
+from depth_loader import DepthMap
+from preview_renderer import DISPLACE_STRENGTH
+
+
+# The distance between mesh vertices in depth map pixels
+GRID_STEP = 4
+# Triangles whose normalized depth range is larger are cut, so foreground and background are not joined
+MAX_DEPTH_JUMP = 0.05
+
+# glTF constants
+GLB_MAGIC = 0x46546C67
+GLB_JSON_CHUNK = 0x4E4F534A
+GLB_BIN_CHUNK = 0x004E4942
+FLOAT = 5126
+UNSIGNED_INT = 5125
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+
+def get_grid_indices(length, step):
+    """Returns the sampled pixel indices along one side, every step pixels and always the last one."""
+    indices = np.arange(0, length, step)
+    if indices[-1] != length - 1:
+        indices = np.append(indices, length - 1)
+    return indices
+
+
+def build_depth_mesh(depth, step=GRID_STEP, max_depth_jump=MAX_DEPTH_JUMP):
+    """
+    Builds the displaced plane of blender.py as a triangle mesh, sampling the depth map on a regular grid.
+
+    The vertices are placed in the Blender scene coordinates of blender.py: the plane spans x in
+    [0, 2 * aspect ratio] and z in [0, 2] and is displaced along -y, towards the camera, by the depth.
+
+    Args:
+        depth (numpy.ndarray): The normalized depth map in [0, 1].
+        step (int, optional): The distance between vertices in pixels. Defaults to GRID_STEP.
+        max_depth_jump (float, optional): The largest normalized depth range of a kept triangle, None keeps
+            all triangles. Defaults to MAX_DEPTH_JUMP.
+
+    Returns:
+        tuple: The float32 vertices of shape (N, 3), the float32 texture coordinates of shape (N, 2) with
+            the origin at the top left image corner, the uint32 triangles of shape (M, 3) and the number of
+            cut triangles.
+
+    Raises:
+        ValueError: If the depth map is smaller than 2x2 pixels or the step is not positive.
+    """
+    height, width = depth.shape
+    if height < 2 or width < 2:
+        raise ValueError(f"The depth map has to be at least 2x2 pixels, got {width}x{height}")
+    if step < 1:
+        raise ValueError(f"The grid step has to be at least 1 pixel, got {step}")
+    rows, cols = get_grid_indices(height, step), get_grid_indices(width, step)
+    u = cols.astype(np.float32) / (width - 1)
+    v = rows.astype(np.float32) / (height - 1)
+    grid_depth = depth[np.ix_(rows, cols)].astype(np.float32)
+
+    aspect_ratio = width / height
+    grid_u, grid_v = np.meshgrid(u, v)
+    vertices = np.stack([
+        grid_u * 2 * aspect_ratio,
+        -DISPLACE_STRENGTH * (grid_depth - 0.5),
+        2 - grid_v * 2,
+    ], axis=-1).reshape(-1, 3)
+    uvs = np.stack([grid_u, grid_v], axis=-1).reshape(-1, 2)
+
+    # Two triangles per grid cell, wound to face the camera at -y
+    index = np.arange(len(rows) * len(cols), dtype=np.uint32).reshape(len(rows), len(cols))
+    top_left, top_right = index[:-1, :-1].ravel(), index[:-1, 1:].ravel()
+    bottom_left, bottom_right = index[1:, :-1].ravel(), index[1:, 1:].ravel()
+    faces = np.concatenate([
+        np.stack([top_left, bottom_left, top_right], axis=1),
+        np.stack([top_right, bottom_left, bottom_right], axis=1),
+    ])
+
+    cut_triangles = 0
+    if max_depth_jump is not None:
+        face_depths = grid_depth.ravel()[faces]
+        keep = face_depths.max(axis=1) - face_depths.min(axis=1) <= max_depth_jump
+        cut_triangles = int(len(faces) - np.count_nonzero(keep))
+        faces = faces[keep]
+
+    # Vertices left without triangles by the cut are dropped
+    used, faces = np.unique(faces, return_inverse=True)
+    faces = faces.reshape(-1, 3).astype(np.uint32)
+    return vertices[used].astype(np.float32), uvs[used].astype(np.float32), faces, cut_triangles
+
+
+def read_png_bytes(image_path):
+    """Returns the PNG file content of an image, encoding it only if it is not a PNG file already."""
+    if image_path.lower().endswith(".png"):
+        with open(image_path, "rb") as f:
+            return f.read()
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f"Unable to load image from {image_path}")
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+def write_glb(output_path, vertices, uvs, faces, texture_png):
+    """
+    Writes a textured mesh as binary glTF with the texture embedded.
+
+    glTF is Y-up, the vertices are converted from the Z-up Blender coordinates so the Blender glTF importer
+    places the mesh exactly where blender.py builds its plane.
+
+    Args:
+        output_path (str): The path to the output .glb file.
+        vertices (numpy.ndarray): The vertices in Blender coordinates of shape (N, 3).
+        uvs (numpy.ndarray): The texture coordinates of shape (N, 2).
+        faces (numpy.ndarray): The triangles of shape (M, 3).
+        texture_png (bytes): The PNG texture.
+    """
+    positions = np.ascontiguousarray(vertices[:, [0, 2, 1]] * np.array([1, 1, -1], dtype=np.float32))
+    blobs = [positions.tobytes(), np.ascontiguousarray(uvs).tobytes(),
+             np.ascontiguousarray(faces, dtype=np.uint32).tobytes(), texture_png]
+
+    # Buffer views start at 4 byte boundaries
+    buffer_views, binary = [], bytearray()
+    for blob, target in zip(blobs, (ARRAY_BUFFER, ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER, None)):
+        binary.extend(b"\0" * (-len(binary) % 4))
+        view = {"buffer": 0, "byteOffset": len(binary), "byteLength": len(blob)}
+        if target is not None:
+            view["target"] = target
+        buffer_views.append(view)
+        binary.extend(blob)
+    binary.extend(b"\0" * (-len(binary) % 4))
+
+    document = {
+        "asset": {"version": "2.0", "generator": "depth_mesh_export.py"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0, "name": "DepthMesh"}],
+        "meshes": [{"name": "DepthMesh", "primitives": [{
+            "attributes": {"POSITION": 0, "TEXCOORD_0": 1},
+            "indices": 2,
+            "material": 0,
+        }]}],
+        # The scene image already holds the lighting, like the Workbench render of blender.py shows it
+        "extensionsUsed": ["KHR_materials_unlit"],
+        "materials": [{
+            "name": "MyMaterial",
+            "pbrMetallicRoughness": {"baseColorTexture": {"index": 0}, "metallicFactor": 0.0,
+                                     "roughnessFactor": 1.0},
+            "extensions": {"KHR_materials_unlit": {}},
+        }],
+        "samplers": [{"magFilter": 9729, "minFilter": 9729, "wrapS": 33071, "wrapT": 33071}],
+        "textures": [{"sampler": 0, "source": 0}],
+        "images": [{"bufferView": 3, "mimeType": "image/png"}],
+        "accessors": [
+            {"bufferView": 0, "componentType": FLOAT, "count": len(positions), "type": "VEC3",
+             "min": positions.min(axis=0).tolist(), "max": positions.max(axis=0).tolist()},
+            {"bufferView": 1, "componentType": FLOAT, "count": len(uvs), "type": "VEC2"},
+            {"bufferView": 2, "componentType": UNSIGNED_INT, "count": int(faces.size), "type": "SCALAR"},
+        ],
+        "bufferViews": buffer_views,
+        "buffers": [{"byteLength": len(binary)}],
+    }
+    json_chunk = json.dumps(document, separators=(",", ":")).encode()
+    json_chunk += b" " * (-len(json_chunk) % 4)
+
+    with open(output_path, "wb") as f:
+        f.write(struct.pack("<III", GLB_MAGIC, 2, 12 + 8 + len(json_chunk) + 8 + len(binary)))
+        f.write(struct.pack("<II", len(json_chunk), GLB_JSON_CHUNK))
+        f.write(json_chunk)
+        f.write(struct.pack("<II", len(binary), GLB_BIN_CHUNK))
+        f.write(binary)
+
+
+def write_ply(output_path, vertices, uvs, faces, texture_png):
+    """
+    Writes a textured mesh as binary PLY in Blender coordinates, with the texture saved next to it as
+    <root>_texture.png and named in a TextureFile comment.
+
+    Args:
+        output_path (str): The path to the output .ply file.
+        vertices (numpy.ndarray): The vertices in Blender coordinates of shape (N, 3).
+        uvs (numpy.ndarray): The texture coordinates of shape (N, 2), with the origin at the top left.
+        faces (numpy.ndarray): The triangles of shape (M, 3).
+        texture_png (bytes): The PNG texture.
+    """
+    root, _ = os.path.splitext(output_path)
+    texture_path = f"{root}_texture.png"
+    with open(texture_path, "wb") as f:
+        f.write(texture_png)
+
+    vertex_data = np.empty(len(vertices), dtype=[("position", "<f4", 3), ("uv", "<f4", 2)])
+    vertex_data["position"] = vertices
+    # PLY texture coordinates have their origin at the bottom left
+    vertex_data["uv"] = np.stack([uvs[:, 0], 1 - uvs[:, 1]], axis=1)
+    face_data = np.empty(len(faces), dtype=[("count", "u1"), ("indices", "<u4", 3)])
+    face_data["count"] = 3
+    face_data["indices"] = faces
+
+    header = "\n".join([
+        "ply",
+        "format binary_little_endian 1.0",
+        "comment generated by depth_mesh_export.py",
+        f"comment TextureFile {os.path.basename(texture_path)}",
+        f"element vertex {len(vertices)}",
+        "property float x",
+        "property float y",
+        "property float z",
+        "property float s",
+        "property float t",
+        f"element face {len(faces)}",
+        "property list uchar uint vertex_indices",
+        "end_header",
+    ]) + "\n"
+    with open(output_path, "wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(vertex_data.tobytes())
+        f.write(face_data.tobytes())
+
+
+def export_depth_mesh(depth_map_path, scene_image_path, output_path, step=GRID_STEP, max_depth_jump=MAX_DEPTH_JUMP):
+    """
+    Exports the textured 2.5D mesh of a depth map and scene image as binary glTF (.glb) or PLY (.ply),
+    depending on the output file extension.
+
+    Args:
+        depth_map_path (str): The path to the depth map, as passed to Blender.
+        scene_image_path (str): The path to the scene image used as texture.
+        output_path (str): The path to the output .glb or .ply file.
+        step (int, optional): The distance between vertices in pixels. Defaults to GRID_STEP.
+        max_depth_jump (float, optional): The largest normalized depth range of a kept triangle, None keeps
+            all triangles. Defaults to MAX_DEPTH_JUMP.
+
+    Returns:
+        dict: The number of vertices, triangles and cut triangles of the mesh.
+
+    Raises:
+        ValueError: If the output format is not supported, the depth map is smaller than 2x2 pixels or
+            every triangle is cut at depth jumps.
+    """
+    writers = {".glb": write_glb, ".ply": write_ply}
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension not in writers:
+        raise ValueError(f"Unsupported mesh format '{extension}', use .glb or .ply")
+
+    depth = DepthMap(depth_map_path).normalized()
+    vertices, uvs, faces, cut_triangles = build_depth_mesh(depth, step, max_depth_jump)
+    if len(faces) == 0:
+        raise ValueError(f"All {cut_triangles} triangles were cut at depth jumps, raise the max depth jump")
+    writers[extension](output_path, vertices, uvs, faces, read_png_bytes(scene_image_path))
+    return {"vertices": len(vertices), "triangles": len(faces), "cut_triangles": cut_triangles}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the textured 2.5D mesh of a depth map and scene image as binary glTF or PLY."
+    )
+    parser.add_argument("--depth_map", type=str, required=True, help="Path to the depth map")
+    parser.add_argument("--scene_image", type=str, required=True, help="Path to the scene image (texture)")
+    parser.add_argument("--output_path", type=str, default="results/depth_mesh.glb",
+                        help="Path of the mesh, the extension (.glb or .ply) selects the format")
+    parser.add_argument("--step", type=int, default=GRID_STEP, help="Distance between vertices in pixels")
+    parser.add_argument("--max_depth_jump", type=float, default=MAX_DEPTH_JUMP,
+                        help="Largest normalized depth range of a triangle, larger ones are cut (negative keeps all)")
+    args = parser.parse_args()
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output_path)), exist_ok=True)
+        start = time.perf_counter()
+        stats = export_depth_mesh(args.depth_map, args.scene_image, args.output_path, args.step,
+                                  args.max_depth_jump if args.max_depth_jump >= 0 else None)
+        print(f"Exported {stats['vertices']} vertices and {stats['triangles']} triangles "
+              f"({stats['cut_triangles']} cut at depth jumps) in {time.perf_counter() - start:.3f} s")
+        print("Mesh saved as", args.output_path)
+    except Exception as exc:
+        print(f"Error while exporting the depth mesh: {exc}")
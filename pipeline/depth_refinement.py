@@ -0,0 +1,196 @@
+import os
+import cv2
+import argparse
+import subprocess
+import numpy as np
+from depth_loader import DepthMap
+from tracing import span
+
+
+# The side of the refined region around the placement point, in scene pixels
+ROI_SIZE = 384
+# Marigold upsamples the region to this resolution, twice the default region size
+ROI_PROCESSING_RES = 768
+# The ensemble of the region pass, larger than the default of the LCM checkpoint
+ROI_ENSEMBLE_SIZE = 10
+# The width of the blending ramp at the region borders, as a share of the region size
+FEATHER = 0.25
+# The share of pixels with the largest alignment residuals left out of the second alignment fit
+OUTLIER_SHARE = 0.1
+
+
+def get_roi_box(point, image_size, roi_size=ROI_SIZE):
+    """
+    Returns the square region around a point, shifted to lie inside the image.
+
+    Args:
+        point (tuple): The (x, y) placement point.
+        image_size (tuple): The (width, height) of the image.
+        roi_size (int, optional): The region side in pixels. Defaults to ROI_SIZE.
+
+    Returns:
+        tuple: The region box (x0, y0, x1, y1).
+    """
+    width, height = image_size
+    size_x, size_y = min(roi_size, width), min(roi_size, height)
+    x0 = int(np.clip(point[0] - size_x // 2, 0, width - size_x))
+    y0 = int(np.clip(point[1] - size_y // 2, 0, height - size_y))
+    return x0, y0, x0 + size_x, y0 + size_y
+
+
+def align_scale_shift(depth, target):
+    """
+    Fits the scale and shift which map an affine-invariant depth map onto a target depth map in the
+    least-squares sense. The fit is repeated without the pixels with the largest residuals.
+
+    Args:
+        depth (numpy.ndarray): The depth map to align.
+        target (numpy.ndarray): The target depth map of the same shape.
+
+    Returns:
+        tuple: The scale and the shift.
+    """
+    x, y = depth.ravel().astype(np.float64), target.ravel().astype(np.float64)
+    inliers = np.ones(x.shape, dtype=bool)
+    for _ in range(2):
+        design = np.stack([x[inliers], np.ones(np.count_nonzero(inliers))], axis=1)
+        (scale, shift), *_ = np.linalg.lstsq(design, y[inliers], rcond=None)
+        residuals = np.abs(scale * x + shift - y)
+        inliers = residuals <= np.quantile(residuals, 1 - OUTLIER_SHARE)
+    return float(scale), float(shift)
+
+
+def get_feather_weights(box, image_size, feather=FEATHER):
+    """
+    Returns the blending weights of a region, which ramp from 0 at the region borders to 1 inside it.
+    Borders on the image border are not feathered, as there is no global depth beyond them to blend with.
+
+    Args:
+        box (tuple): The region box (x0, y0, x1, y1).
+        image_size (tuple): The (width, height) of the image.
+        feather (float, optional): The ramp width as a share of the region size. Defaults to FEATHER.
+
+    Returns:
+        numpy.ndarray: The float32 weights of shape (y1 - y0, x1 - x0).
+    """
+    x0, y0, x1, y1 = box
+    width, height = image_size
+
+    def ramp(length, at_start_border, at_end_border):
+        ramp_length = max(1.0, feather * length)
+        position = np.arange(length, dtype=np.float32) + 0.5
+        weights = np.ones(length, dtype=np.float32)
+        if not at_start_border:
+            weights = np.minimum(weights, position / ramp_length)
+        if not at_end_border:
+            weights = np.minimum(weights, (length - position) / ramp_length)
+        return weights
+
+    weights_x = ramp(x1 - x0, x0 == 0, x1 == width)
+    weights_y = ramp(y1 - y0, y0 == 0, y1 == height)
+    return np.minimum(weights_y[:, None], weights_x[None, :])
+
+
+def blend_roi(global_depth, roi_depth, box, feather=FEATHER):
+    """
+    Aligns the depth map of a region to the global depth map and blends it in with feathered borders.
+
+    Args:
+        global_depth (numpy.ndarray): The normalized global depth map.
+        roi_depth (numpy.ndarray): The normalized depth map of the region.
+        box (tuple): The region box (x0, y0, x1, y1).
+        feather (float, optional): The ramp width as a share of the region size. Defaults to FEATHER.
+
+    Returns:
+        tuple: The refined float32 depth map, the scale and the shift of the alignment.
+    """
+    x0, y0, x1, y1 = box
+    global_roi = global_depth[y0:y1, x0:x1]
+    scale, shift = align_scale_shift(roi_depth, global_roi)
+    aligned = (roi_depth * np.float32(scale) + np.float32(shift)).clip(0, 1)
+
+    weights = get_feather_weights(box, global_depth.shape[::-1], feather)
+    refined = global_depth.astype(np.float32)
+    refined[y0:y1, x0:x1] = weights * aligned + (1 - weights) * global_roi
+    return refined, scale, shift
+
+
+def refine_depth_roi(scene_image_path, depth_map_path, point, output_dir, marigold_checkpoint,
+                     roi_size=ROI_SIZE, processing_res=ROI_PROCESSING_RES, ensemble_size=ROI_ENSEMBLE_SIZE):
+    """
+    Runs a second Marigold pass at a higher resolution and with a larger ensemble on the region around
+    the placement point only, and blends its depth into the global depth map.
+
+    Args:
+        scene_image_path (str): The path to the scene image.
+        depth_map_path (str): The path to the global depth map, as written by depth_estimation_marigold.py.
+        point (tuple): The (x, y) placement point.
+        output_dir (str): The path to the folder where the region and the refined depth map are written.
+        marigold_checkpoint (str): The Marigold model checkpoint.
+        roi_size (int, optional): The region side in pixels. Defaults to ROI_SIZE.
+        processing_res (int, optional): The Marigold processing resolution of the region.
+            Defaults to ROI_PROCESSING_RES.
+        ensemble_size (int, optional): The Marigold ensemble size of the region. Defaults to ROI_ENSEMBLE_SIZE.
+
+    Returns:
+        str: The path to the refined 16-bit depth map.
+    """
+    scene_image = cv2.imread(scene_image_path)
+    global_depth = DepthMap(depth_map_path).normalized()
+    height, width = global_depth.shape
+    if scene_image.shape[:2] != (height, width):
+        raise ValueError("The scene image and the depth map have different resolutions")
+
+    box = get_roi_box(point, (width, height), roi_size)
+    x0, y0, x1, y1 = box
+    roi_image_path = os.path.join(output_dir, "roi.png")
+    cv2.imwrite(roi_image_path, scene_image[y0:y1, x0:x1])
+
+    with span("depth_refinement.marigold", roi_size=roi_size, processing_res=processing_res):
+        subprocess.run([
+            "python",
+            "depth_estimation_marigold.py",
+            "--checkpoint", marigold_checkpoint,
+            "--input_image_path", roi_image_path,
+            "--output_dir", output_dir,
+            "--processing_res", str(processing_res),
+            "--ensemble_size", str(ensemble_size),
+        ], check=True)
+
+    with span("depth_refinement.blend"):
+        roi_depth = DepthMap(os.path.join(output_dir, "roi_depth.png")).normalized()
+        refined, scale, shift = blend_roi(global_depth, roi_depth, box)
+        print(f"Refined the depth of region {box} (scale {scale:.3f}, shift {shift:+.3f})")
+
+        root, ext = os.path.splitext(os.path.basename(depth_map_path))
+        refined_depth_path = os.path.join(output_dir, f"{root}_refined.png")
+        cv2.imwrite(refined_depth_path, (refined * 65535.0).round().astype(np.uint16))
+    return refined_depth_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Refine the depth map around a placement point with a high resolution Marigold pass."
+    )
+    parser.add_argument("--scene_image", type=str, required=True, help="Path to the scene image")
+    parser.add_argument("--depth_map", type=str, required=True, help="Path to the global depth map")
+    parser.add_argument("--point", type=int, nargs=2, required=True, metavar=("X", "Y"), help="Placement point")
+    parser.add_argument("--output_dir", type=str, default="results", help="Output directory")
+    parser.add_argument("--marigold_checkpoint", type=str, default="prs-eth/marigold-lcm-v1-0",
+                        choices=["prs-eth/marigold-lcm-v1-0", "prs-eth/marigold-v1-0", "Bingxin/Marigold"],
+                        help="Marigold checkpoint path or hub name")
+    parser.add_argument("--roi_size", type=int, default=ROI_SIZE, help="Side of the refined region in pixels")
+    parser.add_argument("--processing_res", type=int, default=ROI_PROCESSING_RES,
+                        help="Marigold processing resolution of the region")
+    parser.add_argument("--ensemble_size", type=int, default=ROI_ENSEMBLE_SIZE,
+                        help="Marigold ensemble size of the region")
+    args = parser.parse_args()
+
+    try:
+        os.makedirs(args.output_dir, exist_ok=True)
+        refined_depth_path = refine_depth_roi(args.scene_image, args.depth_map, tuple(args.point), args.output_dir,
+                                              args.marigold_checkpoint, args.roi_size, args.processing_res,
+                                              args.ensemble_size)
+        print("Refined depth map saved as", refined_depth_path)
+    except Exception as exc:
+        print(f"Error while refining the depth map: {exc}")
@@ -0,0 +1,4 @@
+# Settings of the depth stages shared by light and heavy modules, this module must not import anything heavy
+
+# The Marigold processing resolution of the fast depth mode
+FAST_PROCESSING_RES = 384
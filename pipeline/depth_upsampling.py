@@ -0,0 +1,208 @@
+import cv2
+import json
+import argparse
+import numpy as np
+from depth_loader import DepthMap
+from depth_settings import FAST_PROCESSING_RES
+
+
+# The guided depth upsampling methods, the first one is used by the fast depth mode
+UPSAMPLING_METHODS = ["joint_bilateral", "guided", "bilinear"]
+# Reference depth pixels with a gradient above this value (per pixel, normalized depth) are depth edges
+EDGE_GRADIENT = 0.01
+
+
+def guided_filter(guide, source, radius, eps):
+    """
+    Filters a source image with the color guided filter of He et al., which transfers the edges of the
+    guide image to the source. Every step is a box filter, so the cost does not depend on the radius.
+
+    Args:
+        guide (numpy.ndarray): The float32 RGB guide image in [0, 1] of shape (H, W, 3).
+        source (numpy.ndarray): The float32 image to filter of shape (H, W).
+        radius (int): The box filter radius in pixels.
+        eps (float): The regularization, larger values smooth more across weak guide edges.
+
+    Returns:
+        numpy.ndarray: The filtered float32 image.
+    """
+    size = (2 * radius + 1, 2 * radius + 1)
+
+    def box(image):
+        return cv2.boxFilter(image, cv2.CV_32F, size, borderType=cv2.BORDER_REFLECT)
+
+    mean_guide = box(guide)
+    mean_source = box(source)
+    covariance_guide_source = box(guide * source[:, :, None]) - mean_guide * mean_source[:, :, None]
+
+    # Per-pixel 3x3 covariance of the guide colors, regularized by eps
+    variance = np.empty(guide.shape[:2] + (3, 3), dtype=np.float32)
+    for i in range(3):
+        for j in range(i, 3):
+            variance[:, :, i, j] = box(guide[:, :, i] * guide[:, :, j]) - mean_guide[:, :, i] * mean_guide[:, :, j]
+            variance[:, :, j, i] = variance[:, :, i, j]
+    variance += np.eye(3, dtype=np.float32) * np.float32(eps)
+
+    a = np.linalg.solve(variance, covariance_guide_source[:, :, :, None])[:, :, :, 0]
+    b = mean_source - np.sum(a * mean_guide, axis=2)
+    return np.sum(box(a) * guide, axis=2) + box(b)
+
+
+def joint_bilateral_upsample(depth, guide, sigma_spatial=0.5, sigma_color=0.1, taps=2):
+    """
+    Upsamples a low resolution image with joint bilateral upsampling. Every full resolution pixel
+    averages the nearest low resolution samples, weighted by their distance and by how close the guide
+    color at the sample is to the guide color at the pixel, so samples across color edges are ignored.
+
+    Args:
+        depth (numpy.ndarray): The low resolution float32 image of shape (h, w).
+        guide (numpy.ndarray): The float32 RGB guide image in [0, 1] of shape (H, W, 3).
+        sigma_spatial (float, optional): The spatial weight deviation in low resolution pixels.
+            Defaults to 0.5.
+        sigma_color (float, optional): The guide color weight deviation. Defaults to 0.1.
+        taps (int, optional): The number of samples on each side of a pixel per axis. Defaults to 2.
+
+    Returns:
+        numpy.ndarray: The upsampled float32 image of shape (H, W).
+    """
+    height, width = guide.shape[:2]
+    low_height, low_width = depth.shape
+    low_guide = cv2.resize(guide, (low_width, low_height), interpolation=cv2.INTER_AREA)
+
+    # Sample positions of the full resolution pixel centers on the low resolution grid
+    sample_y = (np.arange(height) + 0.5) * low_height / height - 0.5
+    sample_x = (np.arange(width) + 0.5) * low_width / width - 0.5
+    base_y, base_x = np.floor(sample_y).astype(int), np.floor(sample_x).astype(int)
+
+    weighted_sum = np.zeros((height, width), dtype=np.float32)
+    weight_sum = np.zeros((height, width), dtype=np.float32)
+    for offset_y in range(1 - taps, taps + 1):
+        rows = np.clip(base_y + offset_y, 0, low_height - 1)
+        weight_y = np.exp(-(sample_y - base_y - offset_y) ** 2 / (2 * sigma_spatial ** 2)).astype(np.float32)
+        for offset_x in range(1 - taps, taps + 1):
+            cols = np.clip(base_x + offset_x, 0, low_width - 1)
+            weight_x = np.exp(-(sample_x - base_x - offset_x) ** 2 / (2 * sigma_spatial ** 2)).astype(np.float32)
+            color_difference = guide - low_guide[rows][:, cols]
+            weight = np.exp(-np.sum(color_difference ** 2, axis=2) / np.float32(2 * sigma_color ** 2))
+            weight *= weight_y[:, None] * weight_x[None, :]
+            weighted_sum += weight * depth[rows][:, cols]
+            weight_sum += weight
+    return weighted_sum / np.maximum(weight_sum, np.float32(1e-12))
+
+
+def upsample_depth(depth, guide_image, method="joint_bilateral", radius=2, eps=1e-4):
+    """
+    Upsamples a low resolution depth map to the resolution of the scene image, using the scene image as
+    the guide so depth edges follow the object boundaries of the image.
+
+    Args:
+        depth (numpy.ndarray): The low resolution float depth map in [0, 1].
+        guide_image (numpy.ndarray): The full resolution RGB scene image (uint8 or float in [0, 1]).
+        method (str, optional): One of "joint_bilateral", "guided" or "bilinear".
+            Defaults to "joint_bilateral".
+        radius (int, optional): The guided filter radius at full resolution. Defaults to 2.
+        eps (float, optional): The guided filter regularization. Defaults to 1e-4.
+
+    Returns:
+        numpy.ndarray: The float32 depth map in [0, 1] at the scene image resolution.
+    """
+    height, width = guide_image.shape[:2]
+    guide = guide_image.astype(np.float32)
+    if guide_image.dtype == np.uint8:
+        guide *= np.float32(1 / 255)
+    if guide.ndim == 2:
+        guide = np.dstack([guide] * 3)
+    depth = depth.astype(np.float32)
+
+    if method == "joint_bilateral":
+        return joint_bilateral_upsample(depth, guide).clip(0, 1)
+
+    upsampled = cv2.resize(depth, (width, height), interpolation=cv2.INTER_LINEAR)
+    if method == "guided":
+        return guided_filter(guide, upsampled, radius, eps).clip(0, 1)
+    if method != "bilinear":
+        raise ValueError(f"Unknown upsampling method: {method}")
+    return upsampled
+
+
+def get_depth_errors(depth, reference):
+    """
+    Compares a depth map to a reference depth map of the same resolution.
+
+    Args:
+        depth (numpy.ndarray): The normalized depth map to evaluate.
+        reference (numpy.ndarray): The normalized reference depth map.
+
+    Returns:
+        dict: The mean absolute error, root mean squared error, the share of pixels within 1.25 of the
+            reference depth ratio, and the mean absolute error on the depth edges of the reference.
+    """
+    error = np.abs(depth - reference)
+    ratio = np.maximum(depth, 1e-3) / np.maximum(reference, 1e-3)
+    gradient = np.maximum(np.abs(cv2.Sobel(reference, cv2.CV_32F, 1, 0)), np.abs(cv2.Sobel(reference, cv2.CV_32F, 0, 1)))
+    # The Sobel kernel responds with 8 times the per-pixel gradient
+    edges = gradient / 8 > EDGE_GRADIENT
+    return {
+        "mae": float(error.mean()),
+        "rmse": float(np.sqrt(np.mean(error ** 2))),
+        "delta_1.25": float(np.mean(np.maximum(ratio, 1 / ratio) < 1.25)),
+        "edge_mae": float(error[edges].mean()) if edges.any() else 0.0,
+    }
+
+
+def get_quality_report(reference, image, fast_depth=None, processing_res=FAST_PROCESSING_RES):
+    """
+    Reports how much depth quality the fast depth mode loses against a full resolution depth map.
+
+    The reference is downscaled to the fast processing resolution and upsampled again with every method,
+    which isolates the upsampling error from the difference between the Marigold runs.
+
+    Args:
+        reference (numpy.ndarray): The normalized full resolution depth map.
+        image (numpy.ndarray): The RGB scene image.
+        fast_depth (numpy.ndarray, optional): The normalized depth map of the fast depth mode, reported
+            as "fast" if given.
+        processing_res (int, optional): The fast processing resolution. Defaults to FAST_PROCESSING_RES.
+
+    Returns:
+        dict: The depth errors of every upsampling method.
+    """
+    height, width = reference.shape
+    scale = processing_res / max(height, width)
+    low_res = cv2.resize(reference, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+    report = {method: get_depth_errors(upsample_depth(low_res, image, method), reference)
+              for method in UPSAMPLING_METHODS}
+    if fast_depth is not None:
+        report["fast"] = get_depth_errors(fast_depth, reference)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report the depth quality of the fast depth mode against a full resolution depth map."
+    )
+    parser.add_argument("--reference", type=str, required=True, help="Path to the full resolution depth map")
+    parser.add_argument("--image", type=str, required=True, help="Path to the scene image")
+    parser.add_argument("--fast_depth", type=str, default=None, help="Path to the depth map of the fast mode")
+    parser.add_argument("--processing_res", type=int, default=FAST_PROCESSING_RES,
+                        help="Processing resolution of the fast mode")
+    parser.add_argument("--output", type=str, default=None, help="Path to the JSON report")
+    args = parser.parse_args()
+
+    try:
+        reference = DepthMap(args.reference).normalized()
+        image = cv2.cvtColor(cv2.imread(args.image), cv2.COLOR_BGR2RGB)
+        fast_depth = DepthMap(args.fast_depth).normalized() if args.fast_depth else None
+        report = get_quality_report(reference, image, fast_depth, args.processing_res)
+    except Exception as exc:
+        print(f"Error while computing the depth quality report: {exc}")
+        raise SystemExit(1)
+
+    print(f"{'method':<16} {'mae':>8} {'rmse':>8} {'delta_1.25':>11} {'edge_mae':>9}")
+    for method, errors in report.items():
+        print(f"{method:<16} {errors['mae']:>8.4f} {errors['rmse']:>8.4f} "
+              f"{errors['delta_1.25']:>11.4f} {errors['edge_mae']:>9.4f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,257 @@
+import os
+import json
+import mmap
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+# The DIODE files stored per sample, as (file suffix, dtype of the memory-mapped array)
+DIODE_ARRAYS = {
+    "depth": ("_depth.npy", np.float32),
+    "mask": ("_depth_mask.npy", np.bool_),
+    "normal": ("_normal.npy", np.float32),
+}
+
+
+def scan_dataset(data_root: str, previous_scans: dict = None) -> dict:
+    """
+    Lists the files of every scan folder of the DIODE layout <data_root>/<split>/<scene_type>/<scene>/<scan>.
+
+    Scan folders whose modification time did not change since the previous listing are not listed again,
+    adding, removing or replacing files in a folder updates its modification time.
+
+    Args:
+        data_root (str): The path to the DIODE dataset.
+        previous_scans (dict, optional): The result of a previous call, used to skip unchanged scan folders.
+
+    Returns:
+        dict: The scan folders relative to data_root, mapped to their "mtime_ns" and sorted "files".
+    """
+    previous_scans = previous_scans or {}
+    scans = {}
+    pending_dirs = [(data_root, 0)]
+    while pending_dirs:
+        dir_path, level = pending_dirs.pop()
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                if level < 3:
+                    pending_dirs.append((entry.path, level + 1))
+                    continue
+
+                scan = os.path.relpath(entry.path, data_root).replace(os.sep, "/")
+                mtime_ns = entry.stat().st_mtime_ns
+                if previous_scans.get(scan, {}).get("mtime_ns") == mtime_ns:
+                    scans[scan] = previous_scans[scan]
+                else:
+                    with os.scandir(entry.path) as files:
+                        scans[scan] = {
+                            "mtime_ns": mtime_ns,
+                            "files": sorted(file.name for file in files if file.is_file()),
+                        }
+    return dict(sorted(scans.items()))
+
+
+def refresh_manifest(data_root: str, manifest_path: str) -> dict:
+    """
+    Brings the dataset manifest up to date with the dataset folder, only changed scan folders are listed.
+
+    Args:
+        data_root (str): The path to the DIODE dataset.
+        manifest_path (str): The path to the manifest JSON file, created if it does not exist.
+
+    Returns:
+        dict: The scans of the dataset, as returned by scan_dataset.
+    """
+    previous_scans = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            previous_scans = json.load(f)
+
+    scans = scan_dataset(data_root, previous_scans)
+    if scans != previous_scans:
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(scans, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+    return scans
+
+
+class DIODEDataset:
+    """A DIODE split converted once into memory-mapped arrays, whose samples are served as zero-copy views."""
+
+    def __init__(self, data_root: str, split: str = "val", scene_type: str = "indoors", cache_dir: str = None,
+                 arrays=("depth", "mask", "normal"), prefetch: int = 4) -> None:
+        """
+        Constructs a DIODEDataset object, converting new or changed samples into the memory-mapped cache.
+
+        Args:
+            data_root (str): The path to the DIODE dataset.
+            split (str, optional): The dataset split, "train" or "val". Defaults to "val".
+            scene_type (str, optional): The scene type, "indoors" or "outdoor". Defaults to "indoors".
+            cache_dir (str, optional): The path to the folder of the manifest and the memory-mapped arrays.
+                Defaults to "<data_root>/cache".
+            arrays (iterable, optional): The DIODE_ARRAYS served with every sample, only samples having all
+                of them are part of the dataset. Defaults to ("depth", "mask", "normal").
+            prefetch (int, optional): The number of samples read ahead in the background when iterating.
+                Defaults to 4.
+
+        Attributes:
+            samples (list): The (scan folder, sample name) pairs of the dataset, in a deterministic order.
+            data (dict): The array names mapped to memory-mapped arrays of shape (samples, ...).
+        """
+        self.data_root = data_root
+        self.split = split
+        self.scene_type = scene_type
+        self.cache_dir = cache_dir or os.path.join(data_root, "cache")
+        self.arrays = list(arrays)
+        self.prefetch = prefetch
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        scans = refresh_manifest(data_root, os.path.join(self.cache_dir, "manifest.json"))
+        self.samples, self.scan_mtimes = self.find_samples(scans)
+        self.split_dir = os.path.join(self.cache_dir, "_".join([split, scene_type] + sorted(self.arrays)))
+        self.data = self.load_cache()
+        self._mmaps = {}
+
+    def find_samples(self, scans: dict):
+        """Selects the samples of the split and scene type which have all of the requested files."""
+        samples, scan_mtimes = [], {}
+        prefix = f"{self.split}/{self.scene_type}/"
+        for scan, scan_info in scans.items():
+            if not scan.startswith(prefix):
+                continue
+            files = set(scan_info["files"])
+            suffix = DIODE_ARRAYS[self.arrays[0]][0]
+            for file_name in scan_info["files"]:
+                if not file_name.endswith(suffix):
+                    continue
+                name = file_name[:-len(suffix)]
+                if all(name + DIODE_ARRAYS[array][0] in files for array in self.arrays):
+                    samples.append([scan, name])
+                    scan_mtimes[scan] = scan_info["mtime_ns"]
+        return samples, scan_mtimes
+
+    def get_array_path(self, array: str) -> str:
+        """Returns the path to the memory-mapped .npy file of an array."""
+        return os.path.join(self.split_dir, f"{array}.npy")
+
+    def load_cache(self) -> dict:
+        """Opens the memory-mapped arrays, converting the samples first if the cache is missing or stale."""
+        index_path = os.path.join(self.split_dir, "index.json")
+        index = None
+        if os.path.exists(index_path):
+            with open(index_path, "r") as f:
+                index = json.load(f)
+
+        if index is None or index["samples"] != self.samples or index["scan_mtimes"] != self.scan_mtimes or \
+                not all(os.path.exists(self.get_array_path(array)) for array in self.arrays):
+            self.convert(index)
+
+        return {array: np.load(self.get_array_path(array), mmap_mode="r") for array in self.arrays}
+
+    def convert(self, previous_index: dict = None) -> None:
+        """
+        Converts the samples into one .npy file per array. Rows of samples whose scan folder did not change
+        are copied from the previous cache, only new and changed samples are decoded from the dataset.
+
+        Args:
+            previous_index (dict, optional): The index of the previous cache.
+
+        Raises:
+            ValueError: If the dataset has no samples or the samples do not share the same shape.
+        """
+        if not self.samples:
+            raise ValueError(f"No {self.split}/{self.scene_type} samples found in {self.data_root}")
+        os.makedirs(self.split_dir, exist_ok=True)
+
+        reusable_rows = {}
+        if previous_index is not None:
+            for row, (scan, name) in enumerate(previous_index["samples"]):
+                if previous_index["scan_mtimes"].get(scan) == self.scan_mtimes.get(scan):
+                    reusable_rows[(scan, name)] = row
+
+        def get_sample_path(scan, name, array):
+            return os.path.join(self.data_root, scan, name + DIODE_ARRAYS[array][0])
+
+        new_data, previous_data = {}, {}
+        for array in self.arrays:
+            sample_shape = np.load(get_sample_path(*self.samples[0], array), mmap_mode="r").shape
+            new_data[array] = np.lib.format.open_memmap(
+                self.get_array_path(array) + ".tmp", mode="w+", dtype=DIODE_ARRAYS[array][1],
+                shape=(len(self.samples),) + sample_shape
+            )
+            if previous_index is not None and array in previous_index["arrays"]:
+                previous_data[array] = np.load(self.get_array_path(array), mmap_mode="r")
+
+        for row, (scan, name) in enumerate(self.samples):
+            previous_row = reusable_rows.get((scan, name))
+            for array in self.arrays:
+                if previous_row is not None and array in previous_data and \
+                        previous_data[array].shape[1:] == new_data[array].shape[1:]:
+                    new_data[array][row] = previous_data[array][previous_row]
+                    continue
+
+                sample = np.load(get_sample_path(scan, name, array))
+                if sample.shape != new_data[array].shape[1:]:
+                    raise ValueError(f"{name}{DIODE_ARRAYS[array][0]} has shape {sample.shape}, "
+                                     f"expected {new_data[array].shape[1:]}")
+                new_data[array][row] = sample
+            print(f"\rConverting {self.split}/{self.scene_type} samples: {row + 1}/{len(self.samples)}",
+                  end="", flush=True)
+        print()
+
+        for array in self.arrays:
+            new_data[array].flush()
+        del new_data, previous_data
+        for array in self.arrays:
+            os.replace(self.get_array_path(array) + ".tmp", self.get_array_path(array))
+
+        index = {"samples": self.samples, "scan_mtimes": self.scan_mtimes, "arrays": self.arrays}
+        with open(os.path.join(self.split_dir, "index.json"), "w") as f:
+            json.dump(index, f)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def __getitem__(self, index: int) -> dict:
+        """
+        Returns a sample without copying its arrays.
+
+        Args:
+            index (int): The sample index.
+
+        Returns:
+            dict: The sample "name", its "image_path" and read-only views of its arrays, e.g. "depth",
+                "mask" and "normal".
+        """
+        scan, name = self.samples[index]
+        sample = {"name": name, "image_path": os.path.join(self.data_root, scan, name + ".png")}
+        for array, data in self.data.items():
+            sample[array] = data[index]
+        return sample
+
+    def prefetch_sample(self, index: int) -> None:
+        """Asks the OS to read the arrays of a sample into the page cache, so later accesses do not block."""
+        for array, data in self.data.items():
+            row_bytes = data[0].nbytes
+            start = data.offset + index * row_bytes
+            aligned_start = start - start % mmap.PAGESIZE
+            if hasattr(mmap, "MADV_WILLNEED"):
+                if array not in self._mmaps:
+                    with open(self.get_array_path(array), "rb") as f:
+                        self._mmaps[array] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mmaps[array].madvise(mmap.MADV_WILLNEED, aligned_start, start + row_bytes - aligned_start)
+            else:
+                # Touching one byte per page reads the whole row
+                data[index].reshape(-1).view(np.uint8)[::mmap.PAGESIZE].sum()
+
+    def __iter__(self):
+        """Iterates over the samples in order, while the next samples are prefetched in the background."""
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for index in range(min(self.prefetch, len(self))):
+                executor.submit(self.prefetch_sample, index)
+            for index in range(len(self)):
+                if index + self.prefetch < len(self):
+                    executor.submit(self.prefetch_sample, index + self.prefetch)
+                yield self[index]
@@ -0,0 +1,205 @@
+import os
+import cv2
+import json
+import argparse
+import numpy as np
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from diode_dataset import DIODEDataset
+from depthToNormal import DepthToNormalMap, SMOOTHING_FILTERS, GAUSS_SIGMA
+
+
+# The memory-mapped ground truth normals opened by a worker process, by path
+_normals_arrays = {}
+
+EVAL_KEYS = ["mean_angle", "median_angle", "threshold_11_25", "threshold_22_5", "threshold_30"]
+# The DepthToNormalMap settings of the pipelines, and of diode_metrics.ipynb, which differentiated the depth
+# in 0-1 instead of 0-255 units and blurred it with sigma 0
+DEPTH_CONVENTIONS = {
+    "pipeline": {"depth_scale": 255, "gauss_sigma": GAUSS_SIGMA},
+    "notebook": {"depth_scale": 1, "gauss_sigma": 0},
+}
+
+
+def find_samples(data_root, depth_maps_dir, splits, scene_types, cache_dir=None):
+    """
+    Finds DIODE samples which have a Marigold depth map to evaluate.
+
+    Ground truth normals are served from the memory-mapped DIODEDataset cache, Marigold depth maps are
+    expected as <depth_maps_dir>/<name>_depth_16bit.png or <depth_maps_dir>/<name>.png.
+
+    Args:
+        data_root (str): The path to the DIODE dataset.
+        depth_maps_dir (str): The path to the folder with Marigold depth maps.
+        splits (list): The splits to evaluate, e.g. ["val"].
+        scene_types (list): The scene types to evaluate, e.g. ["indoors", "outdoor"].
+        cache_dir (str, optional): The path to the DIODEDataset cache folder. Defaults to "<data_root>/cache".
+
+    Returns:
+        list: The samples as (split, scene_type, ground truth normals array path, row, depth map path) tuples.
+    """
+    depth_maps = {}
+    with os.scandir(depth_maps_dir) as entries:
+        for entry in entries:
+            name, ext = os.path.splitext(entry.name)
+            if ext == ".png":
+                depth_maps[name.replace("_depth_16bit", "")] = entry.path
+
+    samples = []
+    for split in splits:
+        for scene_type in scene_types:
+            dataset = DIODEDataset(data_root, split, scene_type, cache_dir=cache_dir, arrays=["normal"])
+            normals_path = dataset.get_array_path("normal")
+            for row, (_, name) in enumerate(dataset.samples):
+                if name in depth_maps:
+                    samples.append((split, scene_type, normals_path, row, depth_maps[name]))
+
+    return samples
+
+
+def calculate_angular_errors(gt_normals, pred_normals, chunk_rows=128):
+    """
+    Computes the angular error between ground truth normals and predicted normals of several filters.
+
+    Pixels with zero ground truth normals are invalid and left out. Rows are processed in chunks, so the
+    temporaries stay small regardless of the number of filters.
+
+    Args:
+        gt_normals (numpy.ndarray): The ground truth normals of shape (H, W, 3).
+        pred_normals (numpy.ndarray): The predicted normals of shape (F, H, W, 3), one map per filter.
+        chunk_rows (int, optional): The number of image rows processed at once. Defaults to 128.
+
+    Returns:
+        numpy.ndarray: The angular errors in degrees of shape (F, N) for the N valid pixels.
+    """
+    errors = []
+    for start in range(0, gt_normals.shape[0], chunk_rows):
+        gt_chunk = gt_normals[start:start + chunk_rows]
+        valid = np.any(gt_chunk != 0, axis=2)
+        gt_valid = gt_chunk[valid].astype(np.float32)
+        pred_valid = pred_normals[:, start:start + chunk_rows][:, valid].astype(np.float32)
+
+        dot_products = np.einsum("fnk,nk->fn", pred_valid, gt_valid)
+        np.clip(dot_products, -1.0, 1.0, out=dot_products)
+        errors.append(np.degrees(np.arccos(dot_products)))
+
+    return np.concatenate(errors, axis=1)
+
+
+def calculate_normal_metrics(angle_errors):
+    """
+    Computes the mean and median angular error and the percentage of pixels within 11.25, 22.5 and 30
+    degrees for every row of angular errors.
+
+    Args:
+        angle_errors (numpy.ndarray): The angular errors in degrees of shape (F, N).
+
+    Returns:
+        numpy.ndarray: The metrics of shape (F, 5), ordered as EVAL_KEYS.
+    """
+    thresholds = np.array([11.25, 22.5, 30], dtype=np.float32)
+    within = (angle_errors[:, :, None] < thresholds).mean(axis=1) * 100
+    return np.column_stack((angle_errors.mean(axis=1), np.median(angle_errors, axis=1), within))
+
+
+def evaluate_sample(sample, filters, chunk_rows=128, depth_convention="pipeline"):
+    """Computes the normal metrics of one sample for all filters, without writing intermediate files."""
+    split, scene_type, normals_path, row, depth_map_path = sample
+    if normals_path not in _normals_arrays:
+        _normals_arrays[normals_path] = np.load(normals_path, mmap_mode="r")
+    gt_normals = _normals_arrays[normals_path][row]
+
+    convention = DEPTH_CONVENTIONS[depth_convention]
+    converter = DepthToNormalMap(depth_map_path, depth_scale=convention["depth_scale"])
+    pred_normals = np.empty((len(filters),) + gt_normals.shape, dtype=np.float32)
+    for index, smoothing in enumerate(filters):
+        converter.calculate_normals(smoothing=smoothing, gauss_sigma=convention["gauss_sigma"])
+        pred_normals[index] = converter.normals_map
+
+    metrics = calculate_normal_metrics(calculate_angular_errors(gt_normals, pred_normals, chunk_rows))
+    return split, scene_type, metrics
+
+
+def init_worker():
+    """Keeps OpenCV single-threaded inside pool workers, the pool already uses every core."""
+    cv2.setNumThreads(1)
+
+
+def evaluate(samples, filters, workers=None, chunk_rows=128, depth_convention="pipeline"):
+    """
+    Streams samples through a process pool and aggregates the metrics per split and scene type.
+
+    Args:
+        samples (list): The samples returned by find_samples.
+        filters (list): The smoothing filters to evaluate.
+        workers (int, optional): The number of worker processes. Defaults to the number of cores.
+        chunk_rows (int, optional): The number of image rows per metric chunk. Defaults to 128.
+        depth_convention (str, optional): The DEPTH_CONVENTIONS entry normals are estimated with, "notebook"
+            reproduces the metrics of diode_metrics.ipynb. Defaults to "pipeline".
+
+    Returns:
+        dict: The results as {"<split>/<scene_type>" or "all": {filter: {metric: mean value}}}.
+    """
+    sums, counts = {}, {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        results = executor.map(evaluate_sample, samples, [filters] * len(samples), [chunk_rows] * len(samples),
+                               [depth_convention] * len(samples), chunksize=4)
+        for index, (split, scene_type, metrics) in enumerate(results, start=1):
+            for group in (f"{split}/{scene_type}", "all"):
+                sums[group] = sums.get(group, 0) + metrics
+                counts[group] = counts.get(group, 0) + 1
+            print(f"\rEvaluated {index}/{len(samples)} samples", end="", flush=True)
+    print()
+
+    results = {}
+    for group, metrics_sum in sums.items():
+        mean_metrics = metrics_sum / counts[group]
+        results[group] = {
+            smoothing: dict(zip(EVAL_KEYS, map(float, mean_metrics[index])))
+            for index, smoothing in enumerate(filters)
+        }
+        results[group]["num_samples"] = counts[group]
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Evaluate surface normals estimated from Marigold depth maps on the DIODE dataset."
+    )
+    parser.add_argument("--data_root", type=str, required=True, help="Path to the DIODE dataset")
+    parser.add_argument("--depth_maps_dir", type=str, required=True, help="Folder with Marigold depth maps")
+    parser.add_argument("--splits", type=str, nargs="+", default=["val"], choices=["train", "val"],
+                        help="Dataset splits to evaluate")
+    parser.add_argument("--scene_types", type=str, nargs="+", default=["indoors"],
+                        choices=["indoors", "outdoor"], help="Scene types to evaluate")
+    parser.add_argument("--filters", type=str, nargs="+", default=SMOOTHING_FILTERS, choices=SMOOTHING_FILTERS,
+                        help="Depth smoothing filters to evaluate")
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="Folder of the memory-mapped dataset cache (defaults to <data_root>/cache)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--chunk_rows", type=int, default=128, help="Number of image rows per metric chunk")
+    parser.add_argument("--depth_convention", type=str, default="pipeline", choices=list(DEPTH_CONVENTIONS),
+                        help="Estimate normals like the pipelines ('pipeline', depth in 0-255 units, Gaussian sigma "
+                             "1.4) or like diode_metrics.ipynb ('notebook', depth in 0-1 units, sigma 0), whose "
+                             "flatter normals give different metrics")
+    parser.add_argument("--output", type=str, default="evaluation_results/diode_normals.json",
+                        help="Output path of the results JSON")
+    args = parser.parse_args()
+
+    startTime = datetime.now()
+    samples = find_samples(args.data_root, args.depth_maps_dir, args.splits, args.scene_types,
+                           args.cache_dir)
+    print(f"Found {len(samples)} samples with depth maps")
+    results = evaluate(samples, args.filters, args.workers, args.chunk_rows, args.depth_convention)
+
+    for group, group_results in sorted(results.items()):
+        print(f"{group} ({group_results['num_samples']} samples)")
+        print(f"  {'filter':<10} " + " ".join(f"{key:>15}" for key in EVAL_KEYS))
+        for smoothing in args.filters:
+            print(f"  {smoothing:<10} " + " ".join(f"{group_results[smoothing][key]:>15.4f}" for key in EVAL_KEYS))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Evaluation results saved to: {args.output}")
+    print("Evaluation run time:", datetime.now() - startTime)
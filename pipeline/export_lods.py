@@ -0,0 +1,79 @@
+import os
+import bpy
+import sys
+import json
+import argparse
+import numpy as np
+
+# Blender does not add the script folder to the module search path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from blender import clear_scene
+from export_object_mesh import import_object, save_object_mesh
+
+
+def get_bounding_box(root, meshes):
+    """Returns the bounding box corners of the object meshes in the space of the root object, scaled by the
+        root object scale, i.e. the object size as imported by blender.py before it is resized."""
+    to_root = np.array(root.matrix_world.inverted())
+    corners = []
+    for obj in meshes:
+        to_local = to_root @ np.array(obj.matrix_world)
+        box = np.array([corner[:] for corner in obj.bound_box])
+        corners.append(box @ to_local[:3, :3].T + to_local[:3, 3])
+    corners = np.concatenate(corners) * np.array(root.scale)
+    return corners.min(axis=0), corners.max(axis=0)
+
+
+def export_lods(object_path, output_dir, ratios):
+    """
+    Imports a 3D model like blender.py does and exports a decimated FBX file and a preview mesh per
+    level of detail, described in lods.json.
+
+    Args:
+        object_path (str): The path to the 3D model file.
+        output_dir (str): The path to the output folder.
+        ratios (list): The face ratios of the levels of detail, 1.0 keeps the original model.
+    """
+    clear_scene()
+    root, meshes = import_object(object_path)
+    bbox_min, bbox_max = get_bounding_box(root, meshes)
+
+    lods = []
+    for index, ratio in enumerate(ratios):
+        for obj in meshes:
+            decimate = obj.modifiers.get("LOD") or obj.modifiers.new(name="LOD", type='DECIMATE')
+            decimate.decimate_type = 'COLLAPSE'
+            decimate.ratio = ratio
+
+        mesh_file = f"lod_{index}.npz"
+        faces = save_object_mesh(root, meshes, os.path.join(output_dir, mesh_file))
+
+        # The full detail level keeps using the original file
+        fbx_file = None
+        if ratio < 1.0:
+            fbx_file = f"lod_{index}.fbx"
+            bpy.ops.object.select_all(action='DESELECT')
+            for obj in [root] + list(root.children_recursive):
+                obj.select_set(True)
+            bpy.ops.export_scene.fbx(filepath=os.path.join(output_dir, fbx_file), use_selection=True,
+                                     use_mesh_modifiers=True, path_mode='COPY', embed_textures=True)
+
+        lods.append({"ratio": ratio, "faces": faces, "fbx": fbx_file, "mesh": mesh_file})
+
+    with open(os.path.join(output_dir, "lods.json"), "w") as f:
+        json.dump({"bbox_min": bbox_min.tolist(), "bbox_max": bbox_max.tolist(), "lods": lods}, f, indent=4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="blender -b -P export_lods.py --",
+        description="Export decimated levels of detail of a 3D model."
+    )
+    parser.add_argument("object_path", type=str, help="Path to the 3D object")
+    parser.add_argument("output_dir", type=str, help="Path to the output folder")
+    parser.add_argument("--ratios", type=float, nargs="+", default=[1.0, 0.25, 0.05],
+                        help="Face ratios of the levels of detail")
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    args = parser.parse_args(argv)
+
+    export_lods(args.object_path, args.output_dir, args.ratios)
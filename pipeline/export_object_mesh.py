@@ -0,0 +1,114 @@
+import os
+import bpy
+import sys
+import argparse
+import numpy as np
+
+# Blender does not add the script folder to the module search path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from blender import clear_scene
+
+
+def get_material_color(material):
+    """Returns the color Workbench shows for a material: the mean color of its image texture if it has
+        one, otherwise its viewport display color."""
+    if material is None:
+        return np.array([0.8, 0.8, 0.8], dtype=np.float32)
+
+    if material.use_nodes:
+        for node in material.node_tree.nodes:
+            if node.type == 'TEX_IMAGE' and node.image is not None and node.image.has_data:
+                pixels = np.empty(len(node.image.pixels), dtype=np.float32)
+                node.image.pixels.foreach_get(pixels)
+                return pixels.reshape(-1, node.image.channels)[:, :3].mean(axis=0)
+    return np.array(material.diffuse_color[:3], dtype=np.float32)
+
+
+def import_object(object_path):
+    """
+    Imports a 3D model like blender.py does.
+
+    Args:
+        object_path (str): The path to the 3D model file.
+
+    Returns:
+        tuple: The imported root object and the mesh objects of its hierarchy.
+    """
+    old_objs = set(bpy.context.scene.objects)
+    bpy.ops.import_scene.fbx(filepath=object_path)
+    imported_objs = set(bpy.context.scene.objects) - old_objs
+
+    root = next(obj for obj in imported_objs if obj.parent is None)
+    meshes = [obj for obj in imported_objs if obj.type == 'MESH' and (obj == root or root in obj.parent_recursive)]
+    return root, meshes
+
+
+def save_object_mesh(root, meshes, output_path):
+    """
+    Saves the triangulated meshes of an imported object, with their modifiers applied, for the numpy
+    preview renderer.
+
+    The vertices are stored in the local space of the root object, next to the root object rotation and
+    scale, so the preview can apply the same placement as blender.py.
+
+    Args:
+        root (bpy.types.Object): The imported root object.
+        meshes (list): The mesh objects of the root object hierarchy.
+        output_path (str): The path to the output .npz file.
+
+    Returns:
+        int: The number of saved triangles.
+    """
+    to_root = np.array(root.matrix_world.inverted())
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    vertices, faces, face_colors = [], [], []
+    vertex_offset = 0
+    for obj in meshes:
+        mesh = obj.evaluated_get(depsgraph).to_mesh()
+        mesh.calc_loop_triangles()
+
+        coordinates = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", coordinates)
+        coordinates = coordinates.reshape(-1, 3)
+        to_local = to_root @ np.array(obj.matrix_world)
+        coordinates = coordinates @ to_local[:3, :3].T + to_local[:3, 3]
+
+        triangles = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get("vertices", triangles)
+        material_indices = np.empty(len(mesh.loop_triangles), dtype=np.int32)
+        mesh.loop_triangles.foreach_get("material_index", material_indices)
+        material_colors = np.array([get_material_color(slot.material) for slot in obj.material_slots]
+                                   or [get_material_color(None)])
+
+        vertices.append(coordinates)
+        faces.append(triangles.reshape(-1, 3) + vertex_offset)
+        face_colors.append(material_colors[material_indices.clip(0, len(material_colors) - 1)])
+        vertex_offset += len(coordinates)
+        obj.evaluated_get(depsgraph).to_mesh_clear()
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    faces = np.concatenate(faces).astype(np.int32)
+    np.savez(
+        output_path,
+        vertices=np.concatenate(vertices).astype(np.float32),
+        faces=faces,
+        face_colors=np.concatenate(face_colors).astype(np.float32),
+        rotation=np.array(root.rotation_euler, dtype=np.float32),
+        scale=np.array(root.scale, dtype=np.float32),
+    )
+    return len(faces)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="blender -b -P export_object_mesh.py --",
+        description="Save the triangulated mesh of a 3D model for the numpy preview renderer."
+    )
+    parser.add_argument("object_path", type=str, help="Path to the 3D object")
+    parser.add_argument("output_path", type=str, help="Path to the output .npz file")
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    args = parser.parse_args(argv)
+
+    clear_scene()
+    root, meshes = import_object(args.object_path)
+    save_object_mesh(root, meshes, args.output_path)
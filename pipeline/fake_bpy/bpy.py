@@ -0,0 +1,615 @@
+"""A stand-in for the Blender Python API covering the calls of blender.py.
+
+Operators and data-API calls change an in-memory scene like Blender would and are recorded with cost
+counters (operator calls, created mesh vertices, data-block churn, rendered pixels), so the scene-building
+code can run and be measured without a Blender install. Put the fake_bpy folder first on the module
+search path to use it:
+
+    sys.path.insert(0, "fake_bpy")
+    import blender
+"""
+import os
+import re
+import cv2
+import types
+import pickle
+from collections import Counter
+
+
+stats = {}
+
+
+def reset_stats():
+    """Resets the cost counters."""
+    stats.clear()
+    stats.update({
+        # Operator calls by operator name, e.g. "mesh.subdivide"
+        "operators": Counter(),
+        # Property writes through the data API, e.g. obj.location = ...
+        "data_sets": 0,
+        # Data-blocks created and removed by type, e.g. "Mesh"
+        "datablocks_created": Counter(),
+        "datablocks_removed": Counter(),
+        "image_pixels_loaded": 0,
+        "mesh_vertices_created": 0,
+        "keyframes": 0,
+        # Rendered pixels and mesh vertices evaluated for the rendered frames
+        "render_pixels": 0,
+        "evaluated_vertices": 0,
+        "rendered_frames": 0,
+        "files_saved": 0,
+        "files_opened": 0,
+    })
+
+
+def get_stats():
+    """Returns a copy of the cost counters with plain dictionaries."""
+    return {key: dict(value) if isinstance(value, Counter) else value for key, value in stats.items()}
+
+
+reset_stats()
+
+
+class Struct:
+    """A data-API struct, whose property writes after construction are counted."""
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__ and not name.startswith("_"):
+            stats["data_sets"] += 1
+        if name in ("location", "rotation_euler", "scale") and not isinstance(value, Vector):
+            value = Vector(value)
+        object.__setattr__(self, name, value)
+
+
+class Vector(list):
+    """A vector property, which can be assigned as a whole or per component."""
+
+    def __setitem__(self, index, value):
+        stats["data_sets"] += 1
+        super().__setitem__(index, float(value))
+
+
+class ID(Struct):
+    """A data-block."""
+
+    def __init__(self, name):
+        self.name = name
+        stats["datablocks_created"][type(self).__name__] += 1
+
+
+class BlendDataCollection:
+    """A collection of data-blocks of one type, keyed by unique names like in Blender."""
+
+    def __init__(self, id_type):
+        self._id_type = id_type
+        self._items = {}
+
+    def unique_name(self, name):
+        if name not in self._items:
+            return name
+        base = re.sub(r"\.\d{3}$", "", name)
+        index = 1
+        while f"{base}.{index:03d}" in self._items:
+            index += 1
+        return f"{base}.{index:03d}"
+
+    def link(self, datablock):
+        datablock.name = self.unique_name(datablock.name)
+        self._items[datablock.name] = datablock
+        return datablock
+
+    def new(self, name, *args, **kwargs):
+        return self.link(self._id_type(name, *args, **kwargs))
+
+    def remove(self, datablock):
+        self.unlink(datablock)
+        stats["datablocks_removed"][type(datablock).__name__] += 1
+
+    def unlink(self, datablock):
+        del self._items[datablock.name]
+
+    def get(self, name, default=None):
+        return self._items.get(name, default)
+
+    def __getitem__(self, name):
+        return self._items[name]
+
+    def __contains__(self, name):
+        return name in self._items
+
+    def __iter__(self):
+        return iter(list(self._items.values()))
+
+    def __len__(self):
+        return len(self._items)
+
+
+class Socket(Struct):
+    def __init__(self, node, name):
+        self.node = node
+        self.name = name
+        self.default_value = None
+
+
+class SocketCollection:
+    """The sockets of a node, created on first access by name."""
+
+    def __init__(self, node):
+        self._node = node
+        self._sockets = {}
+
+    def __getitem__(self, name):
+        if name not in self._sockets:
+            self._sockets[name] = Socket(self._node, name)
+        return self._sockets[name]
+
+
+class Node(Struct):
+    def __init__(self, node_type, name):
+        self.type = node_type
+        self.name = name
+        self.location = (0, 0)
+        self.image = None
+        self.inputs = SocketCollection(self)
+        self.outputs = SocketCollection(self)
+
+
+class NodeCollection:
+    # The default names of the node types used by the scripts
+    NODE_NAMES = {
+        "ShaderNodeTexImage": "Image Texture",
+        "ShaderNodeTexEnvironment": "Environment Texture",
+        "ShaderNodeBsdfPrincipled": "Principled BSDF",
+        "ShaderNodeBackground": "Background",
+        "ShaderNodeOutputMaterial": "Material Output",
+        "ShaderNodeOutputWorld": "World Output",
+    }
+
+    def __init__(self):
+        self._nodes = {}
+
+    def new(self, node_type):
+        stats["data_sets"] += 1
+        name = self.NODE_NAMES.get(node_type, node_type)
+        index = 1
+        unique_name = name
+        while unique_name in self._nodes:
+            unique_name = f"{name}.{index:03d}"
+            index += 1
+        node = self._nodes[unique_name] = Node(node_type, unique_name)
+        return node
+
+    def get(self, name, default=None):
+        return self._nodes.get(name, default)
+
+    def __getitem__(self, name):
+        return self._nodes[name]
+
+    def __iter__(self):
+        return iter(list(self._nodes.values()))
+
+
+class NodeLinks(list):
+    def new(self, output_socket, input_socket):
+        stats["data_sets"] += 1
+        link = (output_socket, input_socket)
+        self.append(link)
+        return link
+
+
+class NodeTree(Struct):
+    def __init__(self, node_types):
+        self.nodes = NodeCollection()
+        self.links = NodeLinks()
+        for node_type in node_types:
+            self.nodes.new(node_type)
+
+    def get_images(self):
+        return [node.image for node in self.nodes if node.image is not None]
+
+
+class ColorspaceSettings(Struct):
+    def __init__(self):
+        self.name = 'sRGB'
+
+
+class Shading(Struct):
+    def __init__(self):
+        self.color_type = 'MATERIAL'
+        self.show_specular_highlight = True
+
+
+class ViewSettings(Struct):
+    def __init__(self):
+        self.view_transform = 'Filmic'
+        self.look = 'None'
+        self.exposure = 0.0
+
+
+class Image(ID):
+    def __init__(self, name, filepath):
+        super().__init__(name)
+        image = cv2.imread(filepath, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise RuntimeError(f"Error: Cannot read file '{filepath}'")
+        self.filepath = filepath
+        self.size = (image.shape[1], image.shape[0])
+        self.source = 'FILE'
+        self.colorspace_settings = ColorspaceSettings()
+        stats["image_pixels_loaded"] += image.shape[0] * image.shape[1]
+
+
+class ImageCollection(BlendDataCollection):
+    def load(self, filepath):
+        stats["operators"]["data.images.load"] += 1
+        return self.link(Image(os.path.basename(filepath), filepath))
+
+
+class Texture(ID):
+    def __init__(self, name, type='IMAGE'):
+        super().__init__(name)
+        self.type = type
+        self.image = None
+
+
+class Material(ID):
+    def __init__(self, name):
+        super().__init__(name)
+        self.node_tree = None
+        self.use_nodes = False
+
+    @property
+    def use_nodes(self):
+        return self.node_tree is not None
+
+    @use_nodes.setter
+    def use_nodes(self, value):
+        if value and self.node_tree is None:
+            self.node_tree = NodeTree(["ShaderNodeBsdfPrincipled", "ShaderNodeOutputMaterial"])
+
+
+class World(ID):
+    def __init__(self, name):
+        super().__init__(name)
+        self.color = Vector([0.05, 0.05, 0.05])
+        self.node_tree = None
+
+    @property
+    def use_nodes(self):
+        return self.node_tree is not None
+
+    @use_nodes.setter
+    def use_nodes(self, value):
+        if value and self.node_tree is None:
+            self.node_tree = NodeTree(["ShaderNodeBackground", "ShaderNodeOutputWorld"])
+
+
+class Mesh(ID):
+    def __init__(self, name, vertices=0, faces=0):
+        super().__init__(name)
+        self.vertex_count = vertices
+        self.face_count = faces
+        self.materials = []
+        self.smooth = False
+        stats["mesh_vertices_created"] += vertices
+
+
+class Camera(ID):
+    def __init__(self, name):
+        super().__init__(name)
+        self.type = 'PERSP'
+        self.ortho_scale = 6.0
+        self.sensor_fit = 'AUTO'
+        self.angle = 0.6911
+
+
+class Modifier(Struct):
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+        self.texture = None
+        self.strength = 1.0
+
+
+class ModifierCollection(list):
+    def new(self, name, type):
+        stats["data_sets"] += 1
+        modifier = Modifier(name, type)
+        self.append(modifier)
+        return modifier
+
+    def get(self, name, default=None):
+        return next((modifier for modifier in self if modifier.name == name), default)
+
+
+class Object(ID):
+    def __init__(self, name, data=None):
+        super().__init__(name)
+        self.data = data
+        self.type = {Mesh: 'MESH', Camera: 'CAMERA'}.get(type(data), 'EMPTY')
+        self.location = (0, 0, 0)
+        self.rotation_euler = (0, 0, 0)
+        self.scale = (1, 1, 1)
+        self.parent = None
+        self.modifiers = ModifierCollection()
+        self._selected = False
+
+    def select_set(self, state):
+        stats["data_sets"] += 1
+        self._selected = bool(state)
+
+    def select_get(self):
+        return self._selected
+
+    def keyframe_insert(self, data_path, frame=None):
+        stats["keyframes"] += 1
+        return True
+
+    def __hash__(self):
+        return id(self)
+
+
+class RenderSettings(Struct):
+    def __init__(self):
+        self.engine = 'BLENDER_EEVEE'
+        self.resolution_x = 1920
+        self.resolution_y = 1080
+        self.resolution_percentage = 100
+        self.filepath = "/tmp/"
+        self.film_transparent = False
+
+
+class Scene(ID):
+    def __init__(self, name):
+        super().__init__(name)
+        self.objects = BlendDataCollection(Object)
+        self.camera = None
+        self.world = None
+        self.render = RenderSettings()
+        self.display = types.SimpleNamespace(shading=Shading())
+        self.view_settings = ViewSettings()
+        self.frame_start = 1
+        self.frame_end = 250
+        self.frame_current = 1
+
+
+class Context:
+    def __init__(self):
+        self.scene = None
+        self.screen = None
+        self.object = None
+        self.mode = 'OBJECT'
+
+    @property
+    def active_object(self):
+        return self.object
+
+    @property
+    def selected_objects(self):
+        return [obj for obj in self.scene.objects if obj.select_get()]
+
+
+class BlendData:
+    def __init__(self):
+        self.objects = BlendDataCollection(Object)
+        self.meshes = BlendDataCollection(Mesh)
+        self.cameras = BlendDataCollection(Camera)
+        self.images = ImageCollection(Image)
+        self.textures = BlendDataCollection(Texture)
+        self.materials = BlendDataCollection(Material)
+        self.worlds = BlendDataCollection(World)
+        self.scenes = BlendDataCollection(Scene)
+
+
+data = BlendData()
+context = Context()
+app = types.SimpleNamespace(handlers=types.SimpleNamespace(render_pre=[], render_write=[]), version=(4, 1, 0))
+
+
+def reset_data():
+    """Resets the fake Blender to its startup file, a scene with a world, a camera and a cube."""
+    global data
+    data = BlendData()
+    scene = data.scenes.new("Scene")
+    scene.world = data.worlds.new("World")
+    scene.world.use_nodes = True
+    context.scene = scene
+    context.object = None
+    context.mode = 'OBJECT'
+    add_object("Camera", data.cameras.new("Camera"))
+    add_object("Cube", data.meshes.new("Cube", vertices=8, faces=6))
+    reset_stats()
+
+
+def add_object(name, object_data=None, location=(0, 0, 0), rotation=(0, 0, 0), scale=(1, 1, 1)):
+    """Adds an object to the scene, selects it and makes it active, like the add operators do."""
+    for obj in context.scene.objects:
+        obj.select_set(False)
+    obj = data.objects.new(name, object_data)
+    obj.location, obj.rotation_euler, obj.scale = location, rotation, scale
+    context.scene.objects.link(obj)
+    obj.select_set(True)
+    context.object = obj
+    return obj
+
+
+class Operator:
+    """A bpy.ops operator, whose calls are counted."""
+
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+
+    def __call__(self, *args, **kwargs):
+        stats["operators"][self.name] += 1
+        result = self.function(*args, **kwargs)
+        return result or {'FINISHED'}
+
+    def poll(self):
+        return True
+
+
+def operator_namespace(module, functions):
+    return types.SimpleNamespace(**{
+        name: Operator(f"{module}.{name}", function) for name, function in functions.items()
+    })
+
+
+def require_mode(mode, operator):
+    if context.mode != mode:
+        raise RuntimeError(f"Operator bpy.ops.{operator}.poll() failed, context is incorrect")
+
+
+def select_all(action='TOGGLE'):
+    objects = list(context.scene.objects)
+    if action == 'TOGGLE':
+        action = 'DESELECT' if any(obj.select_get() for obj in objects) else 'SELECT'
+    for obj in objects:
+        obj.select_set(action == 'SELECT' or (action == 'INVERT' and not obj.select_get()))
+
+
+def delete(use_global=False, confirm=True):
+    require_mode('OBJECT', "object.delete")
+    for obj in context.selected_objects:
+        context.scene.objects.unlink(obj)
+        data.objects.remove(obj)
+        if context.object is obj:
+            context.object = None
+
+
+def orphans_purge(do_local_ids=True, do_linked_ids=True, do_recursive=False):
+    """Removes the data-blocks no scene object, material or world uses any more."""
+    used = set()
+    for scene in data.scenes:
+        used.add(id(scene.world))
+        if scene.world is not None and scene.world.node_tree is not None:
+            used.update(id(image) for image in scene.world.node_tree.get_images())
+    for obj in data.objects:
+        used.add(id(obj.data))
+        for modifier in obj.modifiers:
+            if modifier.texture is not None:
+                used.update((id(modifier.texture), id(modifier.texture.image)))
+        for material in getattr(obj.data, "materials", []):
+            used.add(id(material))
+            if material.node_tree is not None:
+                used.update(id(image) for image in material.node_tree.get_images())
+
+    for collection in (data.meshes, data.cameras, data.images, data.textures, data.materials):
+        for datablock in collection:
+            if id(datablock) not in used:
+                collection.remove(datablock)
+
+
+def camera_add(enter_editmode=False, align='WORLD', location=(0, 0, 0), rotation=(0, 0, 0), scale=(1, 1, 1)):
+    add_object("Camera", data.cameras.new("Camera"), location, rotation, scale)
+
+
+def primitive_plane_add(size=2, enter_editmode=False, align='WORLD', location=(0, 0, 0), rotation=(0, 0, 0),
+                        scale=(1, 1, 1)):
+    add_object("Plane", data.meshes.new("Plane", vertices=4, faces=1), location, rotation, scale)
+    if enter_editmode:
+        context.mode = 'EDIT_MESH'
+
+
+def editmode_toggle():
+    context.mode = 'OBJECT' if context.mode == 'EDIT_MESH' else 'EDIT_MESH'
+
+
+def subdivide(number_cuts=1, smoothness=0):
+    """Subdivides the quads of the active mesh, every quad becomes (number_cuts + 1) ** 2 quads."""
+    require_mode('EDIT_MESH', "mesh.subdivide")
+    mesh = context.object.data
+    cells = number_cuts + 1
+    # A grid of quads keeps its outline, so its vertices follow from the number of quads per side
+    side = round(mesh.face_count ** 0.5)
+    new_vertex_count = (side * cells + 1) ** 2
+    stats["mesh_vertices_created"] += new_vertex_count - mesh.vertex_count
+    mesh.vertex_count = new_vertex_count
+    mesh.face_count *= cells * cells
+
+
+def shade_smooth():
+    require_mode('OBJECT', "object.shade_smooth")
+    for obj in context.selected_objects:
+        if obj.type == 'MESH':
+            obj.data.smooth = True
+
+
+def import_fbx(filepath, **kwargs):
+    """Imports an FBX file as an armature-free root object with a single cube mesh child."""
+    if not os.path.exists(filepath):
+        raise RuntimeError(f"Error: File not found: {filepath}")
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    for obj in context.scene.objects:
+        obj.select_set(False)
+    mesh = data.meshes.new(name, vertices=8, faces=6)
+    mesh.materials.append(data.materials.new(name))
+    obj = data.objects.new(name, mesh)
+    # FBX files are Y-up, the importer rotates them to Blender's Z-up
+    obj.rotation_euler = (1.5708, 0, 0)
+    context.scene.objects.link(obj)
+    obj.select_set(True)
+    context.object = obj
+
+
+def resize(value=(1, 1, 1), **kwargs):
+    for obj in context.selected_objects:
+        obj.scale = tuple(axis * factor for axis, factor in zip(obj.scale, value))
+
+
+def render(animation=False, write_still=False, **kwargs):
+    """Renders the current frame or all frames, calling the render handlers like Blender does."""
+    scene = context.scene
+    frames = range(scene.frame_start, scene.frame_end + 1) if animation else [scene.frame_current]
+    pixels = scene.render.resolution_x * scene.render.resolution_y * scene.render.resolution_percentage // 100
+    vertices = sum(obj.data.vertex_count for obj in scene.objects if obj.type == 'MESH')
+    for frame in frames:
+        scene.frame_current = frame
+        for handler in app.handlers.render_pre:
+            handler(scene)
+        stats["render_pixels"] += pixels
+        stats["evaluated_vertices"] += vertices
+        stats["rendered_frames"] += 1
+        for handler in app.handlers.render_write:
+            handler(scene)
+
+
+def pack_all():
+    """Packs the external images into the file, which the fake Blender does not need to do."""
+    for image in data.images:
+        image.packed = True
+
+
+def save_as_mainfile(filepath, copy=False, **kwargs):
+    """Saves the data-blocks and the active scene, here as a pickle instead of a .blend file."""
+    with open(filepath, "wb") as f:
+        pickle.dump((data, context.scene), f)
+    stats["files_saved"] += 1
+
+
+def open_mainfile(filepath, **kwargs):
+    """Replaces all data-blocks with the ones of a saved file, like Blender does."""
+    global data
+    with open(filepath, "rb") as f:
+        data, context.scene = pickle.load(f)
+    context.object = None
+    context.mode = 'OBJECT'
+    app.handlers.render_pre.clear()
+    app.handlers.render_write.clear()
+    stats["files_opened"] += 1
+
+
+ops = types.SimpleNamespace(
+    object=operator_namespace("object", {
+        "select_all": select_all, "delete": delete, "camera_add": camera_add,
+        "editmode_toggle": editmode_toggle, "shade_smooth": shade_smooth,
+    }),
+    outliner=operator_namespace("outliner", {"orphans_purge": orphans_purge}),
+    mesh=operator_namespace("mesh", {"primitive_plane_add": primitive_plane_add, "subdivide": subdivide}),
+    import_scene=operator_namespace("import_scene", {"fbx": import_fbx}),
+    transform=operator_namespace("transform", {"resize": resize}),
+    render=operator_namespace("render", {"render": render}),
+    wm=operator_namespace("wm", {"open_mainfile": open_mainfile, "save_as_mainfile": save_as_mainfile}),
+    file=operator_namespace("file", {"pack_all": pack_all}),
+)
+reset_data()
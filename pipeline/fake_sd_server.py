@@ -0,0 +1,246 @@
+import io
+import json
+import time
+import zlib
+import base64
+import argparse
+import threading
+import urllib.parse
+import numpy as np
+from PIL import Image
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def generate_fake_image(prompt: str, seed: int, width: int, height: int) -> Image.Image:
+    """
+    Generates a deterministic stand-in scene image: a sky gradient over a ground gradient with noise,
+    whose colors depend on the prompt and the seed.
+
+    Args:
+        prompt (str): The scene prompt.
+        seed (int): The generation seed.
+        width (int): The image width.
+        height (int): The image height.
+
+    Returns:
+        PIL.Image.Image: The generated RGB image.
+    """
+    rng = np.random.default_rng([zlib.crc32(prompt.encode()), seed])
+    sky_color, ground_color = rng.integers(0, 256, size=(2, 3))
+    horizon = int(height * rng.uniform(0.3, 0.6))
+
+    rows = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None, None]
+    image = np.where(
+        np.arange(height)[:, None, None] < horizon,
+        sky_color * (0.6 + 0.4 * rows),
+        ground_color * (0.4 + 0.6 * rows),
+    )
+    image = np.broadcast_to(image, (height, width, 3)) + rng.normal(0, 8, size=(height, width, 3))
+    return Image.fromarray(image.clip(0, 255).astype(np.uint8))
+
+
+class FakeAutomatic1111:
+    """A lightweight stand-in of the automatic1111 API state, which returns deterministic images after a
+        configurable latency."""
+
+    def __init__(self, latency: float = 0.0, step_latency: float = 0.0, checkpoint_latency: float = 0.0) -> None:
+        """
+        Args:
+            latency (float, optional): The fixed latency of every txt2img call in seconds. Defaults to 0.
+            step_latency (float, optional): The latency of every sampling step and image in seconds.
+                Defaults to 0.
+            checkpoint_latency (float, optional): The latency of switching checkpoints in seconds. Defaults to 0.
+
+        Attributes:
+            checkpoint (str): The currently loaded checkpoint.
+            counters (dict): The number of calls served by every endpoint.
+            job (dict): The state of the running generation, None when idle.
+        """
+        self.latency = latency
+        self.step_latency = step_latency
+        self.checkpoint_latency = checkpoint_latency
+        self.checkpoint = None
+        self.counters = {"options": 0, "txt2img": 0, "checkpoint_switches": 0, "progress": 0, "interrupt": 0}
+        self.job = None
+        self.lock = threading.Lock()
+        # Like automatic1111, generations are queued and run one at a time
+        self.generation_lock = threading.Lock()
+
+    def get_options(self) -> dict:
+        """Serves GET /sdapi/v1/options."""
+        with self.lock:
+            self.counters["options"] += 1
+            return {"sd_model_checkpoint": self.checkpoint}
+
+    def set_options(self, payload: dict) -> dict:
+        """Serves POST /sdapi/v1/options, simulating the checkpoint loading time."""
+        checkpoint = payload.get("sd_model_checkpoint")
+        with self.lock:
+            self.counters["options"] += 1
+            switch = checkpoint is not None and checkpoint != self.checkpoint
+            if switch:
+                self.counters["checkpoint_switches"] += 1
+                self.checkpoint = checkpoint
+        if switch:
+            time.sleep(self.checkpoint_latency)
+        return {}
+
+    def txt2img(self, payload: dict) -> dict:
+        """Serves POST /sdapi/v1/txt2img with a batch of deterministic images."""
+        prompt = payload.get("prompt", "")
+        width, height = int(payload.get("width", 512)), int(payload.get("height", 512))
+        batch_size = int(payload.get("batch_size", 1))
+        steps = int(payload.get("steps", 20))
+        seed = int(payload.get("seed", -1))
+        if seed == -1:
+            seed = zlib.crc32(prompt.encode()) % (2**31)
+        # The hires fix refines the images at the hires size in a second pass of its own steps
+        if payload.get("enable_hr"):
+            scale = float(payload.get("hr_scale", 2.0))
+            width = int(payload.get("hr_resize_x") or width * scale)
+            height = int(payload.get("hr_resize_y") or height * scale)
+            steps += int(payload.get("hr_second_pass_steps") or steps)
+
+        with self.generation_lock:
+            with self.lock:
+                self.counters["txt2img"] += 1
+                self.job = {"prompt": prompt, "seed": seed, "step": 0, "steps": steps, "interrupted": False}
+
+            time.sleep(self.latency)
+            for step in range(steps):
+                if self.job["interrupted"]:
+                    break
+                time.sleep(self.step_latency * batch_size)
+                self.job["step"] = step + 1
+
+            with self.lock:
+                self.job = None
+
+        images, seeds = [], []
+        for index in range(batch_size):
+            buffer = io.BytesIO()
+            generate_fake_image(prompt, seed + index, width, height).save(buffer, format="PNG")
+            images.append(base64.b64encode(buffer.getvalue()).decode())
+            seeds.append(seed + index)
+
+        info = {"prompt": prompt, "seed": seed, "all_seeds": seeds, "width": width, "height": height}
+        return {"images": images, "parameters": payload, "info": json.dumps(info)}
+
+    def get_progress(self, skip_current_image: bool = True) -> dict:
+        """Serves GET /sdapi/v1/progress with a noisy low-resolution preview of the running generation."""
+        with self.lock:
+            self.counters["progress"] += 1
+            job = dict(self.job) if self.job else None
+
+        if job is None:
+            state = {"interrupted": False, "skipped": False, "job_count": 0, "sampling_step": 0, "sampling_steps": 0}
+            return {"progress": 0.0, "eta_relative": 0.0, "state": state, "current_image": None, "textinfo": None}
+
+        progress = job["step"] / max(job["steps"], 1)
+        eta = (job["steps"] - job["step"]) * self.step_latency
+        state = {
+            "interrupted": job["interrupted"],
+            "skipped": False,
+            "job_count": 1,
+            "sampling_step": job["step"],
+            "sampling_steps": job["steps"],
+        }
+
+        current_image = None
+        if not skip_current_image and job["step"] > 0:
+            preview = np.asarray(generate_fake_image(job["prompt"], job["seed"], 128, 128), dtype=np.float32)
+            noise = np.random.default_rng(job["step"]).normal(0, 128 * (1 - progress), size=preview.shape)
+            buffer = io.BytesIO()
+            Image.fromarray((preview + noise).clip(0, 255).astype(np.uint8)).save(buffer, format="PNG")
+            current_image = base64.b64encode(buffer.getvalue()).decode()
+
+        return {"progress": progress, "eta_relative": eta, "state": state, "current_image": current_image,
+                "textinfo": None}
+
+    def interrupt(self) -> dict:
+        """Serves POST /sdapi/v1/interrupt, the running generation stops after its current step."""
+        with self.lock:
+            self.counters["interrupt"] += 1
+            if self.job:
+                self.job["interrupted"] = True
+        return {}
+
+
+class FakeAutomatic1111Handler(BaseHTTPRequestHandler):
+    """Routes automatic1111 API requests to the FakeAutomatic1111 state of the server."""
+
+    def send_json(self, data: dict, status: int = 200) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == "/sdapi/v1/options":
+            self.send_json(self.server.state.get_options())
+        elif url.path == "/sdapi/v1/progress":
+            skip_current_image = query.get("skip_current_image", ["false"])[0].lower() == "true"
+            self.send_json(self.server.state.get_progress(skip_current_image))
+        else:
+            self.send_json({"detail": "Not Found"}, status=404)
+
+    def do_POST(self):
+        payload = self.read_json()
+        if self.path == "/sdapi/v1/options":
+            self.send_json(self.server.state.set_options(payload))
+        elif self.path == "/sdapi/v1/txt2img":
+            self.send_json(self.server.state.txt2img(payload))
+        elif self.path in ("/sdapi/v1/interrupt", "/sdapi/v1/skip"):
+            self.send_json(self.server.state.interrupt())
+        else:
+            self.send_json({"detail": "Not Found"}, status=404)
+
+    def log_message(self, format, *args):
+        """Keeps the server quiet, request logs would distort benchmark timings."""
+
+
+def start_server(host: str = "127.0.0.1", port: int = 7860, **state_kwargs) -> ThreadingHTTPServer:
+    """
+    Starts the stand-in automatic1111 server in a background thread.
+
+    Args:
+        host (str, optional): The host to listen on. Defaults to "127.0.0.1".
+        port (int, optional): The port to listen on, 0 picks a free one. Defaults to 7860.
+        **state_kwargs: The latency settings passed to FakeAutomatic1111.
+
+    Returns:
+        ThreadingHTTPServer: The running server, its url is "http://{host}:{server.server_port}".
+    """
+    server = ThreadingHTTPServer((host, port), FakeAutomatic1111Handler)
+    server.daemon_threads = True
+    server.state = FakeAutomatic1111(**state_kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a local stand-in of the automatic1111 API returning deterministic images."
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to listen on")
+    parser.add_argument("--port", type=int, default=7860, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fixed latency of every txt2img call (s)")
+    parser.add_argument("--step_latency", type=float, default=0.0, help="Latency of every step and image (s)")
+    parser.add_argument("--checkpoint_latency", type=float, default=0.0, help="Latency of checkpoint switches (s)")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), FakeAutomatic1111Handler)
+    server.state = FakeAutomatic1111(args.latency, args.step_latency, args.checkpoint_latency)
+    print(f"Stand-in automatic1111 API running on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
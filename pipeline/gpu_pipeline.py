@@ -1,16 +1,35 @@
 import os
-import io
-import cv2
-import json
-import torch
 import base64
 import argparse
-import requests
+import shutil
 import subprocess
-from PIL import Image
 from datetime import datetime
-from tkinter import filedialog as fd
-from depthToNormal import DepthToNormalMap
+from concurrent.futures import ThreadPoolExecutor, wait
+from artifact_store import ArtifactStore
+from asset_preprocess import get_object_lod_path
+from stages import lazy_import, preload, get_device_capabilities, run_child_process, terminate_child_processes
+from tracing import start_trace, finish_trace, span, traced
+
+# Heavy modules are imported on first use, so the command line starts without them
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+fd = lazy_import("tkinter.filedialog")
+sd_client = lazy_import("sd_client")
+depthToNormal = lazy_import("depthToNormal")
+depth_refinement = lazy_import("depth_refinement")
+point_selector = lazy_import("point_selector")
+preview_renderer = lazy_import("preview_renderer")
+
+# The hires pass of the "hires" draft mode refines the accepted draft, keeping its composition
+DRAFT_DENOISING_STRENGTH = 0.45
+
+
+def positive_int(value):
+    """Parses a command line integer which has to be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
 
 
 class Pipeline:
@@ -19,7 +38,9 @@ class Pipeline:
 
     def __init__(
         self, prompt, negative_prompt, width, height, steps, sampler_name,
-        cfg_scale, seed, checkpoint, marigold_checkpoint
+        cfg_scale, seed, checkpoint, marigold_checkpoint, num_candidates=1,
+        sd_url="http://localhost:7860", depth_mode="full", lighting="sh", draft_mode="off", draft_scale=0.5,
+        draft_steps=10, use_lods=True
     ):
         """
         Args:
@@ -33,16 +54,38 @@ class Pipeline:
             seed (int): The seed value for reproducibility.
             checkpoint (str): The path to the Stable diffusion model checkpoint.
             marigold_checkpoint (str): The path to the Marigold model checkpoint.
+            num_candidates (int, optional): The number of scene images generated in one batched call
+                to choose from, at least 1. Defaults to 1.
+            sd_url (str, optional): The automatic1111 url. Defaults to "http://localhost:7860".
+            depth_mode (str, optional): "full" runs Marigold at its default processing resolution, "fast"
+                runs it at a reduced resolution and upsamples the depth map guided by the scene image, "roi"
+                runs the fast pass and refines the depth around the selected point with a high resolution
+                pass. Defaults to "full".
+            lighting (str, optional): "sh" lights the render with spherical harmonics computed from the scene
+                image, "hdri" with the full HDRI image of the scene image. Defaults to "sh".
+            draft_mode (str, optional): "off" generates candidates at full size and steps, "hires" generates
+                drafts at a reduced size and step count and re-renders the accepted one at full size with the
+                same seed in a hires pass, "upscale" upscales the accepted draft locally. Defaults to "off".
+            draft_scale (float, optional): The draft size as a share of the width and height. Defaults to 0.5.
+            draft_steps (int, optional): The number of steps of drafts. Defaults to 10.
+            use_lods (bool, optional): Whether objects are rendered with the level of detail matching their
+                projected size, if the levels of detail were already exported. Defaults to True.
 
         Attributes:
-            sd_url (str): The automatic1111 url.
+            sd_client (StableDiffusionClient): The pooled client for the automatic1111 API.
             max_depth (int): The maximum depth value used in depth-to-normal conversion.
             output_folder_path (str): The path to the folder where results will be saved.
+            artifact_store (ArtifactStore): The store of stage outputs keyed by their inputs and parameters,
+                used to skip stages whose outputs already exist.
+
+        Raises:
+            ValueError: If num_candidates is below 1.
         """
-        self.sd_url = "http://localhost:7860"
+        self.sd_url = sd_url
         self.max_depth = 255
         self.output_folder_path = "results"
-        self.enable_gpu = True if torch.cuda.is_available() else False
+        self.artifact_store = ArtifactStore(os.path.join(self.output_folder_path, "artifacts"))
+        self.enable_gpu = get_device_capabilities()["cuda"]
 
         self.prompt = prompt
         self.negative_prompt = negative_prompt
@@ -54,6 +97,16 @@ class Pipeline:
         self.seed = seed
         self.checkpoint = checkpoint
         self.marigold_checkpoint = marigold_checkpoint
+        if num_candidates < 1:
+            raise ValueError(f"At least one candidate has to be generated, got {num_candidates}")
+        self.num_candidates = num_candidates
+        self.depth_mode = depth_mode
+        self.lighting = lighting
+        self.draft_mode = draft_mode
+        self.draft_scale = draft_scale
+        self.draft_steps = draft_steps
+        self.use_lods = use_lods
+        self.sd_client = sd_client.StableDiffusionClient(self.sd_url)
 
     def run_pipeline(self):
         """Run the pipeline."""
@@ -68,125 +121,338 @@ class Pipeline:
         print("Seed:", self.seed)
         print("Stable Diffusion checkpoint:", self.checkpoint)
         print("Marigold checkpoint:", self.marigold_checkpoint)
+        print("Depth mode:", self.depth_mode)
+        print("Lighting:", self.lighting)
+        if self.draft_mode != "off":
+            draft_width, draft_height = self.get_draft_size()
+            print(f"Draft mode: {self.draft_mode} ({draft_width}x{draft_height}, {self.draft_steps} steps)")
+        print("Number of candidates:", self.num_candidates)
         print("----------------------------------------------")
 
         startTime = datetime.now()
 
-        if not os.path.exists(self.output_folder_path):
-            os.makedirs(self.output_folder_path)
-        
-        self.run_scene_generation()
-        print("Scene image has been generated and selected!")
-
-        _ = input('Exit automatic1111 (input "ok" when done): ')
-        self.generate_depth_map()
-        print("Depth map has been generated!")
+        # Spans of every stage, including child processes and Blender, are collected into one trace
+        trace_name = startTime.strftime("%Y-%m-%d-%H-%M-%S")
+        trace_path = os.path.join(self.output_folder_path, "traces", f"{trace_name}.jsonl")
+        start_trace(trace_path)
 
-        # Select the 3D object to place at the generated scene
-        self.object_3d_path = self.upload_3d_object()
-        print("3D object has been selected!")
+        try:
+            with span("pipeline.run"):
+                if not os.path.exists(self.output_folder_path):
+                    os.makedirs(self.output_folder_path)
+        
+                self.run_scene_generation()
+                print("Scene image has been generated and selected!")
+
+                # Stages that only depend on the scene image run in background workers, overlapping
+                # with the interactive object and point selection done on the main thread
+                with ThreadPoolExecutor(max_workers=3) as executor:
+                    # Generated HDRI image for scene lightning
+                    hdri_future = executor.submit(self.generate_hdri_image)
+                    # The modules of the interactive stages are imported while automatic1111 is being closed
+                    executor.submit(preload, "dialogs", "point_selection", "normals", "preview")
+
+                    with span("pipeline.wait_for_automatic1111_exit"):
+                        _ = input('Exit automatic1111 (input "ok" when done): ')
+                    depth_future = executor.submit(self.generate_depth_map)
+
+                    # Select the 3D object to place at the generated scene
+                    self.object_3d_path = self.upload_3d_object()
+                    print("3D object has been selected!")
+                    # The preview mesh is exported while the point is being selected
+                    self.preview_mesh_future = executor.submit(preview_renderer.get_preview_mesh, self.object_3d_path, self.artifact_store)
+
+                    # Select the point where to place selected object at the scene
+                    self.selected_point = self.choose_point(self.scene_image_path)
+                    if self.selected_point is None:
+                        print("Point selection has been cancelled, stopping the pipeline.")
+                        # Leaving the executor waits for its workers, so the running stages are stopped by
+                        # terminating their child processes, also those started while shutting down
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        background_futures = [hdri_future, depth_future, self.preview_mesh_future]
+                        while not all(future.done() for future in background_futures):
+                            terminate_child_processes()
+                            wait(background_futures, timeout=0.1)
+                        return
+                    print("Target point has been selected!")
+
+                    depth_future.result()
+                    print("Depth map has been generated!")
+
+                    # Get normal map for generated scene image
+                    with span("pipeline.normals"):
+                        self.depth_to_normal_converter = depthToNormal.DepthToNormalMap(self.depth_map_path, max_depth=self.max_depth)
+                        self.get_normal_map()
+                    print("Normal map has been generated!")
+
+                    # Get surface normal vector for the selected point
+                    self.get_surface_normal_vector(self.selected_point)
+                    self.preview_renderer = self.create_preview_renderer()
+                    self.draw_normal_to_surface()
+
+                    if self.depth_mode == "roi":
+                        self.refine_depth_map()
+                        print("Depth map has been refined around the target point!")
+
+                    hdri_future.result()
+                    print("HDRI image has been generated!")
+
+                self.generate_blender_scene()
+        finally:
+            chrome_trace_path = os.path.join(self.output_folder_path, "traces", f"{trace_name}.json")
+            finish_trace(trace_path, chrome_trace_path)
+            print("Pipeline trace saved as", chrome_trace_path)
+        print("Pipeline run time:", datetime.now() - startTime)
 
-        # Select the point where to place selected object at the scene
-        self.selected_point = self.choose_point(self.scene_image_path)
-        print("Target point has been selected!")
+    def get_draft_size(self):
+        """Returns the draft width and height, rounded to the multiples of 8 Stable Diffusion works with."""
+        return tuple(max(64, int(round(size * self.draft_scale / 8)) * 8) for size in (self.width, self.height))
 
-        # Get normal map for generated scene image
-        self.depth_to_normal_converter = DepthToNormalMap(self.depth_map_path, max_depth=self.max_depth)
-        self.get_normal_map()
-        print("Normal map has been generated!")
+    def generate_scene(self):
+        """
+        Run scene image generation process using provided arguments for the model. While the image is
+            being generated, its progress is printed and intermediate previews are shown. Pressing 'S' in
+            the preview window interrupts the generation. In the draft modes the candidates are drafts of
+            reduced size and step count.
 
-        # Get surface normal vector for the selected point
-        self.get_surface_normal_vector(self.selected_point)
-        self.draw_normal_to_surface()
+        Returns:
+            tuple: The generated candidate images as base64 encoded strings and their seeds, empty lists if
+                the user skipped the generation.
+        """
+        try:
+            width, height, steps = self.width, self.height, self.steps
+            if self.draft_mode != "off":
+                (width, height), steps = self.get_draft_size(), self.draft_steps
+
+            print("Generating scene image... (press 'S' in the preview window to skip it)")
+            generation = self.sd_client.submit_txt2img(
+                self.prompt, self.negative_prompt, width, height, steps,
+                self.sampler_name, self.cfg_scale, self.seed, self.checkpoint,
+                batch_size=self.num_candidates, return_seeds=True
+            )
+            skipped = self.monitor_generation(generation)
+            scene_images, seeds = generation.result()
+            return ([], []) if skipped else (scene_images, seeds)
 
-        # Generated HDRI image for scene lightning
-        self.generate_hdri_image()
-        print("HDRI image has been generated!")
+        except Exception as exc:
+            print(f"Error while generating scene image: {exc}")
 
-        self.generate_blender_scene()
+    @traced("pipeline.finish_draft")
+    def finish_draft(self, draft, seed):
+        """
+        Turns the accepted draft into the full size scene image. The "hires" mode generates the draft again
+            from its seed, size and steps and refines it at full size and steps in a hires pass, so the
+            composition is kept. The "upscale" mode, and the "hires" mode when its generation is skipped or
+            fails, upscale the draft locally.
 
-        print("Pipeline run time:", datetime.now() - startTime)
+        Args:
+            draft (PIL.Image.Image): The accepted draft.
+            seed (int): The seed of the draft.
 
-    def generate_scene(self):
-        """Run scene image generation process using provided arguments for the model."""
-        try:
-            url = self.sd_url + "/sdapi/v1/options"
+        Returns:
+            PIL.Image.Image: The full size scene image.
+        """
+        if self.draft_mode == "hires":
+            try:
+                draft_width, draft_height = self.get_draft_size()
+                print("Re-rendering the selected draft at full size... (press 'S' to upscale it locally instead)")
+                hires = {
+                    "hr_scale": self.width / draft_width,
+                    "hr_resize_x": self.width,
+                    "hr_resize_y": self.height,
+                    "hr_second_pass_steps": self.steps,
+                    "denoising_strength": DRAFT_DENOISING_STRENGTH,
+                    "hr_upscaler": "Latent",
+                }
+                generation = self.sd_client.submit_txt2img(
+                    self.prompt, self.negative_prompt, draft_width, draft_height, self.draft_steps,
+                    self.sampler_name, self.cfg_scale, seed, self.checkpoint, hires=hires
+                )
+                skipped = self.monitor_generation(generation)
+                scene_images = generation.result()
+                if not skipped:
+                    return sd_client.decode_image(scene_images[0])
+            except Exception as exc:
+                print(f"Error while re-rendering the draft: {exc}")
+
+        with span("pipeline.upscale_draft"):
+            return sd_client.upscale_image(draft, (self.width, self.height))
+
+    def monitor_generation(self, generation, poll_interval=0.5):
+        """
+        Polls the progress of a running generation and shows its intermediate previews.
 
-            payload = {'sd_model_checkpoint': self.checkpoint}
-            response = requests.post(url=url, json=payload)
+        Args:
+            generation (concurrent.futures.Future): The running generation.
+            poll_interval (float, optional): The time between progress polls in seconds. Defaults to 0.5.
 
-            url = self.sd_url + "/sdapi/v1/txt2img"
-            with open("payload_base.json", "r") as f:
-                payload = json.load(f)
+        Returns:
+            bool: Whether the user interrupted the generation.
+        """
+        window_name = "Generation Preview"
+        skipped = False
+
+        # Show a blank window until the first preview arrives, so the generation can be skipped right away
+        cv2.imshow(window_name, np.zeros((256, 256, 3), dtype=np.uint8))
+
+        while not generation.done():
+            progress = self.sd_client.get_progress()
+            print(f"\rProgress: {progress['progress'] * 100:5.1f}% "
+                  f"(ETA {progress['eta_relative']:.1f} s)", end="", flush=True)
+
+            if progress.get("current_image"):
+                preview = np.frombuffer(base64.b64decode(progress["current_image"]), dtype=np.uint8)
+                cv2.imshow(window_name, cv2.imdecode(preview, cv2.IMREAD_COLOR))
+
+            # Waiting for a key press also keeps the preview window responsive between polls
+            key = cv2.waitKey(int(poll_interval * 1000)) & 0xFF
+            if key == ord('s') or key == ord('S'):
+                self.sd_client.interrupt()
+                skipped = True
+                print("\nGeneration skipped, the next one is queued.")
+                break
 
-            payload["override_settings"]["sd_model_checkpoint"] = self.checkpoint
-            payload["prompt"] = self.prompt
-            payload["negative_prompt"] = self.negative_prompt
-            payload["width"] = self.width
-            payload["height"] = self.height
-            payload["steps"] = self.steps
-            payload["sampler_name"] = self.sampler_name
-            payload["cfg_scale"] = self.cfg_scale
-            payload["seed"] = self.seed
+        print()
+        cv2.destroyWindow(window_name)
+        return skipped
 
-            print("Generating scene image...")
-            response = requests.post(url=url, json=payload)
-            return response.json()["images"][0]
+    def select_candidate(self, candidates):
+        """
+        Shows generated candidates and asks the user which one to proceed with.
 
-        except Exception as exc:
-            print(f"Error while generating scene image: {exc}")
+        Args:
+            candidates (list): The generated candidate images as PIL images.
 
+        Returns:
+            PIL.Image.Image: The selected image, or None if all candidates were rejected.
+        """
+        if len(candidates) == 1:
+            candidates[0].show()
+            prompt = "Proceed with the generated image? (yes/no): "
+        else:
+            sd_client.make_image_grid(candidates).show()
+            prompt = f"Select the image to proceed with (1-{len(candidates)}), or 'no' to regenerate: "
+
+        # Ask user whether generated image is good enought to proceed with
+        while True:
+            user_input = input(prompt).strip().lower()
+            if user_input == 'no':
+                return None
+            elif len(candidates) == 1 and user_input == 'yes':
+                return candidates[0]
+            elif user_input.isdigit() and 1 <= int(user_input) <= len(candidates):
+                return candidates[int(user_input) - 1]
+            elif len(candidates) == 1:
+                print("Invalid input. Please enter 'yes' or 'no'.")
+            else:
+                print(f"Invalid input. Please enter a number from 1 to {len(candidates)} or 'no'.")
+
+    @traced("pipeline.scene_generation")
     def run_scene_generation(self):
         """Run scene image generation process using provided text prompt. Process continues
             generating images until the user receives one they consider good enough to proceed with."""
         try:
-            scene_img = self.generate_scene()
-            print("Scene image generated!")
-    
             prompt_words = self.prompt.split()[:5]
             cleaned_words = [word.replace(',', '').replace('.', '') for word in prompt_words]
             image_name = f"scene_{'_'.join(cleaned_words)}.png"
-            self.scene_image_path = os.path.join(self.output_folder_path, image_name)
-
-            img = Image.open(io.BytesIO(base64.b64decode(scene_img)))
-            img.save(self.scene_image_path)
-            print(f"Scene image saved in folder {self.output_folder_path} as {image_name}")
-
-            img = Image.open(self.scene_image_path)
-            img.show()
-
-            # Ask user whether generated image is good enought to proceed with
-            while True:
-                user_input = input("Proceed with the generated image? (yes/no): ").strip().lower()
-                if user_input == 'yes':
-                    break
-                elif user_input == 'no':
-                    self.run_scene_generation()
-                    break
-                else:
-                    print("Invalid input. Please enter 'yes' or 'no'.")
-        
+
+            def generate(output_dir):
+                img = None
+                while img is None:
+                    generation = self.generate_scene()
+                    if generation is None:
+                        raise RuntimeError("Scene image generation failed")
+                    scene_images, seeds = generation
+                    if not scene_images:
+                        continue
+                    print("Scene image generated!")
+                    candidates = [sd_client.decode_image(scene_img) for scene_img in scene_images]
+                    img = self.select_candidate(candidates)
+                # Full size images are only generated for the accepted draft
+                if self.draft_mode != "off":
+                    seed = next(seed for candidate, seed in zip(candidates, seeds) if candidate is img)
+                    img = self.finish_draft(img, seed)
+                img.save(os.path.join(output_dir, image_name))
+
+            params = {
+                "prompt": self.prompt,
+                "negative_prompt": self.negative_prompt,
+                "width": self.width,
+                "height": self.height,
+                "steps": self.steps,
+                "sampler_name": self.sampler_name,
+                "cfg_scale": self.cfg_scale,
+                "seed": self.seed,
+                "checkpoint": self.checkpoint,
+            }
+            if self.draft_mode != "off":
+                params.update({"draft_mode": self.draft_mode, "draft_scale": self.draft_scale,
+                               "draft_steps": self.draft_steps})
+            # Only a single generation with a fixed seed is fully determined by its parameters
+            reproducible = self.seed != -1 and self.num_candidates == 1
+            artifacts = self.artifact_store.run_stage("scene", {"scene_image": image_name}, generate,
+                                                      params=params, reproducible=reproducible)
+            self.scene_image_path = artifacts["scene_image"]
+            print(f"Scene image saved as {self.scene_image_path}")
+
         except Exception as exc:
             print(f"Error while generating scene image: {exc}")
 
+    @traced("pipeline.depth")
     def generate_depth_map(self):
         """Run depth map generation process from the scene image using Marigold model."""
         try:
-            args = [
-                "python",
-                "depth_estimation_marigold.py",
-                "--checkpoint", self.marigold_checkpoint,
-                "--input_image_path", self.scene_image_path,
-            ]
-            subprocess.run(args, check=True)
-
-            root, ext = os.path.splitext(self.scene_image_path)
-            output_depth_path = f"{root}_depth{ext}"
-            self.depth_map_path = output_depth_path
+            # The region around the selected point is refined later in the "roi" mode
+            depth_mode = "full" if self.depth_mode == "full" else "fast"
+
+            def estimate_depth(output_dir):
+                args = [
+                    "python",
+                    "depth_estimation_marigold.py",
+                    "--checkpoint", self.marigold_checkpoint,
+                    "--input_image_path", self.scene_image_path,
+                    "--output_dir", output_dir,
+                    "--depth_mode", depth_mode,
+                ]
+                run_child_process(args)
+
+            root, ext = os.path.splitext(os.path.basename(self.scene_image_path))
+            outputs = {"depth_map": f"{root}_depth{ext}", "colored_depth_map": f"{root}_col_depth{ext}"}
+            artifacts = self.artifact_store.run_stage("depth", outputs, estimate_depth,
+                                                      input_paths=[self.scene_image_path],
+                                                      params={"marigold_checkpoint": self.marigold_checkpoint,
+                                                              "depth_mode": depth_mode})
+            self.depth_map_path = artifacts["depth_map"]
 
         except Exception as exc:
             print(f"Error while generating depth image: {exc}")
 
+    @traced("pipeline.depth_refinement")
+    def refine_depth_map(self):
+        """Refines the depth map around the selected point with a high resolution Marigold pass, and
+            updates the normal map and the surface normal at the point."""
+        try:
+            def refine(output_dir):
+                depth_refinement.refine_depth_roi(self.scene_image_path, self.depth_map_path,
+                                                  self.selected_point, output_dir, self.marigold_checkpoint)
+
+            root, ext = os.path.splitext(os.path.basename(self.depth_map_path))
+            artifacts = self.artifact_store.run_stage(
+                "depth_roi", {"depth_map": f"{root}_refined.png"}, refine,
+                input_paths=[self.scene_image_path, self.depth_map_path],
+                params={"marigold_checkpoint": self.marigold_checkpoint, "point": list(self.selected_point),
+                        "roi_size": depth_refinement.ROI_SIZE}
+            )
+            self.depth_map_path = artifacts["depth_map"]
+
+            self.depth_to_normal_converter = depthToNormal.DepthToNormalMap(self.depth_map_path, max_depth=self.max_depth)
+            self.get_normal_map()
+            self.get_surface_normal_vector(self.selected_point)
+
+        except Exception as exc:
+            print(f"Error while refining depth image: {exc}")
+
+    @traced("pipeline.object_selection")
     def upload_3d_object(self):
         """
         Prompts the user to select a 3D object file.
@@ -198,34 +464,19 @@ class Pipeline:
                                        filetypes=[("Object files", "*.fbx")])
         return file_path
     
+    @traced("pipeline.point_selection")
     def choose_point(self, image_path):
         """
-        Allows the user to select a point on an image.
+        Allows the user to select a point on an image. Clicking pins a point and pressing 'Enter'
+            accepts it, closing the window without a pinned point cancels the selection.
 
         Args:
             image_path (str): The path to the image file.
 
         Returns:
-            tuple: The coordinates (x, y) of the selected point.
+            tuple: The coordinates (x, y) of the selected point, or None if the selection was cancelled.
         """
-        def on_mouse_click(event, x, y, flags, param):
-            """Handles mouse click events."""
-            if event == cv2.EVENT_LBUTTONDOWN:
-                nonlocal point
-                point = (x, y)
-                cv2.destroyAllWindows()
-
-        point = None
-        image = cv2.imread(image_path)
-        window_name = "Select Point"
-
-        cv2.imshow(window_name, image)
-        cv2.setMouseCallback(window_name, on_mouse_click)
-
-        while point is None:
-            cv2.waitKey(100)
-
-        return point
+        return point_selector.PointSelector(image_path).select()
     
     def get_normal_map(self):
         """Calculates normal vectors for the entire image."""
@@ -237,71 +488,126 @@ class Pipeline:
         self.normal_to_surface = self.depth_to_normal_converter.normals_map[y, x]
         self.depth_value = self.depth_to_normal_converter.depth_map[y, x]
 
+    @traced("pipeline.render")
     def generate_blender_scene(self):
         """Calls Blender for scene generation and object placement."""
         try:
-            command = [
-                "blender",
-                "-P",
-                "blender.py",
-                "--",
-                self.depth_map_path,
-                self.scene_image_path,
-                self.hdri_image_path,
-                self.object_3d_path,
-                str(self.selected_point[0]),
-                str(self.selected_point[1]),
-                str(self.normal_to_surface[0]),
-                str(self.normal_to_surface[1]),
-                str(self.normal_to_surface[2]),
-                str(self.depth_value),
-                str(self.enable_gpu)
-            ]
-            subprocess.run(command)
+            # Small or far away objects are rendered with a decimated level of detail, if it is exported
+            object_path = self.object_3d_path
+            if self.use_lods:
+                image_height = self.depth_to_normal_converter.depth_map.shape[0]
+                object_path = get_object_lod_path(self.object_3d_path, self.depth_value, image_height,
+                                                  self.artifact_store, cached_only=True)
+
+            def render(output_dir):
+                command = [
+                    "blender",
+                    "-P",
+                    "blender.py",
+                    "--",
+                    self.depth_map_path,
+                    self.scene_image_path,
+                    self.hdri_image_path,
+                    object_path,
+                    str(self.selected_point[0]),
+                    str(self.selected_point[1]),
+                    str(self.normal_to_surface[0]),
+                    str(self.normal_to_surface[1]),
+                    str(self.normal_to_surface[2]),
+                    str(self.depth_value),
+                    str(self.enable_gpu),
+                    "--output_path", os.path.abspath(os.path.join(output_dir, "render.png")),
+                    "--snapshot_dir", os.path.join(self.output_folder_path, "blend_snapshots")
+                ]
+                subprocess.run(command)
+
+            params = {
+                "selected_point": [int(value) for value in self.selected_point],
+                "normal_to_surface": [float(value) for value in self.normal_to_surface],
+                "depth_value": float(self.depth_value),
+                "enable_gpu": self.enable_gpu,
+            }
+            input_paths = [self.depth_map_path, self.scene_image_path, self.hdri_image_path, object_path]
+            artifacts = self.artifact_store.run_stage("render", {"render": "render.png"}, render,
+                                                      input_paths=input_paths, params=params)
+
+            # Keep a copy of the result named by the execution date (ex: 2024-03-31-9-46-22)
+            timestamp = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+            output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../rendered_results/",
+                                       f"{timestamp}.png")
+            shutil.copyfile(artifacts["render"], output_path)
+            print(f"Rendered image saved as {output_path}")
 
         except Exception as exc:
             print(f"Error while generating scene in Blender: {exc}")
 
-    def draw_normal_to_surface(self):
-        """Draws normal vector to the surface at the selected point."""
-        image = cv2.imread(self.scene_image_path)
+    def create_preview_renderer(self):
+        """
+        Prepares the Blender-free placement preview of the selected object.
+
+        Returns:
+            PreviewRenderer: The preview renderer, or None if the object mesh could not be loaded.
+        """
+        try:
+            return preview_renderer.PreviewRenderer(self.scene_image_path, self.depth_map_path, self.preview_mesh_future.result())
+        except Exception as exc:
+            print(f"Error while preparing the placement preview: {exc}")
+            return None
+
+    def draw_placement_preview(self):
+        """Returns the scene image with the placed object preview and the surface normal at the selected point."""
         x, y = self.selected_point
+        if self.preview_renderer is not None:
+            image = self.preview_renderer.render(x, y, self.normal_to_surface, self.depth_value)
+        else:
+            image = cv2.imread(self.scene_image_path)
+
         arrow_length = 50
         end_point = (int(x + arrow_length * self.normal_to_surface[0]), int(y + arrow_length * self.normal_to_surface[1]))
         cv2.arrowedLine(image, (x, y), end_point, (0, 255, 0), thickness=2)
+        return image
 
-        while True:
-            cv2.imshow("Normal to the Surface at the Selected Point", image)
-            key = cv2.waitKey(1) & 0xFF
-
-            if key == ord('r') or key == ord('R'):
-                # Allow user to reselect the point by pressing 'R'
-                cv2.destroyAllWindows()
-                self.selected_point = self.choose_point(self.scene_image_path)
-                self.get_surface_normal_vector(self.selected_point)
-                x, y = self.selected_point
-                image = cv2.imread(self.scene_image_path)
-                end_point = (int(x + arrow_length * self.normal_to_surface[0]), int(y + arrow_length * self.normal_to_surface[1]))
-                cv2.arrowedLine(image, (x, y), end_point, (0, 255, 0), thickness=2)
-
-            # Press 'ESC' or 'Enter' to exit
-            elif key == 27 or key == 13:
-                cv2.destroyAllWindows()
-                break
+    @traced("pipeline.normal_preview")
+    def draw_normal_to_surface(self):
+        """Shows the object preview and the surface normal at the selected point, while the depth and
+            surface normal under the cursor are shown live. Clicking moves the point without Blender."""
+        def render_preview(point):
+            self.selected_point = point
+            self.get_surface_normal_vector(point)
+            return self.draw_placement_preview()
+
+        selector = point_selector.PointSelector(self.scene_image_path, self.depth_to_normal_converter.depth_map,
+                                 self.depth_to_normal_converter.normals_map,
+                                 window_name="Normal to the Surface at the Selected Point")
+        # Closing the window after unpinning keeps the last pinned point
+        point = selector.select(self.selected_point, render_preview)
+        if point is not None:
+            self.selected_point = point
+        self.get_surface_normal_vector(self.selected_point)
 
+    @traced("pipeline.hdri")
     def generate_hdri_image(self):
         """Run HDRI image generation process from the scene image."""
         try:
-            args = [
-                "python",
-                "background_enhancement.py",
-                "--input_image_path", self.scene_image_path
-            ]
-            subprocess.run(args, check=True)
-
-            root, ext = os.path.splitext(self.scene_image_path)
-            output_hdri_path =  f"{root}_hdri{ext}"
-            self.hdri_image_path = output_hdri_path
+            def generate(output_dir):
+                args = [
+                    "python",
+                    "background_enhancement.py",
+                    "--input_image_path", self.scene_image_path,
+                    "--output_dir", output_dir,
+                    "--lighting", self.lighting
+                ]
+                run_child_process(args)
+
+            root, ext = os.path.splitext(os.path.basename(self.scene_image_path))
+            if self.lighting == "sh":
+                # The lighting file is passed to Blender in place of the HDRI image
+                outputs = {"hdri_image": f"{root}_lighting.json", "environment_map": f"{root}_lighting_env.hdr"}
+            else:
+                outputs = {"hdri_image": f"{root}_hdri{ext}"}
+            artifacts = self.artifact_store.run_stage("hdri", outputs, generate, input_paths=[self.scene_image_path],
+                                                      params={"lighting": self.lighting})
+            self.hdri_image_path = artifacts["hdri_image"]
 
         except Exception as exc:
             print(f"Error while generating HDRI image: {exc}")
@@ -390,6 +696,66 @@ if __name__ == "__main__":
             "Bingxin/Marigold"
         ]
     )
+    parser.add_argument(
+        "--depth_mode",
+        type=str,
+        help="Marigold depth mode, 'fast' infers depth at a reduced resolution and upsamples it guided by "
+             "the scene image, 'roi' also refines the depth around the selected point at a high resolution",
+        required=False,
+        default="full",
+        choices=["full", "fast", "roi"]
+    )
+    parser.add_argument(
+        "--lighting",
+        type=str,
+        help="Light the render with spherical harmonics computed from the scene image ('sh'), or with the "
+             "full HDRI image of the scene image ('hdri')",
+        required=False,
+        default="sh",
+        choices=["sh", "hdri"]
+    )
+    parser.add_argument(
+        "--draft_mode",
+        type=str,
+        help="Browse candidates as drafts of reduced size and steps, the accepted one is re-rendered at full "
+             "size with the same seed in a hires pass ('hires') or upscaled locally ('upscale')",
+        required=False,
+        default="off",
+        choices=["off", "hires", "upscale"]
+    )
+    parser.add_argument(
+        "--draft_scale",
+        type=float,
+        help="Draft size as a share of the width and height",
+        required=False,
+        default=0.5
+    )
+    parser.add_argument(
+        "--draft_steps",
+        type=int,
+        help="Number of steps of drafts",
+        required=False,
+        default=10
+    )
+    parser.add_argument(
+        "--candidates",
+        type=positive_int,
+        help="Number of scene images generated in one batch to choose from",
+        required=False,
+        default=1
+    )
+    parser.add_argument(
+        "--no_lods",
+        action="store_true",
+        help="Render the original 3D object instead of its exported levels of detail",
+    )
+    parser.add_argument(
+        "--sd_url",
+        type=str,
+        help="automatic1111 url",
+        required=False,
+        default="http://localhost:7860"
+    )
     args = parser.parse_args()
 
     pipeline = Pipeline(
@@ -402,7 +768,15 @@ if __name__ == "__main__":
         args.cfg_scale,
         args.seed,
         args.checkpoint,
-        args.marigold_checkpoint
+        args.marigold_checkpoint,
+        args.candidates,
+        args.sd_url,
+        args.depth_mode,
+        args.lighting,
+        args.draft_mode,
+        args.draft_scale,
+        args.draft_steps,
+        not args.no_lods
     )
 
     pipeline.run_pipeline()
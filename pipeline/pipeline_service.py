@@ -0,0 +1,415 @@
+import os
+import json
+import base64
+import shutil
+import hashlib
+import binascii
+import argparse
+import threading
+import urllib.parse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from batch_pipeline import BatchRunner, normalize_job, get_job_id, check_points
+from depth_estimation_marigold import DepthModel
+
+
+# The job keys which can be sent as file uploads instead of paths
+UPLOAD_KEYS = ("scene_image", "depth_map", "object_path")
+# How long an event stream waits for new events at a time, in seconds
+EVENT_POLL_TIMEOUT = 15.0
+
+
+class JobExistsError(Exception):
+    """Raised when a job is submitted with the id of a known job."""
+
+
+class PipelineService:
+    """The state of the pipeline service: a queue of composition jobs run by one shared BatchRunner, so the
+        automatic1111 client, the Marigold model, the artifact store and the render core partitions are reused
+        across requests."""
+
+    def __init__(self, runner: BatchRunner, workers: int = 2) -> None:
+        """
+        Args:
+            runner (BatchRunner): The runner of the jobs, whose stage limits bound the concurrency of the
+                depth, normals and render stages across all jobs. A runner without a depth model gets one, so
+                Marigold is loaded once for all jobs instead of once per job.
+            workers (int, optional): The number of jobs processed concurrently. Defaults to 2.
+
+        Attributes:
+            jobs (dict): The job records by job id, with the "status" ("queued", "running", "completed" or
+                "failed"), the "events" of the started stages, the "renders" and the "error" of failed jobs.
+            uploads_folder_path (str): The path to the folder where uploaded job files are saved.
+            reserved_ids (set): The ids of submitted jobs which are still being validated.
+        """
+        self.runner = runner
+        if runner.depth_model is None:
+            runner.depth_model = DepthModel(runner.marigold_checkpoint)
+        self.jobs = {}
+        self.reserved_ids = set()
+        self.uploads_folder_path = os.path.join(runner.output_folder_path, "uploads")
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def decode_uploads(self, uploads):
+        """
+        Checks and decodes base64 encoded job files.
+
+        Args:
+            uploads (dict): The job keys mapped to {"name": file name, "data": base64 content}.
+
+        Returns:
+            dict: The job keys mapped to the file names (without folders) and the decoded contents.
+
+        Raises:
+            ValueError: If an upload is not for a job file or misses its name or content.
+        """
+        if not isinstance(uploads, dict):
+            raise ValueError("The 'uploads' have to map job keys to files")
+        files = {}
+        for key, upload in uploads.items():
+            if key not in UPLOAD_KEYS:
+                raise ValueError(f"Uploads are accepted for {', '.join(UPLOAD_KEYS)}, not '{key}'")
+            if not isinstance(upload, dict) or not isinstance(upload.get("name"), str) \
+                    or not isinstance(upload.get("data"), str):
+                raise ValueError(f"The '{key}' upload needs a 'name' and base64 'data'")
+            # Only the base name is kept, uploads cannot write outside of their folder
+            name = os.path.basename(upload["name"])
+            if name in ("", ".", ".."):
+                raise ValueError(f"The '{key}' upload has an invalid name '{upload['name']}'")
+            try:
+                files[key] = (name, base64.b64decode(upload["data"], validate=True))
+            except binascii.Error:
+                raise ValueError(f"The '{key}' upload data is not base64 encoded")
+        return files
+
+    def save_uploads(self, job_id, files):
+        """
+        Saves decoded job files into the upload folder of the job, replacing earlier uploads.
+
+        Args:
+            job_id (str): The job id.
+            files (dict): The job keys mapped to the file names and contents.
+
+        Returns:
+            dict: The job keys mapped to the saved file paths.
+        """
+        upload_folder = os.path.join(self.uploads_folder_path, job_id)
+        shutil.rmtree(upload_folder, ignore_errors=True)
+        paths = {}
+        for key, (name, content) in files.items():
+            os.makedirs(upload_folder, exist_ok=True)
+            path = os.path.join(upload_folder, name)
+            with open(path, "wb") as f:
+                f.write(content)
+            paths[key] = path
+        return paths
+
+    def submit(self, payload: dict) -> dict:
+        """
+        Validates a job, saves its uploads and queues it.
+
+        Jobs without an "id" are named after their content, like batch manifest jobs, so their results
+        folder is only reused by the same job. Like in a manifest, repeated identical jobs get the number of
+        their occurrence appended, so a job with a random seed can be submitted again. The results folder of
+        a job with its own id, left over by an earlier service run, is cleared, as it may hold the results
+        of a different job.
+
+        Args:
+            payload (dict): The job with the keys of a batch manifest line, and optional "uploads".
+
+        Returns:
+            dict: The queued job record.
+
+        Raises:
+            ValueError: If the job is invalid, refers to missing files or has points outside of its images.
+            JobExistsError: If a job with the same explicit id was already submitted.
+        """
+        if not isinstance(payload, dict):
+            raise ValueError("The job has to be a JSON object")
+        job = dict(payload)
+        files = self.decode_uploads(job.pop("uploads", {}))
+        for key, (name, _) in files.items():
+            job[key] = name
+        normalize_job(job, os.getcwd(), "Job")
+        for key in UPLOAD_KEYS:
+            if job.get(key) and key not in files and not os.path.exists(job[key]):
+                raise ValueError(f"Job refers to a missing file {job[key]}")
+
+        own_id = bool(job.get("id"))
+        if own_id:
+            job_id = str(job["id"])
+            if os.path.basename(job_id) != job_id or job_id.startswith("."):
+                raise ValueError(f"Invalid job id '{job_id}'")
+        else:
+            file_hashes = {key: hashlib.sha256(content).hexdigest() for key, (_, content) in files.items()}
+            job_id = get_job_id(job, file_hashes)
+
+        # The id is reserved before any file is written, so concurrent submissions cannot share it
+        with self.condition:
+            if own_id and (job_id in self.jobs or job_id in self.reserved_ids):
+                raise JobExistsError(f"Job {job_id} already exists")
+            occurrence = 1
+            while job_id in self.jobs or job_id in self.reserved_ids:
+                occurrence += 1
+                job_id = get_job_id(job, file_hashes, occurrence)
+            self.reserved_ids.add(job_id)
+        job["id"] = job_id
+        try:
+            if own_id:
+                shutil.rmtree(self.runner.get_job_folder(job), ignore_errors=True)
+            job.update(self.save_uploads(job_id, files))
+            try:
+                width, height = self.runner.get_image_size(job)
+                check_points(job["points"], width, height)
+            except ValueError:
+                shutil.rmtree(os.path.join(self.uploads_folder_path, job_id), ignore_errors=True)
+                raise
+
+            record = {
+                "id": job_id,
+                "status": "queued",
+                "points": job["points"],
+                "events": [],
+                "renders": [],
+                "error": None,
+            }
+            with self.condition:
+                self.jobs[job_id] = record
+                self.add_event(job_id, "queued")
+        finally:
+            with self.condition:
+                self.reserved_ids.discard(job_id)
+        self.executor.submit(self.run_job, job)
+        return self.get_job(job_id)
+
+    def add_event(self, job_id, stage, **details):
+        """Records a job event and wakes up the event streams of the job."""
+        with self.condition:
+            record = self.jobs[job_id]
+            record["events"].append({"stage": stage, "time": datetime.now().isoformat(), **details})
+            if stage == "rendered":
+                record["renders"].append(os.path.basename(details["path"]))
+            self.condition.notify_all()
+
+    def set_status(self, job_id, status, error=None):
+        """Sets the job status and records it as an event."""
+        with self.condition:
+            self.jobs[job_id]["status"] = status
+            self.jobs[job_id]["error"] = error
+            self.add_event(job_id, status, **({"error": error} if error else {}))
+
+    def run_job(self, job):
+        """Runs a queued job through all pipeline stages."""
+        self.set_status(job["id"], "running")
+        try:
+            self.runner.run_job(job, progress=lambda stage, **details: self.add_event(job["id"], stage, **details))
+            self.set_status(job["id"], "completed")
+        except Exception as exc:
+            print(f"Error while running job {job['id']}: {exc}")
+            self.set_status(job["id"], "failed", str(exc))
+
+    def get_job(self, job_id):
+        """Returns a copy of the job record, or None for an unknown job."""
+        with self.condition:
+            record = self.jobs.get(job_id)
+            if record is None:
+                return None
+            return {**record, "events": list(record["events"]), "renders": list(record["renders"])}
+
+    def get_jobs(self):
+        """Returns the id and status of every job."""
+        with self.condition:
+            return [{"id": record["id"], "status": record["status"]} for record in self.jobs.values()]
+
+    def wait_for_events(self, job_id, start, timeout=EVENT_POLL_TIMEOUT):
+        """
+        Waits until the job has events after the first start ones, or until it is done.
+
+        Args:
+            job_id (str): The job id.
+            start (int): The number of events already seen.
+            timeout (float, optional): The maximum waiting time in seconds. Defaults to EVENT_POLL_TIMEOUT.
+
+        Returns:
+            tuple: The new events and whether the job is done.
+        """
+        with self.condition:
+            record = self.jobs[job_id]
+
+            def is_done():
+                return record["status"] in ("completed", "failed")
+
+            self.condition.wait_for(lambda: len(record["events"]) > start or is_done(), timeout)
+            return list(record["events"][start:]), is_done()
+
+    def get_render_path(self, job_id, name):
+        """Returns the path of a job render, or None if the job has no render with this name."""
+        with self.condition:
+            record = self.jobs.get(job_id)
+            if record is None or name not in record["renders"]:
+                return None
+        return os.path.join(self.runner.output_folder_path, job_id, name)
+
+    def get_status(self):
+        """Returns the number of jobs per status and the utilisation of the render workers."""
+        counts = {}
+        with self.condition:
+            for record in self.jobs.values():
+                counts[record["status"]] = counts.get(record["status"], 0) + 1
+        return {"jobs": counts, "render_workers": self.runner.render_scheduler.get_report()}
+
+
+class PipelineServiceHandler(BaseHTTPRequestHandler):
+    """Routes job requests to the PipelineService state of the server.
+
+        POST /jobs                        queues a job and returns its record
+        GET  /jobs                        lists the jobs and their status
+        GET  /jobs/<id>                   returns the job record with its events and renders
+        GET  /jobs/<id>/events            streams the job events as JSON lines until the job is done
+        GET  /jobs/<id>/renders/<name>    returns a rendered image
+        GET  /status                      returns the job counts and the render worker utilisation
+    """
+
+    def send_json(self, data, status: int = 200) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_events(self, job_id):
+        """Streams the job events as JSON lines, the response ends once the job is done."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        start, done = 0, False
+        while not done:
+            events, done = self.server.service.wait_for_events(job_id, start)
+            start += len(events)
+            for event in events:
+                self.wfile.write((json.dumps(event) + "\n").encode())
+            self.wfile.flush()
+
+    def send_file(self, path, content_type="image/png"):
+        with open(path, "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        parts = [urllib.parse.unquote(part) for part in urllib.parse.urlparse(self.path).path.strip("/").split("/")]
+        if parts == ["status"]:
+            self.send_json(service.get_status())
+        elif parts == ["jobs"]:
+            self.send_json(service.get_jobs())
+        elif len(parts) >= 2 and parts[0] == "jobs" and service.get_job(parts[1]) is None:
+            self.send_json({"detail": f"Unknown job {parts[1]}"}, status=404)
+        elif len(parts) == 2 and parts[0] == "jobs":
+            self.send_json(service.get_job(parts[1]))
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events":
+            self.send_events(parts[1])
+        elif len(parts) == 4 and parts[0] == "jobs" and parts[2] == "renders":
+            render_path = service.get_render_path(parts[1], parts[3])
+            if render_path is None:
+                self.send_json({"detail": f"Unknown render {parts[3]}"}, status=404)
+            else:
+                self.send_file(render_path)
+        else:
+            self.send_json({"detail": "Not Found"}, status=404)
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self.send_json({"detail": "Not Found"}, status=404)
+            return
+        try:
+            self.send_json(self.server.service.submit(self.read_json()), status=202)
+        except JobExistsError as exc:
+            self.send_json({"detail": str(exc)}, status=409)
+        except (ValueError, TypeError) as exc:
+            self.send_json({"detail": str(exc)}, status=400)
+
+    def log_message(self, format, *args):
+        """Keeps the server quiet, job progress is reported through the job events."""
+
+
+def start_server(runner: BatchRunner, host: str = "127.0.0.1", port: int = 8080, workers: int = 2):
+    """
+    Starts the pipeline service in a background thread.
+
+    Args:
+        runner (BatchRunner): The runner of the jobs.
+        host (str, optional): The host to listen on. Defaults to "127.0.0.1".
+        port (int, optional): The port to listen on, 0 picks a free one. Defaults to 8080.
+        workers (int, optional): The number of jobs processed concurrently. Defaults to 2.
+
+    Returns:
+        ThreadingHTTPServer: The running server, its url is "http://{host}:{server.server_port}".
+    """
+    server = ThreadingHTTPServer((host, port), PipelineServiceHandler)
+    server.daemon_threads = True
+    server.service = PipelineService(runner, workers)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a local HTTP service which queues composition jobs and runs them without any interaction."
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--output_dir", type=str, default="results/service",
+                        help="Output directory with a results folder per job")
+    parser.add_argument("--workers", type=int, default=2, help="Number of jobs processed concurrently")
+    parser.add_argument("--depth_workers", type=int, default=1, help="Number of concurrent Marigold depth estimations")
+    parser.add_argument("--normals_workers", type=int, default=2,
+                        help="Number of concurrent normal map calculations")
+    parser.add_argument("--render_workers", type=int, default=1, help="Number of concurrent Blender renders")
+    parser.add_argument("--sd_url", type=str, default="http://localhost:7860",
+                        help="automatic1111 url, used for jobs with a prompt")
+    parser.add_argument("--marigold_checkpoint", type=str, default="prs-eth/marigold-lcm-v1-0",
+                        choices=["prs-eth/marigold-lcm-v1-0", "prs-eth/marigold-v1-0", "Bingxin/Marigold"],
+                        help="Marigold checkpoint path or hub name")
+    parser.add_argument("--depth_mode", type=str, default="full", choices=["full", "fast"],
+                        help="Marigold depth mode, 'fast' infers depth at a reduced resolution and upsamples it")
+    parser.add_argument("--lighting", type=str, default="sh", choices=["sh", "hdri"],
+                        help="Light the renders with spherical harmonics or with the full HDRI image")
+    parser.add_argument("--enable_gpu", action="store_true", help="Render with GPU in Blender")
+    parser.add_argument("--no_lods", action="store_true",
+                        help="Render objects at full detail instead of the level of detail matching their projected size")
+    args = parser.parse_args()
+
+    runner = BatchRunner(
+        args.output_dir,
+        workers=args.workers,
+        depth_workers=args.depth_workers,
+        render_workers=args.render_workers,
+        normals_workers=args.normals_workers,
+        sd_url=args.sd_url,
+        marigold_checkpoint=args.marigold_checkpoint,
+        enable_gpu=args.enable_gpu,
+        use_lods=not args.no_lods,
+        depth_mode=args.depth_mode,
+        lighting=args.lighting
+    )
+    server = ThreadingHTTPServer((args.host, args.port), PipelineServiceHandler)
+    server.daemon_threads = True
+    server.service = PipelineService(runner, args.workers)
+    print(f"Pipeline service running on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        server.service.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,185 @@
+import cv2
+import math
+import numpy as np
+
+
+# Images larger than this are shown at a pyramid level which fits the screen
+MAX_DISPLAY_SIZE = 1600
+
+
+class DepthPyramid:
+    """Depth and normal maps at halving resolutions, where every level is built on first use."""
+
+    def __init__(self, depth_map, normals_map) -> None:
+        """
+        Args:
+            depth_map (numpy.ndarray): The normalized float32 depth map.
+            normals_map (numpy.ndarray): The float32 normal map of shape (H, W, 3).
+        """
+        self.levels = [(depth_map, normals_map)]
+
+    def get_level(self, level: int):
+        """Returns the depth and normal maps of a pyramid level, level 0 being the full resolution."""
+        while len(self.levels) <= level:
+            depth_map, normals_map = self.levels[-1]
+            depth_map = cv2.pyrDown(depth_map)
+            normals_map = cv2.pyrDown(normals_map)
+            normals_map /= np.maximum(np.linalg.norm(normals_map, axis=2, keepdims=True), 1e-6)
+            self.levels.append((depth_map, normals_map))
+        return self.levels[level]
+
+    def lookup(self, x: int, y: int, level: int = 0):
+        """
+        Looks up the depth and the surface normal at a full resolution point.
+
+        Args:
+            x (int): The x coordinate at full resolution.
+            y (int): The y coordinate at full resolution.
+            level (int, optional): The pyramid level to read, coarser levels average larger neighborhoods.
+
+        Returns:
+            tuple: The depth value and the normal vector.
+        """
+        depth_map, normals_map = self.get_level(level)
+        row = min(y >> level, depth_map.shape[0] - 1)
+        col = min(x >> level, depth_map.shape[1] - 1)
+        return depth_map[row, col], normals_map[row, col]
+
+
+class PointSelector:
+    """An interactive point selector, which sleeps until the next window event and only redraws the area
+        around the cursor when it moves. The depth and surface normal under the cursor are shown live."""
+
+    def __init__(self, image, depth_map=None, normals_map=None, window_name="Select Point",
+                 max_display_size=MAX_DISPLAY_SIZE) -> None:
+        """
+        Args:
+            image (numpy.ndarray or str): The scene image (BGR) or the path to it.
+            depth_map (numpy.ndarray, optional): The normalized depth map shown under the cursor.
+            normals_map (numpy.ndarray, optional): The normal map shown under the cursor.
+            window_name (str, optional): The window title. Defaults to "Select Point".
+            max_display_size (int, optional): The maximum displayed image side in pixels.
+                Defaults to MAX_DISPLAY_SIZE.
+
+        Attributes:
+            level (int): The pyramid level of the displayed image, points are scaled by 2 ** level.
+            pyramid (DepthPyramid): The depth and normal pyramid, None without a depth map.
+        """
+        self.image = cv2.imread(image) if isinstance(image, str) else image
+        self.window_name = window_name
+        height, width = self.image.shape[:2]
+        self.level = max(0, math.ceil(math.log2(max(height, width) / max_display_size)))
+        self.pyramid = None
+        if depth_map is not None and normals_map is not None:
+            self.pyramid = DepthPyramid(depth_map, normals_map)
+
+        self.point = None
+        self.render_preview = None
+        self.base_image = None
+        self.display_image = None
+        self.dirty_rect = None
+
+    def to_display(self, image):
+        """Downscales a full resolution image to the displayed pyramid level."""
+        if self.level == 0:
+            return image.copy()
+        height, width = image.shape[:2]
+        size = (math.ceil(width / 2 ** self.level), math.ceil(height / 2 ** self.level))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+    def set_base_image(self, image) -> None:
+        """Replaces the displayed image under the cursor overlay."""
+        self.base_image = self.to_display(image)
+        self.display_image = self.base_image.copy()
+        self.dirty_rect = None
+        cv2.imshow(self.window_name, self.display_image)
+
+    def draw_cursor(self, x: int, y: int) -> None:
+        """Restores the area of the previous cursor overlay and draws the overlay at the cursor position."""
+        if self.dirty_rect is not None:
+            x0, y0, x1, y1 = self.dirty_rect
+            self.display_image[y0:y1, x0:x1] = self.base_image[y0:y1, x0:x1]
+
+        full_x, full_y = x << self.level, y << self.level
+        text = f"({full_x}, {full_y})"
+        end_point = (x, y)
+        if self.pyramid is not None:
+            depth_value, normal = self.pyramid.lookup(full_x, full_y, self.level)
+            text += f" depth {depth_value:.3f} normal ({normal[0]:+.2f}, {normal[1]:+.2f}, {normal[2]:+.2f})"
+            arrow_length = 50
+            end_point = (int(x + arrow_length * normal[0]), int(y + arrow_length * normal[1]))
+            cv2.arrowedLine(self.display_image, (x, y), end_point, (0, 255, 255), thickness=2)
+        cv2.circle(self.display_image, (x, y), 3, (0, 255, 255), -1)
+
+        (text_width, text_height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+        text_x, text_y = x + 10, y - 10
+        cv2.rectangle(self.display_image, (text_x - 2, text_y - text_height - 2),
+                      (text_x + text_width + 2, text_y + baseline), (0, 0, 0), -1)
+        cv2.putText(self.display_image, text, (text_x, text_y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+
+        # The redrawn area covers the arrow, the marker and the text box
+        height, width = self.display_image.shape[:2]
+        x0 = max(0, min(x, end_point[0], text_x) - 12)
+        y0 = max(0, min(y, end_point[1], text_y - text_height) - 12)
+        x1 = min(width, max(x, end_point[0], text_x + text_width) + 12)
+        y1 = min(height, max(y, end_point[1], text_y + baseline) + 12)
+        self.dirty_rect = (x0, y0, x1, y1)
+        cv2.imshow(self.window_name, self.display_image)
+
+    def pin_point(self, point) -> None:
+        """Pins the selected point, showing the preview rendered for it if there is one."""
+        self.point = point
+        image = self.render_preview(point) if self.render_preview else self.image.copy()
+        base_image = self.to_display(image)
+        x, y = point[0] >> self.level, point[1] >> self.level
+        cv2.circle(base_image, (x, y), 4, (0, 255, 0), -1)
+        self.base_image = base_image
+        self.display_image = base_image.copy()
+        self.dirty_rect = None
+        cv2.imshow(self.window_name, self.display_image)
+
+    def on_mouse(self, event, x, y, flags, param) -> None:
+        """Handles mouse events, which are the only reason to redraw."""
+        if event == cv2.EVENT_MOUSEMOVE:
+            self.draw_cursor(x, y)
+        elif event == cv2.EVENT_LBUTTONDOWN:
+            height, width = self.image.shape[:2]
+            self.pin_point((min(x << self.level, width - 1), min(y << self.level, height - 1)))
+            self.draw_cursor(x, y)
+
+    def select(self, point=None, render_preview=None):
+        """
+        Shows the image until the user accepts a point. Clicking pins a point, pressing 'Enter' or 'ESC'
+        accepts the pinned point and pressing 'R' unpins it.
+
+        Args:
+            point (tuple, optional): The initially pinned point.
+            render_preview (callable, optional): The function rendering the full resolution preview
+                image of a pinned point, called with the point.
+
+        Returns:
+            tuple: The accepted point (x, y) at full resolution, or None if the window was closed before
+                a point was pinned.
+        """
+        self.render_preview = render_preview
+        cv2.namedWindow(self.window_name, cv2.WINDOW_AUTOSIZE)
+        if point is not None:
+            self.pin_point(point)
+        else:
+            self.point = None
+            self.set_base_image(self.image)
+        cv2.setMouseCallback(self.window_name, self.on_mouse)
+
+        while True:
+            # Blocks until a key is pressed, mouse events are handled by the callback meanwhile
+            key = cv2.waitKey(0) & 0xFF
+            if cv2.getWindowProperty(self.window_name, cv2.WND_PROP_VISIBLE) < 1:
+                return self.point
+            if key in (13, 27) and self.point is not None:
+                break
+            elif key in (ord('r'), ord('R')):
+                self.point = None
+                self.set_base_image(self.image)
+
+        cv2.destroyWindow(self.window_name)
+        return self.point
@@ -0,0 +1,297 @@
+import os
+import cv2
+import argparse
+import numpy as np
+from asset_preprocess import preprocess_asset
+from depth_loader import DepthMap
+from depthToNormal import DepthToNormalMap
+
+
+# The displaced plane in blender.py is a 2 x 2 plane subdivided with 100 cuts
+PLANE_VERTICES_PER_SIDE = 102
+DISPLACE_STRENGTH = 0.8
+MAX_OBJECT_SCALE = 0.85
+OBJECT_OFFSET_Y = -0.1
+# The level of detail of the preview meshes, previews do not need the full polygon count
+PREVIEW_LOD = 1
+
+
+class ObjectMesh:
+    """A triangulated 3D object mesh in the local space of the object, as imported by Blender."""
+
+    def __init__(self, vertices, faces, face_colors=None, rotation=(0.0, 0.0, 0.0), scale=(1.0, 1.0, 1.0)):
+        """
+        Args:
+            vertices (numpy.ndarray): The vertex coordinates of shape (N, 3).
+            faces (numpy.ndarray): The vertex indices of the triangles of shape (M, 3).
+            face_colors (numpy.ndarray, optional): The RGB colors in [0, 1] of the triangles of shape (M, 3).
+                Defaults to light grey.
+            rotation (tuple, optional): The Euler XYZ rotation of the object after import, in radians.
+            scale (tuple, optional): The scale of the object after import.
+        """
+        self.vertices = np.asarray(vertices, dtype=np.float32)
+        self.faces = np.asarray(faces, dtype=np.int32)
+        if face_colors is None:
+            face_colors = np.full((len(self.faces), 3), 0.8, dtype=np.float32)
+        self.face_colors = np.asarray(face_colors, dtype=np.float32)
+        self.rotation = np.asarray(rotation, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def load(cls, mesh_path: str):
+        """
+        Loads a mesh exported by export_object_mesh.py (.npz) or a Wavefront OBJ file.
+
+        OBJ files are converted from their Y-up axes to the Z-up axes of Blender, like the Blender OBJ
+        importer does.
+
+        Args:
+            mesh_path (str): The path to the mesh file.
+
+        Returns:
+            ObjectMesh: The loaded mesh.
+        """
+        if mesh_path.lower().endswith(".npz"):
+            data = np.load(mesh_path)
+            return cls(data["vertices"], data["faces"], data["face_colors"], data["rotation"], data["scale"])
+
+        vertices, faces = [], []
+        with open(mesh_path, "r") as f:
+            for line in f:
+                values = line.split()
+                if not values:
+                    continue
+                if values[0] == "v":
+                    x, y, z = map(float, values[1:4])
+                    vertices.append((x, -z, y))
+                elif values[0] == "f":
+                    # Polygons are split into a triangle fan, negative indices count from the end
+                    indices = [int(value.split("/")[0]) for value in values[1:]]
+                    indices = [index - 1 if index > 0 else len(vertices) + index for index in indices]
+                    faces.extend((indices[0], indices[i], indices[i + 1]) for i in range(1, len(indices) - 1))
+        return cls(vertices, faces)
+
+
+def get_preview_mesh(object_path: str, artifact_store=None):
+    """
+    Returns the preview mesh of a 3D object. FBX objects are read from the preview mesh of their 25% level
+    of detail, exported once per object by asset_preprocess.py.
+
+    Args:
+        object_path (str): The path to the 3D object (.fbx, .npz or .obj).
+        artifact_store (ArtifactStore, optional): The store keeping the levels of detail.
+
+    Returns:
+        ObjectMesh: The preview mesh.
+    """
+    if os.path.splitext(object_path)[1].lower() in (".npz", ".obj"):
+        return ObjectMesh.load(object_path)
+
+    lods = preprocess_asset(object_path, artifact_store)["lods"]
+    return ObjectMesh.load(lods[min(PREVIEW_LOD, len(lods) - 1)]["mesh"])
+
+
+def get_rotation_matrix(rotation):
+    """Returns the matrix of a Blender Euler XYZ rotation, which applies X first and Z last."""
+    (cos_x, cos_y, cos_z), (sin_x, sin_y, sin_z) = np.cos(rotation), np.sin(rotation)
+    rotation_x = np.array([[1, 0, 0], [0, cos_x, -sin_x], [0, sin_x, cos_x]])
+    rotation_y = np.array([[cos_y, 0, sin_y], [0, 1, 0], [-sin_y, 0, cos_y]])
+    rotation_z = np.array([[cos_z, -sin_z, 0], [sin_z, cos_z, 0], [0, 0, 1]])
+    return rotation_z @ rotation_y @ rotation_x
+
+
+def rasterize(points, depths, faces, width, height, chunk_pixels=1 << 21):
+    """
+    Rasterizes triangles into a depth buffer and a triangle index buffer, smaller depths are closer.
+
+    Candidate pixels of all triangles are tested at once: triangles are grouped by the power of two size of
+    their bounding boxes, so every group is tested on one padded pixel grid.
+
+    Args:
+        points (numpy.ndarray): The vertex positions in pixels of shape (N, 2).
+        depths (numpy.ndarray): The vertex depths of shape (N,).
+        faces (numpy.ndarray): The vertex indices of the triangles of shape (M, 3).
+        width (int): The image width.
+        height (int): The image height.
+        chunk_pixels (int, optional): The maximum number of candidate pixels tested at once.
+
+    Returns:
+        tuple: The depth buffer (infinite where empty) and the triangle index buffer (-1 where empty).
+    """
+    triangles = points[faces]
+    triangle_depths = depths[faces]
+    x0 = np.floor(triangles[:, :, 0].min(axis=1)).clip(0, width).astype(np.int64)
+    x1 = np.ceil(triangles[:, :, 0].max(axis=1)).clip(0, width).astype(np.int64)
+    y0 = np.floor(triangles[:, :, 1].min(axis=1)).clip(0, height).astype(np.int64)
+    y1 = np.ceil(triangles[:, :, 1].max(axis=1)).clip(0, height).astype(np.int64)
+
+    edge_a = triangles[:, 1] - triangles[:, 0]
+    edge_b = triangles[:, 2] - triangles[:, 0]
+    area = edge_a[:, 0] * edge_b[:, 1] - edge_a[:, 1] * edge_b[:, 0]
+    visible = (x1 > x0) & (y1 > y0) & (np.abs(area) > 1e-12)
+
+    box_width = 2 ** np.ceil(np.log2(np.maximum(x1 - x0, 1))).astype(np.int64)
+    box_height = 2 ** np.ceil(np.log2(np.maximum(y1 - y0, 1))).astype(np.int64)
+    depth_buffer = np.full(height * width, np.inf, dtype=np.float32)
+    face_buffer = np.full(height * width, -1, dtype=np.int64)
+
+    for size in np.unique(np.stack([box_width, box_height], axis=1)[visible], axis=0):
+        group = np.flatnonzero(visible & (box_width == size[0]) & (box_height == size[1]))
+        grid_x, grid_y = np.meshgrid(np.arange(size[0]), np.arange(size[1]))
+        chunk_faces = max(1, chunk_pixels // int(size[0] * size[1]))
+        for start in range(0, len(group), chunk_faces):
+            faces_chunk = group[start:start + chunk_faces]
+            pixel_x = x0[faces_chunk, None, None] + grid_x
+            pixel_y = y0[faces_chunk, None, None] + grid_y
+            offset_x = pixel_x + 0.5 - triangles[faces_chunk, 0, 0, None, None]
+            offset_y = pixel_y + 0.5 - triangles[faces_chunk, 0, 1, None, None]
+
+            # Barycentric coordinates of the pixel centers, from the signed areas of the sub-triangles
+            chunk_area = area[faces_chunk, None, None]
+            weight_b = (offset_x * edge_b[faces_chunk, 1, None, None]
+                        - offset_y * edge_b[faces_chunk, 0, None, None]) / chunk_area
+            weight_c = (edge_a[faces_chunk, 0, None, None] * offset_y
+                        - edge_a[faces_chunk, 1, None, None] * offset_x) / chunk_area
+            weight_a = 1 - weight_b - weight_c
+            inside = (weight_a >= 0) & (weight_b >= 0) & (weight_c >= 0) & \
+                     (pixel_x < x1[faces_chunk, None, None]) & (pixel_y < y1[faces_chunk, None, None])
+
+            chunk_depths = triangle_depths[faces_chunk, :, None, None]
+            depth = weight_a * chunk_depths[:, 0] + weight_b * chunk_depths[:, 1] + weight_c * chunk_depths[:, 2]
+            pixel_indices = (pixel_y * width + pixel_x)[inside]
+            pixel_depths = depth[inside]
+            pixel_faces = np.broadcast_to(faces_chunk[:, None, None], inside.shape)[inside]
+
+            # The closest candidate of every pixel comes first after sorting by pixel and depth, it is kept
+            # if it is closer than what earlier chunks left in the buffers
+            order = np.lexsort((pixel_depths, pixel_indices))
+            sorted_indices = pixel_indices[order]
+            closest = order[np.r_[True, sorted_indices[1:] != sorted_indices[:-1]]] if len(order) else order
+            closer = pixel_depths[closest] < depth_buffer[pixel_indices[closest]]
+            closest = closest[closer]
+            depth_buffer[pixel_indices[closest]] = pixel_depths[closest]
+            face_buffer[pixel_indices[closest]] = pixel_faces[closest]
+
+    return depth_buffer.reshape(height, width), face_buffer.reshape(height, width)
+
+
+class PreviewRenderer:
+    """A Blender-free preview of the object placement. The object mesh is rasterized with the orthographic
+        camera of blender.py and composited over the scene image, where the displaced plane occludes it."""
+
+    def __init__(self, scene_image, depth_map, mesh, supersampling=2):
+        """
+        Args:
+            scene_image (numpy.ndarray or str): The scene image (BGR) or the path to it.
+            depth_map (DepthMap or str): The depth map passed to Blender, or the path to it.
+            mesh (ObjectMesh): The object mesh.
+            supersampling (int, optional): The number of samples per pixel side used for anti-aliasing.
+                Defaults to 2.
+        """
+        self.scene_image = cv2.imread(scene_image) if isinstance(scene_image, str) else scene_image
+        self.depth_map = depth_map if isinstance(depth_map, DepthMap) else DepthMap(depth_map)
+        self.mesh = mesh
+        self.supersampling = supersampling
+
+        # The preview covers the scene image, while the scene geometry follows the depth map
+        self.height, self.width = self.scene_image.shape[:2]
+        depth_height, depth_width = self.depth_map.shape
+        self.aspect_ratio = depth_width / depth_height
+
+        # Blender samples the displacement at the plane vertices and interpolates in between
+        plane_depth = cv2.resize(self.depth_map.normalized(), (PLANE_VERTICES_PER_SIDE, PLANE_VERTICES_PER_SIDE),
+                                 interpolation=cv2.INTER_AREA)
+        plane_depth = cv2.resize(plane_depth, (self.width * supersampling, self.height * supersampling),
+                                 interpolation=cv2.INTER_LINEAR)
+        self.plane_y = -DISPLACE_STRENGTH * (plane_depth - 0.5)
+
+    def place_object(self, x, z, normal_vector, depth_value):
+        """
+        Transforms the mesh vertices to world space like import_3d_model, move_object and rotate_object.
+
+        Args:
+            x (int): The x coordinate of the placement point in depth map pixels.
+            z (int): The y coordinate of the placement point in depth map pixels.
+            normal_vector (tuple): The surface normal at the placement point.
+            depth_value (float): The normalized depth value at the placement point.
+
+        Returns:
+            numpy.ndarray: The world space vertices of shape (N, 3).
+        """
+        depth_height, depth_width = self.depth_map.shape
+        location = np.array([(x / depth_width) * 2 * self.aspect_ratio, OBJECT_OFFSET_Y, 2 - (z / depth_height) * 2])
+
+        x_norm, y_norm, _ = normal_vector
+        rotation_angle = np.arccos(y_norm * (-1) / np.sqrt(x_norm**2 + y_norm**2))
+        rotation_angle = -rotation_angle if x_norm < 0 else rotation_angle
+        rotation = get_rotation_matrix((self.mesh.rotation[0], rotation_angle, self.mesh.rotation[2]))
+
+        scale = self.mesh.scale * MAX_OBJECT_SCALE * depth_value
+        return (self.mesh.vertices * scale) @ rotation.T + location
+
+    def render(self, x, z, normal_vector, depth_value):
+        """
+        Renders the placement preview.
+
+        Args:
+            x (int): The x coordinate of the placement point in depth map pixels.
+            z (int): The y coordinate of the placement point in depth map pixels.
+            normal_vector (tuple): The surface normal at the placement point.
+            depth_value (float): The normalized depth value at the placement point.
+
+        Returns:
+            numpy.ndarray: The scene image (BGR) with the object composited over it.
+        """
+        width, height = self.width * self.supersampling, self.height * self.supersampling
+        vertices = self.place_object(x, z, normal_vector, depth_value)
+
+        # The orthographic camera looks along +y and frames x in [0, 2 * aspect ratio] and z in [0, 2]
+        points = np.stack([vertices[:, 0] / (2 * self.aspect_ratio) * width,
+                           (2 - vertices[:, 2]) / 2 * height], axis=1)
+        depth_buffer, face_buffer = rasterize(points, vertices[:, 1], self.mesh.faces, width, height)
+
+        # The object is hidden wherever the displaced plane is closer to the camera
+        visible = (face_buffer >= 0) & (depth_buffer <= self.plane_y)
+
+        # Two-sided Lambertian shading with a light placed behind the camera
+        triangles = vertices[self.mesh.faces]
+        face_normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+        face_normals /= np.maximum(np.linalg.norm(face_normals, axis=1, keepdims=True), 1e-12)
+        light_direction = np.array([-0.3, -1.0, 0.5]) / np.linalg.norm([-0.3, -1.0, 0.5])
+        shading = 0.35 + 0.65 * np.abs(face_normals @ light_direction)
+        face_colors = (self.mesh.face_colors * shading[:, None])[:, ::-1] * 255
+
+        color = np.zeros((height, width, 3), dtype=np.float32)
+        color[visible] = face_colors[face_buffer[visible]]
+        coverage = visible.astype(np.float32)
+        if self.supersampling > 1:
+            color = cv2.resize(color, (self.width, self.height), interpolation=cv2.INTER_AREA)
+            coverage = cv2.resize(coverage, (self.width, self.height), interpolation=cv2.INTER_AREA)
+
+        preview = self.scene_image.astype(np.float32) * (1 - coverage[:, :, None]) + color
+        return preview.clip(0, 255).astype(np.uint8)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render a quick object placement preview without Blender."
+    )
+    parser.add_argument("--scene_image_path", type=str, required=True, help="Path to the scene image")
+    parser.add_argument("--depth_map_path", type=str, required=True, help="Path to the depth map passed to Blender")
+    parser.add_argument("--object_path", type=str, required=True, help="Path to the 3D object (.fbx, .npz or .obj)")
+    parser.add_argument("--point", type=int, nargs=2, required=True, help="Placement point (x y)")
+    parser.add_argument("--output_path", type=str, default="results/preview.png", help="Path of the preview image")
+    args = parser.parse_args()
+
+    try:
+        depth_map = DepthMap(args.depth_map_path)
+        converter = DepthToNormalMap(depth_map)
+        converter.calculate_normals()
+        x, y = args.point
+        renderer = PreviewRenderer(args.scene_image_path, depth_map, get_preview_mesh(args.object_path))
+        preview = renderer.render(x, y, converter.normals_map[y, x], converter.depth_map[y, x])
+        os.makedirs(os.path.dirname(os.path.abspath(args.output_path)), exist_ok=True)
+        cv2.imwrite(args.output_path, preview)
+        print(f"Preview saved as {args.output_path}")
+    except Exception as exc:
+        print(f"Error while rendering the preview: {exc}")
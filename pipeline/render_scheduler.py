@@ -0,0 +1,170 @@
+import os
+import sys
+import time
+import queue
+import shutil
+import argparse
+import threading
+import subprocess
+
+
+# Pins the process to the cores listed in its first argument and replaces it with the remaining command
+# line, like taskset -c does, so the affinity is set before the command starts any thread
+PIN_SCRIPT = "import os, sys; os.sched_setaffinity(0, map(int, sys.argv[1].split(','))); os.execvp(sys.argv[2], sys.argv[2:])"
+
+
+def get_available_cores():
+    """Returns the CPU cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(cores, workers):
+    """
+    Splits cores into contiguous partitions of nearly equal size, one per worker.
+
+    Args:
+        cores (list): The CPU cores to split.
+        workers (int): The number of partitions, at most the number of cores.
+
+    Returns:
+        list: The cores of every partition.
+    """
+    workers = max(1, min(workers, len(cores)))
+    size, remainder = divmod(len(cores), workers)
+    partitions, start = [], 0
+    for index in range(workers):
+        end = start + size + (1 if index < remainder else 0)
+        partitions.append(cores[start:end])
+        start = end
+    return partitions
+
+
+class RenderScheduler:
+    """A scheduler running concurrent Blender renders, each one restricted to its own partition of the CPU
+        cores with a matching render thread count. Renders wait in a queue until a partition is free."""
+
+    def __init__(self, workers: int = 1, cores=None) -> None:
+        """
+        Args:
+            workers (int, optional): The number of concurrent renders. Defaults to 1.
+            cores (list, optional): The CPU cores to use. Defaults to all cores available to the process.
+
+        Attributes:
+            partitions (list): The cores of every worker.
+            taskset_path (str): The path to taskset, which pins the renders to their cores, or None if
+                the renders are pinned by a Python process which sets its affinity and executes Blender.
+            stats (list): The number of renders, busy wall time and CPU time of every worker.
+        """
+        self.partitions = partition_cores(cores or get_available_cores(), workers)
+        self.free_workers = queue.Queue()
+        for worker in range(len(self.partitions)):
+            self.free_workers.put(worker)
+
+        self.stats = [{"renders": 0, "busy_s": 0.0, "cpu_s": 0.0} for _ in self.partitions]
+        self.stats_lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.taskset_path = shutil.which("taskset")
+        if not self.taskset_path and not hasattr(os, "sched_setaffinity"):
+            print("CPU affinity is not supported on this platform, renders are not pinned to their cores")
+
+    def get_command(self, command, worker):
+        """
+        Adds the render thread count of the worker partition to a Blender command and, where the platform
+        supports CPU affinity, pins the command to the partition cores before it starts.
+        """
+        cores = self.partitions[worker]
+        # Blender applies its options in order, so the thread count has to come before the script runs
+        command = [command[0], "-t", str(len(cores))] + list(command[1:])
+        core_list = ",".join(str(core) for core in cores)
+        if self.taskset_path:
+            command = [self.taskset_path, "-c", core_list] + command
+        elif hasattr(os, "sched_setaffinity"):
+            command = [sys.executable, "-c", PIN_SCRIPT, core_list] + command
+        return command
+
+    def run(self, command, check=False, **kwargs):
+        """
+        Runs a Blender command on the next free worker, waiting for one if all of them are busy.
+
+        Args:
+            command (list): The Blender command line, starting with the Blender executable.
+            check (bool, optional): Whether to raise CalledProcessError on a non-zero exit code.
+            **kwargs: The subprocess.Popen keyword arguments, without pipes: the render output is not read.
+
+        Returns:
+            subprocess.CompletedProcess: The finished render process.
+
+        Raises:
+            ValueError: If a standard stream of the render is a pipe, which would block the render once full.
+        """
+        if any(kwargs.get(stream) == subprocess.PIPE for stream in ("stdin", "stdout", "stderr")):
+            raise ValueError("Render output is not read, redirect it to a file or DEVNULL instead of a pipe")
+
+        worker = self.free_workers.get()
+        try:
+            start = time.perf_counter()
+            # The affinity is set by the command itself, a preexec_fn is unsafe when other threads are running
+            process = subprocess.Popen(self.get_command(command, worker), **kwargs)
+            cpu_time = 0.0
+            if hasattr(os, "wait4"):
+                # wait4 reports the resources used by this render only, unlike the process-wide rusage
+                _, status, rusage = os.wait4(process.pid, 0)
+                process.returncode = os.waitstatus_to_exitcode(status)
+                cpu_time = rusage.ru_utime + rusage.ru_stime
+            else:
+                process.wait()
+
+            with self.stats_lock:
+                self.stats[worker]["renders"] += 1
+                self.stats[worker]["busy_s"] += time.perf_counter() - start
+                self.stats[worker]["cpu_s"] += cpu_time
+        finally:
+            self.free_workers.put(worker)
+
+        if check and process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+        return subprocess.CompletedProcess(command, process.returncode)
+
+    def get_report(self):
+        """
+        Reports the utilisation of every worker since the scheduler was created.
+
+        Returns:
+            list: The cores, number of renders, busy wall time, utilisation (busy share of the elapsed time)
+                and CPU utilisation (CPU time share of the partition capacity while busy) of every worker.
+        """
+        elapsed = time.perf_counter() - self.start_time
+        report = []
+        with self.stats_lock:
+            for cores, stats in zip(self.partitions, self.stats):
+                report.append({
+                    "cores": cores,
+                    "renders": stats["renders"],
+                    "busy_s": stats["busy_s"],
+                    "utilisation": stats["busy_s"] / elapsed if elapsed > 0 else 0.0,
+                    "cpu_utilisation": stats["cpu_s"] / (stats["busy_s"] * len(cores)) if stats["busy_s"] else 0.0,
+                })
+        return report
+
+    def print_report(self):
+        """Prints the utilisation of every worker."""
+        print(f"{'worker':<8} {'cores':<16} {'renders':>8} {'busy s':>9} {'util':>6} {'cpu util':>9}")
+        for worker, stats in enumerate(self.get_report()):
+            cores = f"{stats['cores'][0]}-{stats['cores'][-1]}"
+            print(f"{worker:<8} {cores:<16} {stats['renders']:>8} {stats['busy_s']:>9.1f} "
+                  f"{stats['utilisation']:>6.0%} {stats['cpu_utilisation']:>9.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show how the CPU cores are partitioned between concurrent Blender renders."
+    )
+    parser.add_argument("--workers", type=int, default=2, help="Number of concurrent renders")
+    args = parser.parse_args()
+
+    cores = get_available_cores()
+    print(f"{len(cores)} available cores")
+    for worker, partition in enumerate(partition_cores(cores, args.workers)):
+        print(f"Worker {worker}: cores {partition} (blender -t {len(partition)})")
@@ -0,0 +1,215 @@
+import io
+import copy
+import json
+import math
+import base64
+import requests
+from PIL import Image, ImageDraw, ImageFilter
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StableDiffusionClient:
+    """A client for the automatic1111 API which reuses pooled connections between calls."""
+
+    def __init__(self, sd_url: str, payload_base_path: str = "payload_base.json", pool_size: int = 4) -> None:
+        """
+        Args:
+            sd_url (str): The automatic1111 url.
+            payload_base_path (str, optional): The path to the default txt2img payload json file.
+                Defaults to "payload_base.json".
+            pool_size (int, optional): The maximum number of pooled connections kept open. Defaults to 4.
+
+        Attributes:
+            session (requests.Session): The HTTP session with pooled connections.
+            payload_base (dict): The default txt2img payload, read from disk once.
+            current_checkpoint (str): The Stable Diffusion checkpoint loaded in automatic1111, None
+                until it is known.
+            executor (ThreadPoolExecutor): The worker running generations submitted with submit_txt2img.
+        """
+        self.sd_url = sd_url.rstrip("/")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        with open(payload_base_path, "r") as f:
+            self.payload_base = json.load(f)
+        self.current_checkpoint = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def get_checkpoint(self) -> str:
+        """Returns the Stable Diffusion checkpoint currently loaded in automatic1111."""
+        response = self.session.get(url=self.sd_url + "/sdapi/v1/options")
+        response.raise_for_status()
+        self.current_checkpoint = response.json().get("sd_model_checkpoint")
+        return self.current_checkpoint
+
+    def set_checkpoint(self, checkpoint: str) -> None:
+        """
+        Switches automatic1111 to the provided checkpoint, unless it is already loaded.
+
+        Args:
+            checkpoint (str): The Stable Diffusion checkpoint name.
+        """
+        if self.current_checkpoint is None:
+            self.get_checkpoint()
+
+        if self.current_checkpoint == checkpoint:
+            return
+
+        response = self.session.post(url=self.sd_url + "/sdapi/v1/options",
+                                     json={"sd_model_checkpoint": checkpoint})
+        response.raise_for_status()
+        self.current_checkpoint = checkpoint
+
+    def txt2img(
+        self, prompt, negative_prompt, width, height, steps, sampler_name,
+        cfg_scale, seed, checkpoint, batch_size=1, return_seeds=False, hires=None
+    ):
+        """
+        Generates images from a text prompt in a single txt2img call.
+
+        Args:
+            prompt (str): The scene prompt to guide the image generation process.
+            negative_prompt (str): The negative scene prompt to guide the generation process.
+            width (int): The width of the generated images.
+            height (int): The height of the generated images.
+            steps (int): The number of steps in the generation process.
+            sampler_name (str): The name of the sampler used in generation.
+            cfg_scale (float): The scale factor for the generation configuration.
+            seed (int): The seed value for reproducibility.
+            checkpoint (str): The Stable Diffusion checkpoint name.
+            batch_size (int, optional): The number of images generated in one call. Defaults to 1.
+            return_seeds (bool, optional): Whether to also return the seed of every image. Defaults to False.
+            hires (dict, optional): The automatic1111 hires fix settings (e.g. "hr_resize_x", "hr_resize_y",
+                "hr_second_pass_steps", "denoising_strength", "hr_upscaler"). The images are generated at
+                width x height and refined at the hires size in a second pass. Defaults to None.
+
+        Returns:
+            list: The generated images as base64 encoded strings, and their seeds if return_seeds is set.
+        """
+        self.set_checkpoint(checkpoint)
+
+        payload = copy.deepcopy(self.payload_base)
+        payload["override_settings"]["sd_model_checkpoint"] = checkpoint
+        payload["prompt"] = prompt
+        payload["negative_prompt"] = negative_prompt
+        payload["width"] = width
+        payload["height"] = height
+        payload["steps"] = steps
+        payload["sampler_name"] = sampler_name
+        payload["cfg_scale"] = cfg_scale
+        payload["seed"] = seed
+        payload["batch_size"] = batch_size
+        if hires:
+            payload["enable_hr"] = True
+            payload.update(hires)
+
+        response = self.session.post(url=self.sd_url + "/sdapi/v1/txt2img", json=payload)
+        response.raise_for_status()
+        result = response.json()
+        if not return_seeds:
+            return result["images"]
+        return result["images"], json.loads(result["info"])["all_seeds"]
+
+    def submit_txt2img(self, *args, **kwargs):
+        """
+        Starts a txt2img generation in the background, so its progress can be polled meanwhile.
+
+        Args:
+            *args: The txt2img arguments.
+            **kwargs: The txt2img keyword arguments.
+
+        Returns:
+            concurrent.futures.Future: The future resolving to the generated images.
+        """
+        return self.executor.submit(self.txt2img, *args, **kwargs)
+
+    def get_progress(self, skip_current_image: bool = False) -> dict:
+        """
+        Polls the progress of the running generation.
+
+        Args:
+            skip_current_image (bool, optional): Whether to leave out the intermediate preview image.
+                Defaults to False.
+
+        Returns:
+            dict: The progress in [0, 1], the estimated remaining time ("eta_relative"), the sampler "state"
+                and the base64 encoded "current_image" preview (None if there is no new preview).
+        """
+        response = self.session.get(url=self.sd_url + "/sdapi/v1/progress",
+                                    params={"skip_current_image": str(skip_current_image).lower()})
+        response.raise_for_status()
+        return response.json()
+
+    def interrupt(self) -> None:
+        """Aborts the running generation, the pending txt2img call then returns early."""
+        response = self.session.post(url=self.sd_url + "/sdapi/v1/interrupt")
+        response.raise_for_status()
+
+    def close(self) -> None:
+        """Closes all pooled connections."""
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+def decode_image(image_base64: str) -> Image.Image:
+    """Decodes a base64 encoded image returned by automatic1111."""
+    return Image.open(io.BytesIO(base64.b64decode(image_base64)))
+
+
+def upscale_image(image: Image.Image, size: tuple) -> Image.Image:
+    """
+    Upscales an image on the CPU with Lanczos resampling and a light unsharp mask, which restores some of
+    the edge contrast lost by the resampling.
+
+    Args:
+        image (PIL.Image.Image): The image to upscale.
+        size (tuple): The (width, height) of the upscaled image.
+
+    Returns:
+        PIL.Image.Image: The upscaled image.
+    """
+    upscaled = image.convert("RGB").resize(size, Image.LANCZOS)
+    return upscaled.filter(ImageFilter.UnsharpMask(radius=2, percent=60, threshold=2))
+
+
+def make_image_grid(images: list, max_columns: int = 4, cell_size: int = 384) -> Image.Image:
+    """
+    Arranges candidate images into a single numbered grid image.
+
+    Args:
+        images (list): The PIL images to arrange.
+        max_columns (int, optional): The maximum number of images in a row. Defaults to 4.
+        cell_size (int, optional): The size of the longer side of each grid cell in pixels. Defaults to 384.
+
+    Returns:
+        PIL.Image.Image: The grid image with candidate numbers drawn in the top-left corner of each cell.
+
+    Raises:
+        ValueError: If there are no images.
+    """
+    if not images:
+        raise ValueError("No candidate images to arrange into a grid")
+    columns = min(max_columns, len(images))
+    rows = math.ceil(len(images) / columns)
+
+    thumbnails = []
+    for image in images:
+        thumbnail = image.convert("RGB")
+        thumbnail.thumbnail((cell_size, cell_size))
+        thumbnails.append(thumbnail)
+
+    cell_width = max(thumbnail.width for thumbnail in thumbnails)
+    cell_height = max(thumbnail.height for thumbnail in thumbnails)
+    grid = Image.new("RGB", (columns * cell_width, rows * cell_height))
+    draw = ImageDraw.Draw(grid)
+
+    for index, thumbnail in enumerate(thumbnails):
+        x, y = (index % columns) * cell_width, (index // columns) * cell_height
+        grid.paste(thumbnail, (x, y))
+        draw.rectangle((x, y, x + 28, y + 22), fill=(0, 0, 0))
+        draw.text((x + 8, y + 5), str(index + 1), fill=(255, 255, 255))
+
+    return grid
@@ -0,0 +1,184 @@
+import os
+import cv2
+import json
+import argparse
+import numpy as np
+from tracing import span
+
+
+# The height of the low resolution panorama the coefficients are integrated over
+PANORAMA_HEIGHT = 64
+# The height of the prefiltered environment map, 0 writes no map
+ENVIRONMENT_HEIGHT = 32
+# Convolution of the radiance with the clamped cosine, per SH band (Ramamoorthi and Hanrahan)
+COSINE_LOBE = np.array([np.pi, 2 * np.pi / 3, 2 * np.pi / 3, 2 * np.pi / 3,
+                        np.pi / 4, np.pi / 4, np.pi / 4, np.pi / 4, np.pi / 4], dtype=np.float32)
+
+
+def get_sh_basis(directions):
+    """
+    Evaluates the 9 real spherical harmonics of bands 0 to 2.
+
+    Args:
+        directions (numpy.ndarray): The unit directions of shape (..., 3).
+
+    Returns:
+        numpy.ndarray: The basis values of shape (..., 9).
+    """
+    x, y, z = directions[..., 0], directions[..., 1], directions[..., 2]
+    return np.stack([
+        np.full_like(x, 0.282095),
+        0.488603 * y,
+        0.488603 * z,
+        0.488603 * x,
+        1.092548 * x * y,
+        1.092548 * y * z,
+        0.315392 * (3 * z * z - 1),
+        1.092548 * x * z,
+        0.546274 * (x * x - y * y),
+    ], axis=-1)
+
+
+def get_equirect_directions(height):
+    """
+    Returns the world directions and solid angles of the pixels of an equirectangular map of shape
+    (height, 2 * height), laid out like Blender's environment texture with Z up.
+
+    Returns:
+        tuple: The unit directions of shape (height, 2 * height, 3) and the solid angles of shape
+            (height, 2 * height).
+    """
+    width = 2 * height
+    u = (np.arange(width, dtype=np.float32) + 0.5) / width
+    v = (np.arange(height, dtype=np.float32) + 0.5) / height
+    # Blender maps u = atan2(y, -x) / 2pi + 0.5 and v = elevation / pi + 0.5, with v = 1 at the top row
+    azimuth = (u - 0.5) * 2 * np.pi
+    elevation = (0.5 - v) * np.pi
+    cos_elevation = np.cos(elevation)[:, None]
+    directions = np.stack(np.broadcast_arrays(
+        -np.cos(azimuth)[None, :] * cos_elevation,
+        np.sin(azimuth)[None, :] * cos_elevation,
+        np.sin(elevation)[:, None],
+    ), axis=-1)
+    solid_angles = np.broadcast_to(cos_elevation * (2 * np.pi / width) * (np.pi / height), (height, width))
+    return directions, solid_angles
+
+
+def image_to_panorama(image, height=PANORAMA_HEIGHT):
+    """
+    Wraps the scene image around the viewer like background_enhancement.image_to_hdri does, at a low
+    resolution: the left half of the image fills the right half of the panorama and vice versa.
+
+    Args:
+        image (numpy.ndarray): The BGR scene image.
+        height (int, optional): The panorama height. Defaults to PANORAMA_HEIGHT.
+
+    Returns:
+        numpy.ndarray: The BGR panorama of shape (height, 2 * height, 3).
+    """
+    half = image.shape[1] // 2
+    return np.hstack([
+        cv2.resize(image[:, half:], (height, height), interpolation=cv2.INTER_AREA),
+        cv2.resize(image[:, :half], (height, height), interpolation=cv2.INTER_AREA),
+    ])
+
+
+def srgb_to_linear(image):
+    """Converts an 8-bit sRGB image to linear float32 values."""
+    image = image.astype(np.float32) / 255
+    return np.where(image <= 0.04045, image / 12.92, ((image + 0.055) / 1.055) ** 2.4)
+
+
+def compute_sh_coefficients(image, panorama_height=PANORAMA_HEIGHT):
+    """
+    Projects the radiance of the wrapped scene image onto the 9 spherical harmonics of bands 0 to 2.
+
+    Args:
+        image (numpy.ndarray): The BGR scene image.
+        panorama_height (int, optional): The height of the integrated panorama. Defaults to PANORAMA_HEIGHT.
+
+    Returns:
+        numpy.ndarray: The linear RGB coefficients of shape (9, 3).
+    """
+    panorama = srgb_to_linear(image_to_panorama(image, panorama_height)[:, :, ::-1])
+    directions, solid_angles = get_equirect_directions(panorama_height)
+    basis = get_sh_basis(directions) * solid_angles[:, :, None]
+    return np.einsum("hwk,hwc->kc", basis, panorama)
+
+
+def render_irradiance_map(coefficients, height=ENVIRONMENT_HEIGHT):
+    """
+    Renders the prefiltered environment map of the coefficients, i.e. the light a white diffuse surface
+    facing each direction reflects, which is all the detail soft ambient lighting needs.
+
+    Args:
+        coefficients (numpy.ndarray): The linear RGB coefficients of shape (9, 3).
+        height (int, optional): The map height. Defaults to ENVIRONMENT_HEIGHT.
+
+    Returns:
+        numpy.ndarray: The linear RGB map of shape (height, 2 * height, 3).
+    """
+    directions, _ = get_equirect_directions(height)
+    irradiance = get_sh_basis(directions) @ (coefficients * COSINE_LOBE[:, None])
+    return np.maximum(irradiance / np.pi, 0).astype(np.float32)
+
+
+def generate_sh_lighting(image_path, output_path, environment_height=ENVIRONMENT_HEIGHT):
+    """
+    Writes the spherical harmonics lighting of a scene image, which replaces the HDRI image of the scene.
+
+    Args:
+        image_path (str): The path to the scene image.
+        output_path (str): The path to the output lighting JSON file.
+        environment_height (int, optional): The height of the prefiltered environment map written next to
+            the JSON file, 0 writes no map. Defaults to ENVIRONMENT_HEIGHT.
+
+    Returns:
+        dict: The lighting with the "sh" coefficients, the "ambient" color (the mean radiance) and the file
+            name of the "environment_map" if it was written.
+    """
+    with span("sh_lighting.read"):
+        image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f"Unable to load image from {image_path}")
+
+    with span("sh_lighting.project"):
+        coefficients = compute_sh_coefficients(image)
+
+    lighting = {
+        "sh": coefficients.tolist(),
+        # The band 0 term times its basis constant is the mean radiance over the sphere
+        "ambient": (coefficients[0] * 0.282095).tolist(),
+        "environment_map": None,
+    }
+    if environment_height:
+        root, _ = os.path.splitext(output_path)
+        environment_path = f"{root}_env.hdr"
+        with span("sh_lighting.environment_map"):
+            cv2.imwrite(environment_path, render_irradiance_map(coefficients, environment_height)[:, :, ::-1])
+        lighting["environment_map"] = os.path.basename(environment_path)
+
+    with open(output_path, "w") as f:
+        json.dump(lighting, f, indent=4)
+    return lighting
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compute the spherical harmonics lighting of a scene image."
+    )
+    parser.add_argument("--input_image_path", type=str, required=True, help="Path to the scene image")
+    parser.add_argument("--output_dir", type=str, default=None,
+                        help="Output directory (defaults to the input image directory)")
+    parser.add_argument("--environment_height", type=int, default=ENVIRONMENT_HEIGHT,
+                        help="Height of the prefiltered environment map, 0 writes no map")
+    args = parser.parse_args()
+
+    root, _ = os.path.splitext(args.input_image_path)
+    if args.output_dir:
+        root = os.path.join(args.output_dir, os.path.basename(root))
+    try:
+        lighting = generate_sh_lighting(args.input_image_path, f"{root}_lighting.json", args.environment_height)
+        print("Ambient color:", ", ".join(f"{value:.3f}" for value in lighting["ambient"]))
+    except Exception as exc:
+        print(f"Error while computing the lighting: {exc}")
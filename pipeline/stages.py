@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import argparse
+import functools
+import importlib
+import importlib.util
+import threading
+import subprocess
+from tracing import span
+
+
+# The modules every pipeline stage needs, imported on first use or preloaded in the background
+STAGE_MODULES = {
+    "scene": ["sd_client"],
+    "normals": ["depthToNormal"],
+    "point_selection": ["point_selector"],
+    "preview": ["preview_renderer"],
+    "depth_refinement": ["depth_refinement"],
+    "lods": ["asset_preprocess"],
+    "dialogs": ["tkinter.filedialog"],
+}
+# Detected device capabilities are reused until the torch installation or the visible devices change
+DEVICE_CACHE_PATH = os.path.join("results", "device_capabilities.json")
+
+_import_lock = threading.RLock()
+# Child processes started by the stages running in background workers, terminated when the run is stopped
+_child_processes = set()
+_child_processes_lock = threading.Lock()
+
+
+class LazyModule:
+    """A stand-in for a module, which imports the module on first attribute access, so scripts only pay
+        for the heavy dependencies of the stages they actually run."""
+
+    def __init__(self, name: str) -> None:
+        """
+        Args:
+            name (str): The full module name.
+        """
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        """Imports the module once, also when several threads use it at the same time."""
+        if self._module is None:
+            with _import_lock:
+                if self._module is None:
+                    with span("stage.import", module=self._name):
+                        self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+@functools.lru_cache(maxsize=None)
+def lazy_import(name: str) -> LazyModule:
+    """Returns the shared lazy stand-in of a module."""
+    return LazyModule(name)
+
+
+def preload(*stages) -> None:
+    """Imports the modules of pipeline stages ahead of their use, e.g. in a background thread while the
+        user is busy with an interactive stage."""
+    for stage in stages:
+        for name in STAGE_MODULES[stage]:
+            lazy_import(name)._load()
+
+
+def run_child_process(args, **kwargs) -> None:
+    """
+    Runs a command like subprocess.run with check=True, registered so terminate_child_processes can stop it
+        while a background worker waits for it.
+
+    Args:
+        args (list): The command and its arguments.
+        **kwargs: Further arguments of subprocess.Popen, e.g. stdout.
+
+    Raises:
+        subprocess.CalledProcessError: If the command exits with a non-zero code, also when it was terminated.
+    """
+    with subprocess.Popen(args, **kwargs) as process:
+        with _child_processes_lock:
+            _child_processes.add(process)
+        try:
+            returncode = process.wait()
+        finally:
+            with _child_processes_lock:
+                _child_processes.discard(process)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args)
+
+
+def terminate_child_processes() -> None:
+    """Terminates the running child processes started with run_child_process."""
+    with _child_processes_lock:
+        processes = list(_child_processes)
+    for process in processes:
+        process.terminate()
+
+
+def get_device_fingerprint() -> dict:
+    """Returns what the device capabilities depend on, without importing torch."""
+    spec = importlib.util.find_spec("torch")
+    torch_path = spec.origin if spec is not None else None
+    return {
+        "python": sys.executable,
+        "torch": torch_path,
+        "torch_mtime": os.path.getmtime(torch_path) if torch_path else None,
+        "cuda_visible_devices": os.environ.get("CUDA_VISIBLE_DEVICES"),
+    }
+
+
+def detect_device_capabilities() -> dict:
+    """Detects the CUDA devices with torch, a missing torch installation means no CUDA device."""
+    if importlib.util.find_spec("torch") is None:
+        return {"cuda": False, "devices": []}
+
+    with span("stage.detect_devices"):
+        import torch
+        if not torch.cuda.is_available():
+            return {"cuda": False, "devices": []}
+        devices = [torch.cuda.get_device_name(index) for index in range(torch.cuda.device_count())]
+        return {"cuda": True, "devices": devices}
+
+
+@functools.lru_cache(maxsize=None)
+def get_device_capabilities(cache_path: str = DEVICE_CACHE_PATH) -> dict:
+    """
+    Returns the device capabilities, detected once and cached on disk so later runs and subprocesses do not
+    have to import torch to find out whether a GPU is available.
+
+    Args:
+        cache_path (str, optional): The path to the cache file. Defaults to DEVICE_CACHE_PATH.
+
+    Returns:
+        dict: Whether "cuda" is available and the names of the CUDA "devices".
+    """
+    fingerprint = get_device_fingerprint()
+    try:
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        if cached["fingerprint"] == fingerprint:
+            return cached["capabilities"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    capabilities = detect_device_capabilities()
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        with open(cache_path, "w") as f:
+            json.dump({"fingerprint": fingerprint, "capabilities": capabilities}, f, indent=4)
+    except OSError as exc:
+        print(f"Error while caching device capabilities: {exc}")
+    return capabilities
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show the cached device capabilities and the modules of every pipeline stage."
+    )
+    parser.add_argument("--refresh", action="store_true", help="Detect the device capabilities again")
+    args = parser.parse_args()
+
+    if args.refresh and os.path.exists(DEVICE_CACHE_PATH):
+        os.remove(DEVICE_CACHE_PATH)
+    capabilities = get_device_capabilities()
+    print("CUDA:", "available" if capabilities["cuda"] else "not available")
+    for index, device in enumerate(capabilities["devices"]):
+        print(f"  Device {index}: {device}")
+    for stage, modules in STAGE_MODULES.items():
+        print(f"{stage:<18} {', '.join(modules)}")
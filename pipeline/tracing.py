@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import functools
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+TRACE_FILE_ENV = "PIPELINE_TRACE_FILE"
+
+_trace_file_lock = threading.Lock()
+
+
+def get_peak_rss_mb():
+    """Returns the peak resident set size of the current process in megabytes, or None if unknown."""
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+
+def start_trace(trace_path: str) -> None:
+    """
+    Starts collecting spans of the current process and of every child process started afterwards.
+
+    Spans are appended as JSON lines to the trace file, whose path is passed to child processes
+    (including Blender) through the PIPELINE_TRACE_FILE environment variable.
+
+    Args:
+        trace_path (str): The path to the file where spans are collected.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(trace_path)), exist_ok=True)
+    open(trace_path, "w").close()
+    os.environ[TRACE_FILE_ENV] = os.path.abspath(trace_path)
+
+
+def write_span(record: dict) -> None:
+    """Appends a span record to the trace file of the current run, if tracing is enabled."""
+    trace_path = os.environ.get(TRACE_FILE_ENV)
+    if not trace_path:
+        return
+    line = json.dumps(record) + "\n"
+    with _trace_file_lock:
+        with open(trace_path, "a") as f:
+            f.write(line)
+
+
+@contextlib.contextmanager
+def span(name: str, **args):
+    """
+    Measures wall time and CPU time of a code block and records them as a span, together with the peak RSS
+    of the process so far.
+
+    The CPU time is the time of the calling thread, so spans of concurrent threads do not count each
+    other's work, and work the block hands to other threads is not included. The peak RSS is a high-water
+    mark of the whole process and never decreases, it is not the memory used by the block.
+
+    Args:
+        name (str): The span name, e.g. "marigold.inference".
+        **args: Additional values stored with the span.
+    """
+    if not os.environ.get(TRACE_FILE_ENV):
+        yield
+        return
+
+    start_wall = time.time()
+    start_cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        wall_time = time.time() - start_wall
+        cpu_time = time.thread_time() - start_cpu
+        write_span({
+            "name": name,
+            "ph": "X",
+            "ts": int(start_wall * 1e6),
+            "dur": int(wall_time * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": dict(args, wall_time_s=wall_time, cpu_time_s=cpu_time,
+                         process_peak_rss_mb=get_peak_rss_mb()),
+        })
+
+
+def traced(name: str):
+    """Decorator recording every call of the decorated function as a span with the provided name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def load_spans(trace_path: str) -> list:
+    """Reads all span records collected in the trace file."""
+    with open(trace_path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def finish_trace(trace_path: str, output_path: str) -> None:
+    """
+    Stops collecting spans and converts them into a Chrome trace JSON file, which can be opened with
+    chrome://tracing or https://ui.perfetto.dev.
+
+    Args:
+        trace_path (str): The path to the file where spans were collected.
+        output_path (str): The path to the Chrome trace JSON file.
+    """
+    os.environ.pop(TRACE_FILE_ENV, None)
+    events = load_spans(trace_path)
+
+    # Name every process after the prefix of its first span (e.g. "marigold", "blender")
+    process_names = {}
+    for event in sorted(events, key=lambda event: event["ts"]):
+        process_names.setdefault(event["pid"], event["name"].split(".")[0])
+    for pid, process_name in process_names.items():
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": process_name}})
+
+    with open(output_path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)